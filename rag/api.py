@@ -3,8 +3,9 @@
 
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from contextlib import asynccontextmanager
-from typing import List
+from typing import List, Optional
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, Header, HTTPException
@@ -14,12 +15,15 @@ from pydantic import BaseModel
 from weaviate.exceptions import WeaviateConnectionError
 
 from google_drive_downloader import GoogleDriveDownloader
+from ingestion_jobs import IngestionJob, IngestionJobManager, JobLimitError
 from llm_wraper import LLMWrapper
-from log import log
+from log import capture, log
+from query_cache import query_cache
 from reranker import Reranker
 from rewriter import Rewriter
+from sync_worker import SyncWorker
 from utils import color_print
-from vector_store import VectorStore
+from vector_store import VectorStoreFactory
 
 
 class QueryRequest(BaseModel):
@@ -28,17 +32,52 @@ class QueryRequest(BaseModel):
     history: List[str]
     use_history: bool
     
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest]
+    k: int = 3
+    alpha: float = 0.55
+    autocut: bool = True
+    generate: bool = True  # False returns the retrieved chunks only
+
 class FolderIngestRequest(BaseModel):
     driveURL: str
 
+BATCH_MAX_QUERIES = 5000         # queries of one /query_batch request
+BATCH_REWRITE_CONCURRENCY = 8    # rewriting requests to the LLM in flight
+BATCH_GENERATE_CONCURRENCY = 4   # answer generations in flight
+
+def run_sync() -> dict:
+    # executed by the background sync worker, never concurrently
+    vector_store = connect_to_vector_store()
+    try:
+        gd_downloader = GoogleDriveDownloader()
+        return gd_downloader.sync_changes(vector_store)
+    finally:
+        vector_store.close()
+
+def run_ingestion(job: IngestionJob):
+    # executed by the ingestion job manager in a background thread
+    vector_store = connect_to_vector_store()
+    try:
+        gd_downloader = GoogleDriveDownloader()
+        gd_downloader.bulk_ingest(vector_store, job=job)
+    finally:
+        vector_store.close()
+
+sync_worker = SyncWorker(run_sync)
+ingestion_jobs = IngestionJobManager(run_ingestion)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     load_dotenv()
     gd_downloader = GoogleDriveDownloader()
     gd_downloader.initialize_changes_page_token()
+    sync_worker.start()
     channel_id, response_id = gd_downloader.start_changes_watch()
     yield
     gd_downloader.stop_changes_watch(channel_id, response_id)
+    sync_worker.stop()
+    ingestion_jobs.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -52,9 +91,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def server_timing(timings: dict) -> str:
+    # Server-Timing header (milliseconds), stage latencies of a streamed response are visible to the client
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+def rewrite(request: QueryRequest) -> str:
+    if request.use_history:
+        return Rewriter.rewrite_with_history(request.query, request.history)
+    return Rewriter.rewrite(request.query)
+
+def rewrite_or_original(request: QueryRequest) -> str:
+    # a failed rewrite of one query in a batch falls back to the original query
+    try:
+        return rewrite(request)
+    except Exception as e:
+        color_print(f"Rewriting of '{request.query}' failed ({type(e).__name__}: {e}), searching the original query.", color="red")
+        return request.query
+
 def connect_to_vector_store():
     try:
-        vector_store = VectorStore()
+        vector_store = VectorStoreFactory.get_store()
     except WeaviateConnectionError:
         # handle weaviate connection error
         raise HTTPException(status_code=500, detail="Failed to connect to VectorStore.")
@@ -70,12 +126,31 @@ def get_drive_url():
 def ingest_folder(request: FolderIngestRequest):
     gd_downloader = GoogleDriveDownloader()
     gd_downloader.save_url(request.driveURL)
-    vector_store = connect_to_vector_store()
 
-    gd_downloader.bulk_ingest(vector_store)
-    vector_store.close()
+    try:
+        job = ingestion_jobs.submit(request.driveURL)
+    except JobLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    return {"message": "Ingestion started.", "job_id": job.job_id}
+
+@app.get("/jobs")
+def list_jobs():
+    return {"jobs": [job.to_dict() for job in ingestion_jobs.list_jobs()]}
 
-    return {"message": "Ingestion started."}
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job.to_dict()
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = ingestion_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job.to_dict()
 
 @app.post("/delete_schema")
 def delete_schema():
@@ -89,6 +164,7 @@ def delete_schema():
 def query_endpoint(request: QueryRequest):
     print(f"Query: {request.query}, Rights: {request.rights}, Use History: {request.use_history}, History: {request.history}")
     timings = {}
+    received_at = time.time()
     start = time.perf_counter()
     overall_start = start
     
@@ -97,31 +173,33 @@ def query_endpoint(request: QueryRequest):
 
     # rewriting
     start = time.perf_counter()
-    if request.use_history:
-        rewritten_query = Rewriter.rewrite_with_history(request.query, request.history)
-    else:
-        rewritten_query = Rewriter.rewrite(request.query)
+    rewritten_query = rewrite(request)
     timings["rewrite_query"] = time.perf_counter() - start
 
     color_print(f"Rewritten query: {rewritten_query}", color="yellow")
     
     # hybrid search
     start = time.perf_counter()
+    # only chunk_id, text and score of the hits, the metadata is fetched for the chunks kept by the reranker
     if request.rights == "user":
-        chunks = vector_store.hybrid_search(rewritten_query, autocut=True, k=3, rights="user")
+        chunks = vector_store.hybrid_search_lean(rewritten_query, autocut=True, k=3, rights="user")
     else:
-        chunks = vector_store.hybrid_search(rewritten_query, autocut=True, k=3)
+        chunks = vector_store.hybrid_search_lean(rewritten_query, autocut=True, k=3)
     timings["hybrid_search"] = time.perf_counter() - start
         
     color_print(f"Hybrid search returned {len(chunks)} chunks.", color="yellow")
-        
-    vector_store.close()    
     
     # reranking, filtering
     start = time.perf_counter()
     reranked_chunks = Reranker.rerank(rewritten_query, chunks)
     timings["reranking"] = time.perf_counter() - start
 
+    start = time.perf_counter()
+    reranked_chunks = vector_store.hydrate(reranked_chunks)
+    timings["hydrate"] = time.perf_counter() - start
+
+    vector_store.close()
+
     color_print(f"Reranked chunks: {len(reranked_chunks)}", color="yellow")
     start = time.perf_counter()
 
@@ -150,11 +228,102 @@ def query_endpoint(request: QueryRequest):
                 "metadata": None
             }) + "\n"
             
+        timings["total"] = time.perf_counter() - overall_start  # including the streamed answer
         log(request.query, rewritten_query, chunks, reranked_chunks, "".join(response), timings=timings)
+        capture(
+            received_at, request.query, request.rights, request.use_history, request.history,
+            rewritten_query, chunks, reranked_chunks, "".join(response), timings
+        )
     
     color_print("Generating response...", color="yellow")
     
-    return StreamingResponse(stream(), media_type="application/json")
+    # retrieval stages are finished before streaming starts
+    return StreamingResponse(stream(), media_type="application/json", headers={"Server-Timing": server_timing(timings)})
+
+@app.post("/query_batch")
+def query_batch_endpoint(request: BatchQueryRequest):
+    # the /query pipeline for many queries: rewriting with bounded concurrency, one embedding and reranking batch,
+    # generation with bounded concurrency, one NDJSON line per query in the order of completion (index = position)
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUERIES} queries per batch.")
+    queries = request.queries
+    vector_store = connect_to_vector_store()
+
+    def stream():
+        timings = {}
+        received_at = time.time()
+        overall_start = time.perf_counter()
+        try:
+            # rewriting
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=BATCH_REWRITE_CONCURRENCY) as executor:
+                rewritten_queries = list(executor.map(rewrite_or_original, queries))
+            timings["rewrite_query"] = time.perf_counter() - start
+
+            # hybrid search, one batch per rights value (as in /query, only "user" restricts the search)
+            start = time.perf_counter()
+            searches = [None] * len(queries)
+            for restricted in {query.rights == "user" for query in queries}:
+                indices = [i for i, query in enumerate(queries) if (query.rights == "user") == restricted]
+                results = vector_store.hybrid_search_many(
+                    [rewritten_queries[i] for i in indices],
+                    rights="user" if restricted else None,
+                    k=request.k,
+                    alpha=request.alpha,
+                    autocut=request.autocut
+                )
+                for i, result in zip(indices, results):
+                    searches[i] = result
+            timings["hybrid_search"] = time.perf_counter() - start
+        finally:
+            vector_store.close()
+
+        # reranking, filtering
+        start = time.perf_counter()
+        reranked_lists = Reranker.rerank_many(rewritten_queries, [search.chunks for search in searches])
+        timings["reranking"] = time.perf_counter() - start
+        color_print(f"Batch of {len(queries)} queries retrieved and reranked, generating answers...", color="yellow")
+        llm_wrapper = LLMWrapper()
+
+        def generate(i: int) -> dict:
+            query = queries[i]
+            start = time.perf_counter()
+            response = ""
+            if request.generate:
+                llm_query = rewritten_queries[i] if query.use_history else query.query
+                response = "".join(llm_wrapper.get_stream_response(llm_query, reranked_lists[i]))
+            query_timings = {"hybrid_search": searches[i].seconds, "llm_query": time.perf_counter() - start}
+            log(query.query, rewritten_queries[i], searches[i].chunks, reranked_lists[i], response, timings=query_timings)
+            capture(
+                received_at, query.query, query.rights, query.use_history, query.history,
+                rewritten_queries[i], searches[i].chunks, reranked_lists[i], response, query_timings
+            )
+            return {
+                "index": i,
+                "query": query.query,
+                "rewritten_query": rewritten_queries[i],
+                "text": response if request.generate else None,
+                "metadata": {"chunks": [vars(chunk) for chunk in reranked_lists[i]]},
+                "timings": query_timings
+            }
+
+        # generate responses, each result is streamed when it is complete
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=BATCH_GENERATE_CONCURRENCY) as executor:
+            futures = {executor.submit(generate, i): i for i in range(len(queries))}
+            for future in as_completed(futures):
+                try:
+                    yield json.dumps(future.result()) + "\n"
+                except Exception as e:
+                    i = futures[future]
+                    yield json.dumps({"index": i, "query": queries[i].query, "error": f"{type(e).__name__}: {e}"}) + "\n"
+        timings["llm_query"] = time.perf_counter() - start
+        timings["total"] = time.perf_counter() - overall_start
+
+        # last line: stage timings of the whole batch
+        yield json.dumps({"index": None, "queries": len(queries), "timings": timings}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 @app.post("/webhook")
 async def receive_notification( 
@@ -168,11 +337,8 @@ async def receive_notification(
     print("========================\n")
     
     if x_goog_resource_state == "change":
-        vector_store = connect_to_vector_store()
-        
-        gd_downloader = GoogleDriveDownloader()
-        gd_downloader.sync_changes(vector_store)
-        vector_store.close()
+        # enqueue only, the sync runs in the background worker (bursts are debounced)
+        sync_worker.notify()
         
     return {"status": "success"} # ACK
     
@@ -182,19 +348,25 @@ def root():
 
 @app.get("/sync")
 def sync():
-    # manually trigger sync
-    vector_store = connect_to_vector_store()
-    
-    gd_downloader = GoogleDriveDownloader()
-    gd_downloader.sync_changes(vector_store)
-    vector_store.close()
+    # manually trigger sync (skips the debounce window)
+    sync_worker.notify(immediate=True)
     
-    return {"message": "Sync completed."}
+    return {"message": "Sync scheduled."}
+
+@app.get("/sync_status")
+def sync_status():
+    return sync_worker.metrics()
+
+@app.get("/cache_stats")
+def cache_stats():
+    # hit rate, size and index generation of the hybrid search result cache
+    return query_cache.metrics()
     
 @app.get("/filenames")
-def get_all_filenames():
+def get_all_filenames(offset: int = 0, limit: Optional[int] = None):
+    # file catalog sorted by name, chunk counts per file, paged with offset and limit
     vector_store = connect_to_vector_store()
     
-    filenames = vector_store.get_all_filenames()
+    files, total = vector_store.file_catalog(offset=offset, limit=limit)
     vector_store.close()
-    return {"filenames": filenames}
+    return {"filenames": [file["filename"] for file in files], "files": files, "total": total, "offset": offset, "limit": limit}
@@ -0,0 +1,127 @@
+# File: batch_writer.py - BatchWriter module (parallel batch inserts with failure accounting)
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import json
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+import numpy as np
+from tqdm import tqdm
+
+from utils import color_print
+
+
+@dataclass
+class BatchReport:
+    objects: int = 0
+    inserted: int = 0
+    failed: int = 0
+    retried: int = 0
+    batch_size: int = 0
+    seconds: float = 0.0
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def objects_per_second(self) -> float:
+        return self.inserted / self.seconds if self.seconds > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {**vars(self), "objects_per_second": self.objects_per_second}
+
+    def __str__(self):
+        return (
+            f"{self.inserted}/{self.objects} objects inserted in {self.seconds:.2f}s ({self.objects_per_second:.0f} objects/s), "
+            f"{self.failed} failed, {self.retried} retried, batch size {self.batch_size}"
+        )
+
+
+class BatchWriter:
+    MODE = "fixed"                      # fixed | rate_limit
+    BATCH_SIZE = 200                    # objects per request (fixed mode)
+    CONCURRENT_REQUESTS = 4             # gRPC requests in flight (fixed mode)
+    REQUESTS_PER_MINUTE = 600           # rate_limit mode
+    MAX_BATCH_BYTES = 8 * 1024 * 1024   # stay below the gRPC message limit (10 MB by default)
+    MAX_RETRIES = 3                     # rounds of re-sending failed objects
+
+    def __init__(
+        self,
+        collection,
+        mode: str = MODE,
+        batch_size: int = BATCH_SIZE,
+        concurrent_requests: int = CONCURRENT_REQUESTS,
+        requests_per_minute: int = REQUESTS_PER_MINUTE,
+        max_retries: int = MAX_RETRIES
+    ):
+        if mode not in ("fixed", "rate_limit"):
+            raise ValueError(f"Unknown batch mode '{mode}'")
+        self.collection = collection
+        self.mode = mode
+        self.batch_size = batch_size
+        self.concurrent_requests = concurrent_requests
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+
+    @staticmethod
+    def object_size(properties: dict, dimension: int) -> int:
+        # serialized size estimate: properties + float32 vector + protocol overhead
+        return len(json.dumps(properties).encode("utf-8")) + 4 * dimension + 256
+
+    def fit_batch_size(self, objects: List[dict], dimension: int) -> int:
+        # split oversize payloads: the largest object decides how many objects fit into one message
+        largest = max(self.object_size(properties, dimension) for properties in objects)
+        return max(1, min(self.batch_size, self.MAX_BATCH_BYTES // largest))
+
+    def _batch(self, batch_size: int):
+        if self.mode == "rate_limit":
+            return self.collection.batch.rate_limit(requests_per_minute=self.requests_per_minute)
+        return self.collection.batch.fixed_size(batch_size=batch_size, concurrent_requests=self.concurrent_requests)
+
+    def _write_once(self, indices: List[int], objects, vectors, uuids, batch_size, desc) -> dict:
+        # returns index -> error message of the objects that failed
+        with self._batch(batch_size) as batch:
+            for i in tqdm(indices, desc=desc, unit="chunks"):
+                batch.add_object(properties=objects[i], vector=vectors[i], uuid=uuids[i])
+
+        index_of = {str(uuids[i]): i for i in indices}
+        failed = {}
+        for error in self.collection.batch.failed_objects:
+            i = index_of.get(str(error.object_.uuid))
+            if i is not None:
+                failed[i] = error.message
+        return failed
+
+    def write(self, objects: List[dict], vectors: np.ndarray, uuids: List[str]) -> BatchReport:
+        '''objects are property dicts, vectors is a (len(objects) x dimension) array, uuids make the writes idempotent'''
+        report = BatchReport(objects=len(objects))
+        if not objects:
+            return report
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        batch_size = self.fit_batch_size(objects, vectors.shape[1])
+        report.batch_size = batch_size
+
+        start = time.perf_counter()
+        pending = list(range(len(objects)))
+        failed = {}
+        for attempt in range(self.max_retries + 1):
+            desc = "Inserting Batches" if attempt == 0 else f"Retrying Failed Objects ({attempt})"
+            failed = self._write_once(pending, objects, vectors, uuids, batch_size, desc)
+            if not failed:
+                break
+
+            messages = set(failed.values())
+            color_print(f"{len(failed)} objects failed: {'; '.join(list(messages)[:3])}", color="red")
+            if any("larger than max" in message or "ResourceExhausted" in message for message in messages):
+                # message size limit hit despite the estimate, halve the requests
+                batch_size = max(1, batch_size // 2)
+            if attempt < self.max_retries:
+                pending = sorted(failed)
+                report.retried += len(pending)
+
+        report.seconds = time.perf_counter() - start
+        report.failed = len(failed)
+        report.inserted = report.objects - report.failed
+        report.errors = sorted(set(failed.values()))
+        color_print(f"Batch insert: {report}", color="red" if report.failed else "green")
+        return report
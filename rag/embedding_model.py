@@ -1,21 +1,134 @@
 # File: embedding_model.py - EmbeddingModel modules with base abstract class and a Factory
 # Author: Adam Valík <xvalik05@stud.fit.vut.cz>
 
+import multiprocessing
 import os
+import random
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import List, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Tuple, Union
 
+import numpy as np
 from tqdm import tqdm
 
 
+class DimensionReduction:
+    '''
+    Reduced vectors of a smaller vector index: "pca" projects onto the principal components fitted on
+    the corpus (scripts/reduce_dimensions.py), "matryoshka" keeps the leading dimensions of a Matryoshka
+    trained model. Reduced vectors are L2-normalized, the full ones are kept for rescoring (vector_store.py).
+    '''
+    METHODS = ("pca", "matryoshka")
+
+    def __init__(self, method: str, dimension: int, path: Optional[str] = None):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown dimension reduction '{method}'")
+        self.method = method
+        self.dimension = dimension
+        self.path = path
+        self.mean = self.components = None
+        if method == "pca":
+            projection = np.load(path)
+            self.mean, self.components = projection["mean"], projection["components"][:dimension]
+            if self.components.shape[0] != dimension:
+                raise ValueError(f"Projection {path} has {self.components.shape[0]} components, {dimension} required")
+
+    @classmethod
+    def from_env(cls, model_name: str) -> Optional["DimensionReduction"]:
+        # EMBEDDING_REDUCTION=pca|matryoshka, EMBEDDING_DIMENSION, EMBEDDING_PROJECTION (fitted PCA, .npz)
+        method = os.getenv("EMBEDDING_REDUCTION")
+        if not method:
+            return None
+        dimension = int(os.getenv("EMBEDDING_DIMENSION", "256"))
+        return cls(method, dimension, os.getenv("EMBEDDING_PROJECTION") or cls.projection_path(model_name, dimension))
+
+    @staticmethod
+    def projection_path(model_name: str, dimension: int) -> str:
+        return os.path.join("projections", f"{model_name.replace('/', '_')}_{dimension}.npz")
+
+    @staticmethod
+    def fit_pca(vectors: np.ndarray, dimension: int, path: str) -> float:
+        '''fits the projection on the corpus vectors and saves it, returns the explained variance ratio'''
+        vectors = np.asarray(vectors, dtype=np.float64)
+        mean = vectors.mean(axis=0)
+        # eigenvectors of the covariance matrix (dimension x dimension), the corpus is not decomposed as a whole
+        covariance = np.cov(vectors - mean, rowvar=False)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1]
+        components = eigenvectors[:, order[:dimension]].T
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(path, mean=mean.astype(np.float32), components=components.astype(np.float32))
+        return float(eigenvalues[order[:dimension]].sum() / eigenvalues.sum())
+
+    def __call__(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[1] == self.dimension:
+            return vectors  # already reduced
+        if self.method == "pca":
+            reduced = (vectors - self.mean) @ self.components.T
+        else:
+            reduced = vectors[:, :self.dimension]
+        norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+        return np.ascontiguousarray(reduced / np.where(norms == 0, 1, norms), dtype=np.float32)
+
+
 class BaseEmbeddingModel(ABC):
+    reduction: Optional[DimensionReduction] = None
+
     @abstractmethod
-    def embed(self, texts: Union[str, List[str]]):
+    def embed(self, texts: Union[str, List[str]], full: bool = False):
+        '''full = vectors before the dimension reduction (rescoring)'''
         pass
 
+    def reduce(self, vectors: np.ndarray) -> np.ndarray:
+        # vectors of the index, reduced vectors are returned unchanged
+        return self.reduction(vectors) if self.reduction is not None else vectors
+
+    def close(self):
+        # release the resources held by the model (worker processes, connections)
+        pass
+
+# model of a worker process of the multi-process embedding (set by the pool initializer)
+_worker_model = None
+
+def _init_embedding_worker(model_name: str, num_threads: int):
+    # every worker process loads its own copy of the model and uses its share of the cores
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(num_threads)
+    _worker_model = SentenceTransformer(model_name)
+    _worker_model.half()
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    return _worker_model.encode(texts, batch_size=len(texts))
+
 class HuggingFaceEmbeddingModel(BaseEmbeddingModel):
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+    TOKEN_BUDGET = 16384  # padded tokens in one batch of the batched path (batch_size x longest member)
+
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        num_workers: Optional[int] = None,
+        num_threads: Optional[int] = None,
+        reduction: Optional[DimensionReduction] = None
+    ):
         self.model_name = model_name
+        # chunks and queries are embedded into the reduced space (EMBEDDING_REDUCTION), full vectors on request
+        self.reduction = reduction or DimensionReduction.from_env(model_name)
+        # worker processes of the batched path (bulk ingestion), queries always use the in-process model
+        self.num_workers = num_workers if num_workers is not None else int(os.getenv("EMBEDDING_WORKERS", "1"))
+        # torch threads per worker, the cores are split between the workers by default
+        threads = num_threads or int(os.getenv("EMBEDDING_THREADS", "0"))
+        self.num_threads = threads or max(1, (os.cpu_count() or 1) // self.num_workers)
+        self._pool = None
+        if threads and self.num_workers <= 1:
+            # the in-process model is the only worker, it gets the configured threads as well
+            import torch
+            torch.set_num_threads(threads)
         self.model = self._init_model()
         self.model.half() # speeds up the embeding process
         
@@ -24,7 +137,25 @@ class HuggingFaceEmbeddingModel(BaseEmbeddingModel):
         from sentence_transformers import SentenceTransformer
         return SentenceTransformer(self.model_name)
 
-    def embed(self, texts: Union[str, List[str]], batch_size: int = 0):
+    def get_pool(self):
+        # started lazily, spawn avoids forking a process with an initialized torch runtime
+        if self._pool is None:
+            ctx = multiprocessing.get_context("spawn")
+            self._pool = ctx.Pool(
+                self.num_workers,
+                initializer=_init_embedding_worker,
+                initargs=(self.model_name, self.num_threads)
+            )
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def embed(self, texts: Union[str, List[str]], batch_size: int = 0, bucketing: bool = True, full: bool = False) -> np.ndarray:
+        '''returns one contiguous float32 array (len(texts) x dimension), rows in the order of texts'''
         if isinstance(texts, str):
             texts = [texts]
 
@@ -33,39 +164,196 @@ class HuggingFaceEmbeddingModel(BaseEmbeddingModel):
                 print(f"Embedding {len(texts)} text chunks...")
             embeddings = self.model.encode(texts)
         else:
-            embeddings = []
             print(f"Embedding {len(texts)} text chunks in batches (batch_size: {batch_size})")
-            for i in tqdm(range(0, len(texts), batch_size), desc=f"Embedding Batches", unit="batch"):
-                batch = texts[i:i+batch_size]
-                batch_embeddings = self.model.encode(batch)
-                embeddings.extend(batch_embeddings)
+            if bucketing and texts:
+                batches = self.make_batches(self.token_lengths(texts), batch_size, self.TOKEN_BUDGET)
+            else:
+                # arrival order
+                batches = [np.arange(i, min(i + batch_size, len(texts))) for i in range(0, len(texts), batch_size)]
 
-        return embeddings
+            embeddings = np.empty((len(texts), self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+            if self.num_workers > 1:
+                # batches are distributed to the worker processes as they become free, imap keeps their order
+                results = self.get_pool().imap(_encode_in_worker, [[texts[i] for i in batch] for batch in batches])
+            else:
+                results = (self.model.encode([texts[i] for i in batch], batch_size=len(batch)) for batch in batches)
+
+            for batch, batch_embeddings in zip(batches, tqdm(results, total=len(batches), desc=f"Embedding Batches", unit="batch")):
+                # one forward pass per batch, results are scattered back to the original positions
+                embeddings[batch] = batch_embeddings
+
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        return embeddings if full else self.reduce(embeddings)
+
+    def token_lengths(self, texts: List[str]) -> np.ndarray:
+        # truncated the same way as in encode
+        encoded = self.model.tokenizer(texts, truncation=True, max_length=self.model.max_seq_length)
+        return np.array([len(ids) for ids in encoded["input_ids"]])
+
+    @staticmethod
+    def make_batches(lengths: np.ndarray, max_batch_size: int, token_budget: int) -> List[np.ndarray]:
+        # sort by token length so each batch is padded to a similar length, batch size adapts to the token budget
+        order = np.argsort(-lengths, kind="stable")
+        batches = []
+        start = 0
+        while start < len(order):
+            # the first member is the longest one, the whole batch is padded to its length
+            padded_length = max(int(lengths[order[start]]), 1)
+            size = max(1, min(max_batch_size, token_budget // padded_length))
+            batches.append(order[start:start + size])
+            start += size
+        return batches
+
+class TokenRateLimiter:
+    # token bucket shared by the concurrent requests (tokens per minute)
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        if self.capacity <= 0:
+            return
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
 
 class OpenAIEmbeddingModel(BaseEmbeddingModel):
-    def __init__(self, model_name: str = "text-embedding-3-small"):
+    # API limits
+    MAX_INPUTS_PER_REQUEST = 2048
+    MAX_TOKENS_PER_REQUEST = 300000
+    MAX_TOKENS_PER_INPUT = 8191
+    # client settings
+    MAX_CONCURRENCY = 4           # requests in flight
+    TOKENS_PER_MINUTE = 1000000   # TPM limit of the account (0 = no pacing)
+    MAX_RETRIES = 6
+    MAX_BACKOFF_SECONDS = 60
+
+    def __init__(
+        self,
+        model_name: str = "text-embedding-3-small",
+        base_url: Optional[str] = None,
+        max_concurrency: int = MAX_CONCURRENCY,
+        tokens_per_minute: int = TOKENS_PER_MINUTE
+    ):
         self.model_name = model_name
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = TokenRateLimiter(tokens_per_minute)
         self.client = self._init_client()
+        self.encoding = self._init_encoding()
 
     def _init_client(self):
-        # lazy import
+        # lazy import, retries are handled in _embed_request (OPENAI_BASE_URL is respected when base_url is None)
+        import openai
+        return openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=self.base_url, max_retries=0)
+
+    def _init_encoding(self):
+        # tiktoken is optional (requirements_eval), otherwise the token counts are estimated
+        try:
+            import tiktoken
+            return tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            return None
+
+    def prepare_inputs(self, texts: List[str]) -> Tuple[List[str], List[int]]:
+        # empty inputs are rejected by the API, too long inputs are truncated to the input limit
+        inputs = []
+        token_counts = []
+        for text in texts:
+            text = text if text.strip() else " "
+            if self.encoding is not None:
+                tokens = self.encoding.encode(text, disallowed_special=())
+                if len(tokens) > self.MAX_TOKENS_PER_INPUT:
+                    tokens = tokens[:self.MAX_TOKENS_PER_INPUT]
+                    text = self.encoding.decode(tokens)
+                token_counts.append(len(tokens))
+            else:
+                token_counts.append(len(text) // 3 + 1)
+            inputs.append(text)
+        return inputs, token_counts
+
+    @staticmethod
+    def make_batches(token_counts: List[int], max_inputs: int, max_tokens: int) -> List[List[int]]:
+        batches = []
+        current = []
+        current_tokens = 0
+        for i, tokens in enumerate(token_counts):
+            if current and (len(current) >= max_inputs or current_tokens + tokens > max_tokens):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _embed_request(self, inputs: List[str], tokens: int) -> List[List[float]]:
         import openai
-        return openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-    def embed(self, texts: Union[str, List[str]]):
+        for attempt in range(self.MAX_RETRIES + 1):
+            self.rate_limiter.acquire(tokens)
+            try:
+                response = self.client.embeddings.create(input=inputs, model=self.model_name)
+                # the API returns an index for each input, never rely on the order of data
+                embeddings = [None] * len(inputs)
+                for item in response.data:
+                    embeddings[item.index] = item.embedding
+                if any(embedding is None for embedding in embeddings):
+                    raise ValueError(f"Embeddings response is missing {embeddings.count(None)} of {len(inputs)} inputs.")
+                return embeddings
+            except (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError) as e:
+                if attempt == self.MAX_RETRIES:
+                    raise
+                backoff = self._retry_after(e)
+                if backoff is None:
+                    backoff = min(self.MAX_BACKOFF_SECONDS, 2 ** attempt) * (0.5 + random.random())
+                print(f"Embedding request failed ({type(e).__name__}), retrying in {backoff:.1f}s...")
+                time.sleep(backoff)
+
+    @staticmethod
+    def _retry_after(error) -> Optional[float]:
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        try:
+            return float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+
+    def embed(self, texts: Union[str, List[str]], batch_size: int = 0, full: bool = False) -> np.ndarray:
+        '''returns one contiguous float32 array (len(texts) x dimension), raises if any batch fails after retries'''
         if isinstance(texts, str):
             texts = [texts]
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
 
-        embeddings = []
+        inputs, token_counts = self.prepare_inputs(texts)
+        max_inputs = min(batch_size, self.MAX_INPUTS_PER_REQUEST) if batch_size > 0 else self.MAX_INPUTS_PER_REQUEST
+        batches = self.make_batches(token_counts, max_inputs, self.MAX_TOKENS_PER_REQUEST)
 
-        for text in tqdm(texts, desc="Embedding with OpenAI", unit="text"):
-            try:
-                response = self.client.embeddings.create(input=text, model=self.model_name)
-                embeddings.append(response.data[0].embedding)
-            except Exception as e:
-                print(f"Failed to generate embedding for text: {text[:50]}... - Error: {e}")
+        embeddings = [None] * len(texts)
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {
+                executor.submit(self._embed_request, [inputs[i] for i in batch], sum(token_counts[i] for i in batch)): batch
+                for batch in batches
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Embedding with OpenAI", unit="batch"):
+                for i, embedding in zip(futures[future], future.result()):
+                    embeddings[i] = embedding
 
-        return embeddings
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
 
 class EmbeddingModelFactory:
     @staticmethod
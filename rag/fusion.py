@@ -0,0 +1,167 @@
+# File: fusion.py - client-side hybrid fusion (Weaviate's relativeScoreFusion) and autocut
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+from chunk import Chunk
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# (object id, original score) of one result set, sorted by the score (descending)
+ResultSet = List[Tuple[str, float]]
+
+
+def normalize_scores(results: ResultSet) -> List[float]:
+    # min-max normalization of a result set, the best result gets 1.0 (a constant set gets 1.0, all zeros 0.0)
+    if not results:
+        return []
+    scores = [score for _, score in results]
+    max_score, min_score = max(scores), min(scores)
+    if max_score == min_score:
+        return [0.0 if max_score == 0 else 1.0] * len(scores)
+    return [(score - min_score) / (max_score - min_score) for score in scores]
+
+def relative_score_fusion(result_sets: List[ResultSet], weights: List[float], names: List[str]) -> List[Tuple[str, float, str]]:
+    '''
+    HybridFusion.RELATIVE_SCORE: every result set is min-max normalized, weighted and summed per object.
+    Hybrid search uses [keyword (bm25), vector] with weights [1 - alpha, alpha].
+    Returns (object id, fused score, explain score) sorted by the fused score.
+    '''
+    fused: Dict[str, float] = {}
+    explain: Dict[str, List[str]] = {}
+    for results, weight, name in zip(result_sets, weights, names):
+        for (object_id, score), normalized in zip(results, normalize_scores(results)):
+            fused[object_id] = fused.get(object_id, 0.0) + weight * normalized
+            # same wording as the explain score of Weaviate (VectorStore.format_explain_score parses it)
+            explain.setdefault(object_id, []).append(
+                f"(Result Set {name}) Document {object_id}: original score {score}, normalized score: {normalized}"
+            )
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return [(object_id, score, " - ".join(explain[object_id])) for object_id, score in ranked]
+
+def autocut(scores: List[float], cut_off: int) -> int:
+    '''
+    Number of results to keep: the scores are normalized to rise from 0 (first result) to 1 (last result)
+    and compared with a straight line, the list is cut before the cut_off-th local maximum of the
+    difference (a jump). Port of Weaviate's autocut (auto_limit).
+    '''
+    if len(scores) <= 1:
+        return len(scores)
+    span = scores[-1] - scores[0]
+    if span == 0:
+        return len(scores)
+
+    step = 1.0 / (len(scores) - 1)
+    diff = [(score - scores[0]) / span - i * step for i, score in enumerate(scores)]
+
+    extrema = 0
+    for i in range(1, len(diff) - 1):
+        if diff[i] > diff[i - 1] and diff[i] > diff[i + 1]:
+            extrema += 1
+            if extrema >= cut_off:
+                return i
+    return len(scores)
+
+# ----------------------------------------------------------------------------------------------------
+# vectorized variants for parameter sweeps: the candidate lists of a query are fetched once
+# (BaseVectorStore.fetch_candidates) and fused for many alpha values at once
+
+@dataclass
+class Candidates:
+    '''keyword (BM25) and vector result sets of one query with raw scores (NaN = not in the result set)'''
+    chunks: List[Chunk]          # union of the result sets, keyword results first (order of the fusion)
+    keyword_scores: np.ndarray   # BM25 scores
+    vector_scores: np.ndarray    # cosine similarities (1 - distance)
+
+    @staticmethod
+    def from_result_sets(keyword: List[Tuple[Chunk, float]], vector: List[Tuple[Chunk, float]]) -> "Candidates":
+        chunks: Dict[str, Chunk] = {}
+        for chunk, _ in keyword + vector:
+            chunks.setdefault(chunk.chunk_id, chunk)
+        position = {chunk_id: i for i, chunk_id in enumerate(chunks)}
+
+        keyword_scores = np.full(len(chunks), np.nan)
+        vector_scores = np.full(len(chunks), np.nan)
+        for chunk, score in keyword:
+            keyword_scores[position[chunk.chunk_id]] = score
+        for chunk, score in vector:
+            vector_scores[position[chunk.chunk_id]] = score
+        return Candidates(list(chunks.values()), keyword_scores, vector_scores)
+
+    def to_dict(self) -> dict:
+        return {
+            "chunks": [chunk.to_dict() for chunk in self.chunks],
+            "keyword_scores": [None if np.isnan(score) else float(score) for score in self.keyword_scores],
+            "vector_scores": [None if np.isnan(score) else float(score) for score in self.vector_scores]
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "Candidates":
+        return Candidates(
+            chunks=[Chunk(**chunk) for chunk in data["chunks"]],
+            keyword_scores=np.array([np.nan if score is None else score for score in data["keyword_scores"]], dtype=np.float64),
+            vector_scores=np.array([np.nan if score is None else score for score in data["vector_scores"]], dtype=np.float64)
+        )
+
+def normalize_set(scores: np.ndarray) -> np.ndarray:
+    # normalize_scores over the members of a result set (NaN stays NaN)
+    present = ~np.isnan(scores)
+    if not present.any():
+        return scores
+    max_score, min_score = scores[present].max(), scores[present].min()
+    if max_score == min_score:
+        return np.where(present, 0.0 if max_score == 0 else 1.0, np.nan)
+    return (scores - min_score) / (max_score - min_score)
+
+def fuse_many(candidates: Candidates, alphas: np.ndarray) -> np.ndarray:
+    '''
+    Fused scores (len(alphas) x candidates) of relative_score_fusion for every alpha. As in Weaviate, the keyword
+    search is not run for alpha 1 and the vector search for alpha 0, their candidates get -inf.
+    '''
+    alphas = np.asarray(alphas, dtype=np.float64)[:, None]
+    keyword, vector = normalize_set(candidates.keyword_scores), normalize_set(candidates.vector_scores)
+    fused = (1 - alphas) * np.nan_to_num(keyword) + alphas * np.nan_to_num(vector)
+
+    searched = ((alphas < 1) & ~np.isnan(keyword)) | ((alphas > 0) & ~np.isnan(vector))
+    return np.where(searched, fused, -np.inf)
+
+def rank_many(fused: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # candidate indices sorted by the fused score per row (ties keep the fusion order) and the sorted scores
+    order = np.argsort(-fused, axis=1, kind="stable")
+    return order, np.take_along_axis(fused, order, axis=1)
+
+def autocut_many(scores: np.ndarray, cut_off: int) -> np.ndarray:
+    '''autocut of every row of sorted scores (-inf padding at the end), returns the number of kept results per row'''
+    num_rows, n = scores.shape
+    counts = np.isfinite(scores).sum(axis=1)
+    if n == 0:
+        return counts
+
+    first = scores[:, :1]
+    last = np.take_along_axis(scores, np.maximum(counts - 1, 0)[:, None], axis=1)
+    positions = np.arange(n)
+    step = 1.0 / np.maximum(counts - 1, 1)[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        span = last - first  # NaN for empty rows
+        diff = (scores - first) / np.where(span == 0, 1, span) - positions * step
+
+    maxima = np.zeros((num_rows, n), dtype=bool)
+    maxima[:, 1:-1] = (diff[:, 1:-1] > diff[:, :-2]) & (diff[:, 1:-1] > diff[:, 2:])
+    maxima &= positions < (counts - 1)[:, None]
+    reached = np.cumsum(maxima, axis=1) >= cut_off
+
+    kept = np.where(reached.any(axis=1), reached.argmax(axis=1), counts)
+    return np.where((counts <= 1) | (span[:, 0] == 0), counts, kept)
+
+def hybrid_from_candidates(candidates: Candidates, alpha: float = 0.55, k: int = 5, autocut: bool = False) -> List[Chunk]:
+    # hybrid_search of the stores computed from the fetched candidates (scores set, explain scores are not)
+    fused = fuse_many(candidates, [alpha])
+    order, scores = rank_many(fused)
+    count = int(autocut_many(scores, k)[0]) if autocut else min(k, int(np.isfinite(scores).sum()))
+
+    chunks = []
+    for index, score in zip(order[0, :count], scores[0, :count]):
+        chunk = Chunk(**candidates.chunks[index].to_dict())
+        chunk.score = float(score)
+        chunks.append(chunk)
+    return chunks
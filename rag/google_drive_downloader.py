@@ -5,31 +5,61 @@ import io
 import json
 import os
 import re
+import threading
+import time
 import uuid
+from chunk import Chunk
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
 from dotenv import load_dotenv
+from google.auth.credentials import AnonymousCredentials
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 
 from changes_state import load_page_token, save_page_token
 from document_processor import DocumentProcessor
+from ingestion_jobs import IngestionJob
+from query_cache import bump_generation
 from utils import color_print
-from vector_store import VectorStore
+from vector_store import BaseVectorStore
 
 
 class GoogleDriveDownloader:
     CREDENTIALS_FILE = "credentials.json"
     ROOT_ID_FILE = "root_url.json"
+    FILES_PAGE_SIZE = 1000    # maximum allowed by the Drive API
+    CHANGES_PAGE_SIZE = 1000  # maximum allowed by the Drive API, larger pages coalesce more changes
+    INGEST_BUFFER_SIZE = 500  # chunks embedded and inserted together during bulk ingestion
+    SYNC_BATCH_SIZE = 16      # changes downloaded and processed together
+    SYNC_WORKERS = 4          # parallel downloads/partitioning within a batch
+
+    # folder-id -> rights cache shared by all instances
+    _folder_rights = {}
+    _folder_rights_lock = threading.Lock()
 
     def __init__(self):      
         self.file_cnt = 0  
-        # load Google Drive API credentials
-        self.creds = service_account.Credentials.from_service_account_file(
-            self.CREDENTIALS_FILE,
-            scopes=["https://www.googleapis.com/auth/drive"]
-        )
-        self.service = build("drive", "v3", credentials=self.creds)
+        # local Drive stand-in (load tests), e.g. http://127.0.0.1:8500/drive/v3/
+        self.api_endpoint = os.getenv("GOOGLE_DRIVE_API_ENDPOINT")
+        if self.api_endpoint:
+            self.creds = AnonymousCredentials()
+        else:
+            # load Google Drive API credentials
+            self.creds = service_account.Credentials.from_service_account_file(
+                self.CREDENTIALS_FILE,
+                scopes=["https://www.googleapis.com/auth/drive"]
+            )
+        self._local = threading.local()
+
+    @property
+    def service(self):
+        # googleapiclient (httplib2) is not thread-safe, every thread builds its own service object
+        if not hasattr(self._local, "service"):
+            client_options = {"api_endpoint": self.api_endpoint} if self.api_endpoint else None
+            self._local.service = build("drive", "v3", credentials=self.creds, client_options=client_options)
+        return self._local.service
         
     def save_url(self, drive_url: str):
         with open(self.ROOT_ID_FILE, "w") as f:
@@ -56,8 +86,19 @@ class GoogleDriveDownloader:
         
     def list_files_in_folder(self, folder_id):
         query = f"'{folder_id}' in parents and trashed=false"
-        results = self.service.files().list(q=query, fields="files(id, name, mimeType)").execute()
-        return results.get("files", [])
+        files = []
+        page_token = None
+        while True:
+            results = self.service.files().list(
+                q=query,
+                pageSize=self.FILES_PAGE_SIZE,
+                pageToken=page_token,
+                fields="nextPageToken, files(id, name, mimeType)"
+            ).execute()
+            files.extend(results.get("files", []))
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                return files
     
     def get_parent_folder_name(self, file_id):
         file = self.service.files().get(fileId=file_id, fields="parents").execute()
@@ -66,6 +107,28 @@ class GoogleDriveDownloader:
             parent_file = self.service.files().get(fileId=parent_id, fields="name").execute()
             return parent_file.get("name")
         return None
+
+    def get_folder_rights(self, folder_id: Optional[str]) -> str:
+        # rights are given by the name of the parent folder, resolved folders are cached (folder-id -> rights)
+        if not folder_id:
+            return ""
+        with GoogleDriveDownloader._folder_rights_lock:
+            if folder_id in GoogleDriveDownloader._folder_rights:
+                return GoogleDriveDownloader._folder_rights[folder_id]
+
+        folder = self.service.files().get(fileId=folder_id, fields="name").execute()
+        folder_name = folder.get("name")
+        rights = folder_name if folder_name in ("superior", "user") else ""
+
+        with GoogleDriveDownloader._folder_rights_lock:
+            GoogleDriveDownloader._folder_rights[folder_id] = rights
+        return rights
+
+    @staticmethod
+    def forget_folder(folder_id: str):
+        # folder was renamed, moved or removed
+        with GoogleDriveDownloader._folder_rights_lock:
+            GoogleDriveDownloader._folder_rights.pop(folder_id, None)
     
     # ----------------------------------------------------------------------------------------------------
     def download_file(self, file_id: str, file_name: str, folder_path: str):
@@ -131,56 +194,88 @@ class GoogleDriveDownloader:
         file_buffer.seek(0) # reset pointer
         return file_buffer.read()
                         
-    def ingest_folder(self, folder_id, parent_path, vector_store: VectorStore):
-        color_print(f"\nIngesting documents from directory: {parent_path}", color="blue")
+    def build_manifest(self, folder_id, parent_path) -> List[dict]:
+        # recursively list all files below the folder, the path determines the rights
+        manifest = []
         files = self.list_files_in_folder(folder_id)
 
         if not files:
             print(f"No files found in folder {folder_id}.")
-            return
 
-        buffer = []
         for file in files:
-            filename = file["name"]
-            file_id = file["id"]
-            mime_type = file["mimeType"]
-
-            # recursively download subfolder contents
-            if mime_type == "application/vnd.google-apps.folder":
-                subfolder_path = os.path.join(parent_path, filename)
-                print(f"Entering folder: {filename}")
-                self.ingest_folder(file_id, subfolder_path, vector_store)
-                print(f"Returning to folder: {parent_path}")
+            if file["mimeType"] == "application/vnd.google-apps.folder":
+                subfolder_path = os.path.join(parent_path, file["name"])
+                manifest.extend(self.build_manifest(file["id"], subfolder_path))
             else:
-                print(f"Downloading file: {filename}")
-                if vector_store.document_exists(file_id):
-                    # avoid duplicate ingestion
-                    color_print(f"Document {filename} already exists in the vector store. Skipping ingestion...", color="yellow")
-                else:
-                    bytes = self.download_file_in_memory(file_id)
-                    document_processor = DocumentProcessor(filename=filename, file=bytes, file_id=file_id)
-                    if "superior" in parent_path:
-                        document_processor.add_rights("superior")
-                    elif "user" in parent_path:
-                        document_processor.add_rights("user") 
-                    chunks = document_processor.process()
-                    if chunks:
-                        buffer.extend(chunks)
-        
-        if buffer:
-            vector_store.insert_chunks_batch(buffer)
+                manifest.append({"id": file["id"], "name": file["name"], "mimeType": file["mimeType"], "path": parent_path})
+        return manifest
+
+    @staticmethod
+    def insert_buffer(chunks: List[Chunk], vector_store: BaseVectorStore, job: IngestionJob):
+        # full vectors, a store with reduced embeddings keeps them for rescoring
+        embeddings = vector_store.embedding_model.embed([chunk.text for chunk in chunks], batch_size=100, full=True)
+        job.chunks_embedded += len(chunks)
+        report = vector_store.insert_chunks_batch(chunks, embeddings=embeddings)
+        job.chunks_inserted += report.inserted
+        if report.failed:
+            job.add_error(f"{report.failed} chunks failed to insert: {'; '.join(report.errors[:3])}")
+
+    def bulk_ingest(self, vector_store: BaseVectorStore, job: Optional[IngestionJob] = None):
+        job = job or IngestionJob(drive_url=self.get_url() or "")
 
-    def bulk_ingest(self, vector_store: VectorStore):
         # get the root folder ID
-        root_folder_id = self.get_root_id()
-        
+        root_folder_id = self.extract_folder_id(job.drive_url) if job.drive_url else None
         if not root_folder_id:
             color_print("Failed to obtain root folder ID. Provide URL of root folder.", "red")
-            return
+            raise ValueError("Failed to obtain root folder ID.")
                 
         print(f"Starting download for folder: {root_folder_id}")
         self.file_cnt = 0
-        self.ingest_folder(root_folder_id, "root", vector_store)
+        manifest = self.build_manifest(root_folder_id, "root")
+        job.files_discovered = len(manifest)
+        color_print(f"Discovered {len(manifest)} files in the folder tree", color="blue")
+
+        buffer = []
+        # already ingested files of the manifest, checked in bulk
+        existing = vector_store.existing_documents([file["id"] for file in manifest])
+        try:
+            for file in manifest:
+                job.check_cancelled()
+                filename = file["name"]
+                file_id = file["id"]
+
+                if file_id in existing:
+                    # avoid duplicate ingestion
+                    color_print(f"Document {filename} already exists in the vector store. Skipping ingestion...", color="yellow")
+                    job.files_skipped += 1
+                    continue
+
+                try:
+                    print(f"Downloading file: {filename}")
+                    file_bytes = self.download_file_in_memory(file_id)
+                    job.files_downloaded += 1
+
+                    document_processor = DocumentProcessor(filename=filename, file=file_bytes, file_id=file_id)
+                    if "superior" in file["path"]:
+                        document_processor.add_rights("superior")
+                    elif "user" in file["path"]:
+                        document_processor.add_rights("user")
+                    chunks = document_processor.process()
+                    job.files_partitioned += 1
+                except Exception as e:
+                    job.files_failed += 1
+                    job.add_error(f"Failed to ingest {filename}: {type(e).__name__}: {e}")
+                    continue
+
+                buffer.extend(chunks)
+                if len(buffer) >= self.INGEST_BUFFER_SIZE:
+                    pending, buffer = buffer, []
+                    self.insert_buffer(pending, vector_store, job)
+        finally:
+            # chunks of already processed files are inserted even if the job was cancelled
+            if buffer:
+                self.insert_buffer(buffer, vector_store, job)
+
         color_print(f"Downloaded {self.file_cnt} files and ingested them to the vector database")
 
     # ----------------------------------------------------------------------------------------------------
@@ -218,26 +313,42 @@ class GoogleDriveDownloader:
         self.service.channels().stop(body=body).execute()
         color_print("[Changes] Watch stopped.", "yellow")
 
-    def sync_changes(self, vector_store: VectorStore):
+    def sync_changes(self, vector_store: BaseVectorStore) -> dict:
         # page token tells where last sync ended
         page_token = load_page_token()
         if not page_token:
             color_print("[Changes] No page token found. Initializing...", "red")
             self.initialize_changes_page_token()
+            page_token = load_page_token()
 
         next_page_token = page_token
+        stats = {"changes": 0, "coalesced": 0, "files": 0, "deleted_files": 0, "failed": 0, "chunks": 0, "failed_chunks": 0, "deleted_objects": 0}
+        start = time.perf_counter()
 
         while True:
             # get a page of changes
             response = self.service.changes().list(
                 pageToken=next_page_token,
-                fields="changes(fileId, file(name, mimeType, trashed)), nextPageToken, newStartPageToken"
+                pageSize=self.CHANGES_PAGE_SIZE,
+                fields="changes(fileId, file(name, mimeType, trashed, parents)), nextPageToken, newStartPageToken"
             ).execute()
 
             changes = response.get("changes", [])
-            for change in changes:
-                # handle each change
-                self.handle_change(change, vector_store)
+            change_set = self.coalesce_changes(changes)
+            stats["changes"] += len(changes)
+            stats["coalesced"] += len(changes) - len(change_set)
+
+            # apply the whole page at once
+            page_stats = self.apply_changes(change_set, vector_store)
+            for key, value in page_stats.items():
+                stats[key] += value
+
+            if page_stats["failed"]:
+                # the token stays at this page, the next sync lists it again and retries the failed files
+                # (the applied changes of the page are applied once more, which is idempotent)
+                save_page_token(page_token)
+                color_print(f"[Changes] {page_stats['failed']} files failed, the page will be synced again.", "red")
+                break
 
             # check if there are more pages of changes
             next_page_token = response.get("nextPageToken")
@@ -254,66 +365,124 @@ class GoogleDriveDownloader:
             # update page token for the next iteration
             page_token = next_page_token
             save_page_token(page_token)
-            
-    def handle_change(self, change: dict, vector_store: VectorStore):
+
+        elapsed = time.perf_counter() - start
+        stats["seconds"] = elapsed
+        stats["files_per_second"] = stats["files"] / elapsed if elapsed > 0 else 0.0
+        stats["chunks_per_second"] = stats["chunks"] / elapsed if elapsed > 0 else 0.0
+        color_print(
+            f"[Changes] Synced {stats['files']} files ({stats['chunks']} chunks), removed {stats['deleted_files']} files "
+            f"in {elapsed:.2f}s: {stats['files_per_second']:.2f} files/s, {stats['chunks_per_second']:.2f} chunks/s",
+            color="blue"
+        )
+        return stats
+
+    @staticmethod
+    def coalesce_changes(changes: List[dict]) -> List[dict]:
+        # keep only the latest change for each file (changes are ordered oldest to newest)
+        latest = {}
+        for change in changes:
+            file_id = change.get("fileId")
+            latest.pop(file_id, None)
+            latest[file_id] = change
+        return list(latest.values())
+
+    def process_change(self, change: dict) -> Tuple[Optional[List[Chunk]], bool]:
+        # download and chunk an added or modified file, runs in a worker thread (no vector store access)
+        file_obj = change["file"]
+        try:
+            file_bytes = self.download_file_in_memory(change["fileId"])
+            doc_processor = DocumentProcessor(
+                filename=file_obj["name"],
+                file=file_bytes,
+                file_id=change["fileId"]
+            )
+            return doc_processor.process(), True
+        except Exception as e:
+            color_print(f"[Changes] Failed to process file {file_obj['name']}: {e}", "red")
+            return None, False
+
+    def apply_changes(self, changes: List[dict], vector_store: BaseVectorStore) -> dict:
         """
+        changes (one per file):
         {
             "fileId": "abc123",
             "file": {
                 "name": "report.pdf",
                 "mimeType": "application/pdf",
-                "trashed": false
+                "trashed": false,
+                "parents": ["folder123"]
             }
         }
         """
-        file_id = change.get("fileId")
-        file_obj = change.get("file")
-
-        if not file_obj:
-            # file was removed, delete from DB
-            vector_store.delete_document(file_id)
-            color_print(f"[Changes] File {file_id} was removed (no file object).", "yellow")
-            return
-
-        is_trashed = file_obj.get("trashed", False)
-        if is_trashed:
-            # file was moved to trash, delete from DB
-            vector_store.delete_document(file_id)
-            color_print(f"[Changes] File {file_obj['name']} is trashed. Removed from DB.", "yellow")
-            return
-
-        # added or modified
-        filename = file_obj["name"]
-        mime_type = file_obj["mimeType"]
-
-        rights = ""
-        updated = False
-        
-        if vector_store.document_exists(file_id):
-            # update existing document (remove to re-ingest)
-            updated = True
-            rights = vector_store.get_rights(file_id)
-            vector_store.delete_document(file_id)
-
-        # ingest the file
-        if mime_type != "application/vnd.google-apps.folder":
-            file_bytes = self.download_file_in_memory(file_id)
-            doc_processor = DocumentProcessor(
-                filename=filename,
-                file=file_bytes,
-                file_id=file_id
-            )
-            if rights:
-                doc_processor.add_rights(rights)
+        stats = {"files": 0, "deleted_files": 0, "failed": 0, "chunks": 0, "failed_chunks": 0, "deleted_objects": 0}
+        removed_ids = []
+        upserts = []
+
+        for change in changes:
+            file_id = change.get("fileId")
+            file_obj = change.get("file")
+
+            if not file_obj or file_obj.get("trashed", False):
+                # file was removed or moved to trash, delete from DB
+                removed_ids.append(file_id)
+            elif file_obj["mimeType"] == "application/vnd.google-apps.folder":
+                # folder itself is not ingested, but its cached rights may be stale now
+                self.forget_folder(file_id)
             else:
-                parent_folder_name = self.get_parent_folder_name(file_id)
-                if parent_folder_name == "superior":
-                    doc_processor.add_rights("superior")
-                elif parent_folder_name == "user":
-                    doc_processor.add_rights("user")
-            # process
-            chunks = doc_processor.process()
-            # insert into vector store
-            vector_store.insert_chunks(chunks)  
-            color_print(f"[Changes] File {filename} {'updated' if updated else 'created'} in DB.", "green")
-
+                # added or modified
+                upserts.append(change)
+
+        # rights of the already ingested files (one round trip), updated files keep their rights
+        existing_rights = vector_store.rights_for([change["fileId"] for change in upserts])
+
+        replaced_ids = []
+        new_chunks = []
+        for i in range(0, len(upserts), self.SYNC_BATCH_SIZE):
+            batch = upserts[i:i + self.SYNC_BATCH_SIZE]
+            # download and process the files in parallel
+            with ThreadPoolExecutor(max_workers=self.SYNC_WORKERS) as executor:
+                processed = list(executor.map(self.process_change, batch))
+
+            for change, (chunks, ok) in zip(batch, processed):
+                file_id = change["fileId"]
+                file_obj = change["file"]
+                if not ok:
+                    # keep the previous version in the DB
+                    stats["failed"] += 1
+                    continue
+
+                updated = file_id in existing_rights
+                rights = existing_rights.get(file_id)
+                if not rights:
+                    rights = self.get_folder_rights((file_obj.get("parents") or [None])[0])
+                for chunk in chunks:
+                    chunk.rights = rights
+
+                replaced_ids.append(file_id)
+                new_chunks.extend(chunks)
+                stats["files"] += 1
+                color_print(f"[Changes] File {file_obj['name']} {'updated' if updated else 'created'} ({len(chunks)} chunks).", "green")
+
+        # remove deleted and replaced documents in one filtered delete
+        affected_ids = [file_id for file_id in removed_ids if file_id] + replaced_ids
+        if affected_ids:
+            stats["deleted_objects"] = vector_store.delete_documents(affected_ids).deleted
+        stats["deleted_files"] = len(removed_ids)
+        if removed_ids:
+            color_print(f"[Changes] {len(removed_ids)} removed or trashed files deleted from DB.", "yellow")
+
+        # insert all new chunks through one batch
+        report = vector_store.insert_chunks_batch(new_chunks)
+        stats["chunks"] = report.inserted
+        stats["failed_chunks"] = report.failed
+
+        # cached search results of the previous index state are stale (the store writes bump it as well),
+        # a sync without any change keeps them
+        if affected_ids or new_chunks:
+            bump_generation()
+        return stats
+
+    def handle_change(self, change: dict, vector_store: BaseVectorStore):
+        # single change (same path as the batched sync)
+        self.apply_changes([change], vector_store)
@@ -0,0 +1,167 @@
+# File: ingestion_jobs.py - Background ingestion jobs with progress tracking
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from utils import color_print
+
+
+class JobLimitError(Exception):
+    pass
+
+class JobCancelledError(Exception):
+    pass
+
+
+@dataclass
+class IngestionJob:
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    drive_url: str = ""
+    status: str = "queued"  # queued | running | completed | failed | cancelled
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    files_discovered: int = 0
+    files_skipped: int = 0
+    files_downloaded: int = 0
+    files_partitioned: int = 0
+    files_failed: int = 0
+    chunks_embedded: int = 0
+    chunks_inserted: int = 0
+    errors: List[str] = field(default_factory=list)
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        # called by the ingestion between files
+        if self.cancelled():
+            raise JobCancelledError(f"Job {self.job_id} was cancelled.")
+
+    def add_error(self, error: str):
+        color_print(f"[Job {self.job_id[:8]}] {error}", color="red")
+        self.errors.append(error)
+
+    def to_dict(self) -> dict:
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        # failed files are processed as well, they are not remaining work
+        files_done = self.files_partitioned + self.files_skipped + self.files_failed
+        files_per_second = files_done / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.files_discovered - files_done, 0)
+
+        eta = None
+        if self.status == "running" and files_per_second > 0:
+            eta = remaining / files_per_second
+
+        return {
+            "job_id": self.job_id,
+            "drive_url": self.drive_url,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": elapsed,
+            "files_discovered": self.files_discovered,
+            "files_skipped": self.files_skipped,
+            "files_downloaded": self.files_downloaded,
+            "files_partitioned": self.files_partitioned,
+            "files_failed": self.files_failed,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_inserted": self.chunks_inserted,
+            "files_per_second": files_per_second,
+            "chunks_per_second": self.chunks_inserted / elapsed if elapsed > 0 else 0.0,
+            "eta_seconds": eta,
+            "errors": self.errors,
+        }
+
+
+class IngestionJobManager:
+    MAX_CONCURRENT_JOBS = 1   # running jobs, the rest waits in the queue
+    MAX_QUEUED_JOBS = 10      # jobs waiting to run
+    MAX_FINISHED_JOBS = 100   # finished jobs kept for the progress API
+
+    def __init__(
+        self,
+        run_fn: Callable[[IngestionJob], None],
+        max_concurrent_jobs: int = MAX_CONCURRENT_JOBS,
+        max_queued_jobs: int = MAX_QUEUED_JOBS
+    ):
+        '''run_fn performs the ingestion and reports the progress into the given job'''
+        self.run_fn = run_fn
+        self.max_queued_jobs = max_queued_jobs
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_jobs, thread_name_prefix="ingestion-job")
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, drive_url: str) -> IngestionJob:
+        with self._lock:
+            queued = sum(1 for job in self.jobs.values() if job.status == "queued")
+            if queued >= self.max_queued_jobs:
+                raise JobLimitError(f"Too many queued ingestion jobs ({queued}).")
+            job = IngestionJob(drive_url=drive_url)
+            self.jobs[job.job_id] = job
+            self._evict_finished()
+
+        self.executor.submit(self._run, job)
+        color_print(f"[Job {job.job_id[:8]}] Ingestion job queued for {drive_url}", color="blue")
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> List[IngestionJob]:
+        with self._lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[IngestionJob]:
+        job = self.get(job_id)
+        if job and job.status in ("queued", "running"):
+            job.cancel()
+        return job
+
+    def shutdown(self):
+        # cancel everything and wait for the running jobs to stop at the next file boundary
+        for job in self.list_jobs():
+            job.cancel()
+        self.executor.shutdown(wait=True)
+
+    def _run(self, job: IngestionJob):
+        if job.cancelled():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            return
+
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            self.run_fn(job)
+            job.status = "completed"
+        except JobCancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            job.add_error(f"{type(e).__name__}: {e}")
+            job.status = "failed"
+        job.finished_at = time.time()
+
+        color_print(
+            f"[Job {job.job_id[:8]}] Ingestion {job.status}: {job.files_partitioned} files, "
+            f"{job.chunks_inserted} chunks in {job.finished_at - job.started_at:.2f}s",
+            color="green" if job.status == "completed" else "yellow"
+        )
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(len(finished) - self.MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job_id]
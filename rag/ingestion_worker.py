@@ -0,0 +1,127 @@
+# File: ingestion_worker.py - Ingestion worker consuming file-level tasks from the shared task queue
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import os
+import socket
+import time
+import uuid
+from chunk import Chunk
+from typing import List, Optional
+
+from document_processor import DocumentProcessor
+from task_queue import Task, TaskQueue
+from utils import color_print
+from vector_store import BaseVectorStore, VectorStoreFactory
+
+
+def file_task(file_id: str, filename: str, path: str, source: str = "drive") -> dict:
+    '''
+    payload of one file-level task
+    source "drive": file_id is a Google Drive file id, path is the folder path in the Drive (rights)
+    source "local": filename is a path on a disk shared by the workers
+    '''
+    return {"file_id": file_id, "filename": filename, "path": path, "source": source}
+
+
+class IngestionWorker:
+    BATCH_FILES = 8     # files leased at once, their chunks are embedded and inserted together
+    IDLE_SLEEP = 2.0    # seconds to wait when the queue has no available task
+
+    def __init__(
+        self,
+        queue: TaskQueue,
+        worker_id: Optional[str] = None,
+        batch_files: int = BATCH_FILES,
+        exit_when_drained: bool = False
+    ):
+        self.queue = queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.batch_files = batch_files
+        self.exit_when_drained = exit_when_drained
+        self.downloader = None
+        self.files_done = 0
+        self.chunks_done = 0
+
+    def get_downloader(self):
+        # lazy, local-only workers do not need Google Drive credentials
+        if self.downloader is None:
+            from google_drive_downloader import GoogleDriveDownloader
+            self.downloader = GoogleDriveDownloader()
+        return self.downloader
+
+    def load_chunks(self, payload: dict) -> List[Chunk]:
+        if payload["source"] == "local":
+            document_processor = DocumentProcessor(filename=payload["filename"])
+        else:
+            file_bytes = self.get_downloader().download_file_in_memory(payload["file_id"])
+            document_processor = DocumentProcessor(filename=payload["filename"], file=file_bytes, file_id=payload["file_id"])
+
+        if "superior" in payload["path"]:
+            document_processor.add_rights("superior")
+        elif "user" in payload["path"]:
+            document_processor.add_rights("user")
+        return document_processor.process()
+
+    def process(self, tasks: List[Task], vector_store: BaseVectorStore):
+        processed = []
+        for task in tasks:
+            try:
+                processed.append((task, self.load_chunks(task.payload)))
+            except Exception as e:
+                color_print(f"[Worker {self.worker_id}] Failed to process {task.task_id}: {e}", color="red")
+                self.queue.fail(task, self.worker_id, f"{type(e).__name__}: {e}")
+
+        if not processed:
+            return
+        self.queue.extend_lease([task.task_id for task, _ in processed], self.worker_id)
+
+        chunks = [chunk for _, file_chunks in processed for chunk in file_chunks]
+        try:
+            # object ids are derived from chunk_id, a retried task overwrites its partially inserted chunks
+            report = vector_store.insert_chunks_batch(chunks)
+            if report.failed:
+                raise RuntimeError(f"{report.failed} chunks failed to insert: {'; '.join(report.errors[:3])}")
+        except Exception as e:
+            color_print(f"[Worker {self.worker_id}] Failed to insert {len(chunks)} chunks: {e}", color="red")
+            for task, _ in processed:
+                self.queue.fail(task, self.worker_id, f"{type(e).__name__}: {e}")
+            return
+
+        self.queue.complete([task.task_id for task, _ in processed], self.worker_id)
+        self.files_done += len(processed)
+        self.chunks_done += len(chunks)
+
+    def run(self, vector_store: Optional[BaseVectorStore] = None):
+        own_store = vector_store is None
+        vector_store = vector_store or VectorStoreFactory.get_store()
+        color_print(f"[Worker {self.worker_id}] Started, queue: {self.queue.path}", color="blue")
+        start = time.perf_counter()
+
+        try:
+            while True:
+                tasks = self.queue.lease(self.worker_id, self.batch_files)
+                if not tasks:
+                    if self.exit_when_drained and self.queue.is_drained():
+                        break
+                    time.sleep(self.IDLE_SLEEP)
+                    continue
+                self.process(tasks, vector_store)
+        finally:
+            if own_store:
+                vector_store.close()
+
+        elapsed = time.perf_counter() - start
+        color_print(
+            f"[Worker {self.worker_id}] Finished {self.files_done} files ({self.chunks_done} chunks) "
+            f"in {elapsed:.2f}s: {self.files_done / elapsed:.2f} docs/s",
+            color="green"
+        )
+
+
+def run_worker(queue_path: str, worker_id: Optional[str] = None, exit_when_drained: bool = False, torch_threads: int = 0):
+    # entry point of a worker process
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+    worker = IngestionWorker(TaskQueue(queue_path), worker_id=worker_id, exit_when_drained=exit_when_drained)
+    worker.run()
@@ -3,10 +3,12 @@
 
 import os
 from chunk import Chunk
-from typing import List
+from typing import List, Optional
 
 import openai
 
+from utils import add_usage
+
 
 class LLMWrapper:
     def __init__(self):
@@ -73,16 +75,20 @@ class LLMWrapper:
         except openai.APIStatusError as e:
             yield f"[ERROR] OpenAI API Error: {e.status_code} - {e.response}"
             
-    def get_response(self, query: str, chunks: List[Chunk], model: str = "gpt-4o", temperature: float = 0.2):
-        # used for evaluation
-        messages = LLMWrapper.construct_messages(query, chunks)
-        
+    @staticmethod
+    def count_tokens(messages: List[dict], model: str = "gpt-4o") -> int:
+        # tokens of the message contents (evaluation, requirements_eval.txt)
         import tiktoken
         if model == "gpt-4.1":
             enc = tiktoken.get_encoding("o200k_base")
         else:
             enc = tiktoken.encoding_for_model(model)
-        num_tokens = len(enc.encode(messages[0]["content"])) + len(enc.encode(messages[1]["content"]))
+        return sum(len(enc.encode(message["content"])) for message in messages)
+
+    def get_response(self, query: str, chunks: List[Chunk], model: str = "gpt-4o", temperature: float = 0.2, usage: Optional[dict] = None):
+        # used for evaluation
+        messages = LLMWrapper.construct_messages(query, chunks)
+        num_tokens = LLMWrapper.count_tokens(messages, model)
 
         try:
             response = self.client.chat.completions.create(
@@ -90,6 +96,7 @@ class LLMWrapper:
                 messages=messages,
                 temperature=temperature,
             )
+            add_usage(usage, response)
             
             return response.choices[0].message.content, num_tokens
         
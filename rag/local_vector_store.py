@@ -0,0 +1,440 @@
+# File: local_vector_store.py - in-process vector store (memory-mapped vectors, BM25, relative score fusion)
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+from chunk import Chunk
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+import fusion
+from batch_writer import BatchReport
+from embedding_model import BaseEmbeddingModel
+from fusion import Candidates
+from utils import color_print
+from vector_store import BaseVectorStore, DeleteReport
+
+# same tokenization as the "word" tokenization of Weaviate (alphanumeric runs, lowercased)
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+# stopwords removed from BM25 queries (Weaviate's default "en" preset)
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it", "no",
+    "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these", "they", "this",
+    "to", "was", "will", "with"
+}
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    '''BM25F inverted index over all text properties of the chunks (k1 and b as the Weaviate defaults)'''
+    K1 = 1.2
+    B = 0.75
+    PROPERTIES = ["chunk_id", "file_id", "text", "filename", "file_directory", "title", "page", "rights"]
+    FIELD_PROPERTIES = {"file_id"}  # "field" tokenization in Weaviate, the whole value is one token
+
+    @classmethod
+    def tokens(cls, name: str, value) -> List[str]:
+        value = str(value)
+        if name in cls.FIELD_PROPERTIES:
+            return [value.strip()] if value.strip() else []
+        return tokenize(value)
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, np.ndarray]] = {}  # term -> row -> term frequency per property
+        self.lengths: Dict[int, np.ndarray] = {}              # row -> number of tokens per property
+        self.total_lengths = np.zeros(len(self.PROPERTIES), dtype=np.float64)
+
+    def add(self, row: int, properties: dict):
+        lengths = np.zeros(len(self.PROPERTIES), dtype=np.float32)
+        frequencies: Dict[str, np.ndarray] = {}
+        for p, name in enumerate(self.PROPERTIES):
+            tokens = self.tokens(name, properties.get(name, ""))
+            lengths[p] = len(tokens)
+            for token in tokens:
+                frequencies.setdefault(token, np.zeros(len(self.PROPERTIES), dtype=np.float32))[p] += 1
+
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[row] = frequency
+        self.lengths[row] = lengths
+        self.total_lengths += lengths
+
+    def remove(self, row: int, properties: dict):
+        for term in {token for name in self.PROPERTIES for token in self.tokens(name, properties.get(name, ""))}:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(row, None)
+                if not posting:
+                    del self.postings[term]
+        self.total_lengths -= self.lengths.pop(row)
+
+    def search(self, query: str, num_rows: int, allowed: Optional[np.ndarray], limit: int) -> List[Tuple[int, float]]:
+        # (row, score) of the best matching rows, allowed is a boolean mask of the rows passing the filter
+        num_docs = len(self.lengths)
+        # the query is one token of the field-tokenized properties
+        terms = [term for term in dict.fromkeys(tokenize(query)) if term not in STOPWORDS] + [query.strip()]
+        terms = [term for term in dict.fromkeys(terms) if term in self.postings]
+        if not num_docs or not terms:
+            return []
+
+        average_lengths = np.maximum(self.total_lengths / num_docs, 1e-9)
+        scores = np.zeros(num_rows, dtype=np.float64)
+        for term in terms:
+            posting = self.postings[term]
+            rows = np.fromiter(posting.keys(), dtype=np.int64, count=len(posting))
+            frequencies = np.stack(list(posting.values()))
+            lengths = np.stack([self.lengths[row] for row in posting])
+
+            idf = math.log(1 + (num_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+            # BM25F: length-normalized frequencies are summed over the properties before saturation
+            frequency = (frequencies / (1 - self.B + self.B * lengths / average_lengths)).sum(axis=1)
+            np.add.at(scores, rows, idf * frequency * (self.K1 + 1) / (frequency + self.K1))
+
+        if allowed is not None:
+            scores[~allowed] = 0.0
+        return top_k(scores, limit, minimum=0.0)
+
+
+def top_k(scores: np.ndarray, k: int, minimum: float = -np.inf) -> List[Tuple[int, float]]:
+    # (row, score) of the k highest scores above minimum, sorted by the score
+    candidates = np.flatnonzero(scores > minimum)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+    candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return [(int(row), float(scores[row])) for row in candidates]
+
+
+class LocalIndex:
+    '''
+    Storage of one collection in a directory:
+    vectors.npy - float32 matrix (rows x dimension) opened as a memory map, rows are normalized (cosine similarity)
+    objects.jsonl - append-only log of the inserted objects and deleted rows, replayed into memory on open
+    A row is written to the matrix before its object is logged, the log decides which rows exist.
+    One process writes to a directory at a time (the API with its sync worker, or a script).
+    '''
+    INITIAL_CAPACITY = 1024
+    COMPACT_RATIO = 0.5  # rewrite the files when more than half of the rows are deleted
+
+    # indexes are shared by the stores of a process (the API opens a store per request)
+    _shared: Dict[str, "LocalIndex"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        self.vectors_file = os.path.join(path, "vectors.npy")
+        self.objects_file = os.path.join(path, "objects.jsonl")
+        self.lock = threading.RLock()
+        self.load()
+
+    @classmethod
+    def shared(cls, path: str) -> "LocalIndex":
+        path = os.path.abspath(path)
+        with cls._shared_lock:
+            if path not in cls._shared:
+                cls._shared[path] = cls(path)
+            return cls._shared[path]
+
+    def reset(self):
+        self.vectors: Optional[np.memmap] = None
+        self.num_rows = 0                                   # used rows of the matrix (deleted included)
+        self.objects: List[Optional[dict]] = []             # row -> properties (None = deleted)
+        self.uuids: List[Optional[str]] = []                # row -> object id
+        self.rows: Dict[str, int] = {}                      # object id -> row
+        self.rows_by_file: Dict[str, Set[int]] = {}         # file_id -> rows
+        self.rights = np.empty(0, dtype=object)             # row -> rights (vectorized filtering)
+        self.alive = np.zeros(0, dtype=bool)                # row -> not deleted
+        self.deleted = 0
+        self.bm25 = BM25Index()
+
+    def load(self):
+        self.reset()
+        os.makedirs(self.path, exist_ok=True)
+        if os.path.exists(self.vectors_file):
+            self.vectors = np.load(self.vectors_file, mmap_mode="r+")
+            self._resize_columns(self.vectors.shape[0])
+        if not os.path.exists(self.objects_file):
+            return
+
+        with open(self.objects_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if "deleted" in entry:
+                    for row in entry["deleted"]:
+                        self._remove_row(row)
+                else:
+                    self._add_row(entry["row"], entry["uuid"], entry["properties"])
+
+    def clear(self):
+        with self.lock:
+            self.vectors = None
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.load()
+
+    @property
+    def size(self) -> int:
+        return len(self.rows)
+
+    # ----------------------------------------------------------------------------------------------------
+    def _add_row(self, row: int, uuid: str, properties: dict):
+        if uuid in self.rows:  # same object id twice in one batch, the last one wins
+            self._remove_row(self.rows[uuid])
+        while len(self.objects) <= row:
+            self.objects.append(None)
+            self.uuids.append(None)
+        self.objects[row] = properties
+        self.uuids[row] = uuid
+        self.rows[uuid] = row
+        self.rows_by_file.setdefault(properties["file_id"], set()).add(row)
+        self.rights[row] = properties["rights"]
+        self.alive[row] = True
+        self.num_rows = max(self.num_rows, row + 1)
+        self.bm25.add(row, properties)
+
+    def _remove_row(self, row: int):
+        properties = self.objects[row]
+        if properties is None:
+            return
+        self.bm25.remove(row, properties)
+        rows = self.rows_by_file[properties["file_id"]]
+        rows.discard(row)
+        if not rows:
+            del self.rows_by_file[properties["file_id"]]
+        del self.rows[self.uuids[row]]
+        self.objects[row] = None
+        self.uuids[row] = None
+        self.rights[row] = None
+        self.alive[row] = False
+        self.deleted += 1
+
+    def _ensure_capacity(self, rows: int, dimension: int):
+        if self.vectors is not None and self.vectors.shape[1] != dimension:
+            raise ValueError(f"Vector dimension {dimension} does not match the index dimension {self.vectors.shape[1]}")
+        capacity = 0 if self.vectors is None else self.vectors.shape[0]
+        if rows <= capacity:
+            return
+
+        # grow by doubling: a new file is filled and replaces the old one
+        capacity = max(rows, 2 * capacity, self.INITIAL_CAPACITY)
+        self._write_vectors(capacity, dimension, self.vectors[:self.num_rows] if self.vectors is not None else None)
+        self._resize_columns(capacity)
+
+    def _resize_columns(self, capacity: int):
+        rights = np.empty(capacity, dtype=object)
+        rights[:len(self.rights)] = self.rights
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(self.alive)] = self.alive
+        self.rights, self.alive = rights, alive
+
+    def _write_vectors(self, capacity: int, dimension: int, vectors: Optional[np.ndarray]):
+        tmp_file = self.vectors_file + ".tmp"
+        new_vectors = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=np.float32, shape=(capacity, dimension))
+        if vectors is not None:
+            new_vectors[:len(vectors)] = vectors
+        new_vectors.flush()
+        del new_vectors
+        self.vectors = None
+        os.replace(tmp_file, self.vectors_file)
+        self.vectors = np.load(self.vectors_file, mmap_mode="r+")
+
+    def insert(self, objects: List[dict], vectors: np.ndarray, uuids: List[str]) -> int:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(objects), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        with self.lock:
+            # an existing object id is overwritten (as the insert of an existing uuid in the batch of Weaviate)
+            replaced = [self.rows[uuid] for uuid in dict.fromkeys(uuids) if uuid in self.rows]
+            if replaced:
+                self._log({"deleted": replaced})
+                for row in replaced:
+                    self._remove_row(row)
+
+            start = self.num_rows
+            self._ensure_capacity(start + len(objects), vectors.shape[1])
+            self.vectors[start:start + len(objects)] = vectors
+            self.vectors.flush()
+
+            entries = [{"row": start + i, "uuid": uuid, "properties": properties} for i, (uuid, properties) in enumerate(zip(uuids, objects))]
+            self._log(*entries)
+            for entry in entries:
+                self._add_row(entry["row"], entry["uuid"], entry["properties"])
+        return len(objects)
+
+    def delete(self, rows: List[int]) -> int:
+        with self.lock:
+            rows = [row for row in rows if self.objects[row] is not None]
+            if rows:
+                self._log({"deleted": rows})
+                for row in rows:
+                    self._remove_row(row)
+                if self.deleted > self.COMPACT_RATIO * self.num_rows and self.num_rows > self.INITIAL_CAPACITY:
+                    self.compact()
+        return len(rows)
+
+    def compact(self):
+        # rewrite both files with the live rows only (row numbers change)
+        with self.lock:
+            live = [row for row in range(self.num_rows) if self.objects[row] is not None]
+            objects = [(self.uuids[row], self.objects[row]) for row in live]
+            dimension = self.vectors.shape[1]
+            self._write_vectors(max(len(live), self.INITIAL_CAPACITY), dimension, self.vectors[live])
+
+            tmp_file = self.objects_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                for row, (uuid, properties) in enumerate(objects):
+                    f.write(json.dumps({"row": row, "uuid": uuid, "properties": properties}, ensure_ascii=False) + "\n")
+            os.replace(tmp_file, self.objects_file)
+
+            vectors = self.vectors
+            self.reset()
+            self.vectors = vectors
+            self._resize_columns(vectors.shape[0])
+            for row, (uuid, properties) in enumerate(objects):
+                self._add_row(row, uuid, properties)
+
+    def _log(self, *entries: dict):
+        with open(self.objects_file, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+    # ----------------------------------------------------------------------------------------------------
+    def mask(self, rights: Optional[str]) -> Optional[np.ndarray]:
+        # rows passing the rights filter (exact match as Filter.by_property("rights").equal)
+        if not rights:
+            return None
+        return self.rights[:self.num_rows] == rights
+
+    def vector_search(self, vector: np.ndarray, allowed: Optional[np.ndarray], limit: int) -> List[Tuple[int, float]]:
+        # exact (brute-force) cosine similarity over the memory-mapped matrix
+        if self.vectors is None or not self.rows:
+            return []
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        similarities = self.vectors[:self.num_rows] @ vector
+
+        alive = self.alive[:self.num_rows]
+        if allowed is not None:
+            alive = alive & allowed
+        similarities = np.where(alive, similarities, -np.inf)
+        return top_k(similarities, limit)
+
+
+class LocalVectorStore(BaseVectorStore):
+    '''
+    In-process replacement of the Weaviate store (VECTOR_STORE=local): exact vector search over
+    a memory-mapped matrix, BM25 keyword search and the relative score fusion of Weaviate.
+    '''
+    def __init__(self, collection_name: Optional[str] = None, path: Optional[str] = None, embedding_model: Optional[BaseEmbeddingModel] = None):
+        self.collection_name = collection_name or os.getenv("WEAVIATE_COLLECTION", "DocumentChunks")
+        self.path = os.path.abspath(path or os.path.join(os.getenv("LOCAL_STORE_PATH", "local_store"), self.collection_name))
+        self.get_schema()
+        self.embedding_model = embedding_model or self.load_embedding_model()
+        color_print(f"Opened local store {self.path} ({self.index.size} chunks).")
+
+    def get_schema(self):
+        self.index = LocalIndex.shared(self.path)
+
+    def delete_schema(self):
+        self.index.clear()
+        color_print("Schema deleted.", color="yellow")
+
+    def existing_documents(self, file_ids: List[str]) -> Set[str]:
+        with self.index.lock:
+            return {file_id for file_id in file_ids if self.index.rows_by_file.get(file_id)}
+
+    def insert_chunks_batch(self, chunks: List[Chunk], embeddings: Optional[np.ndarray] = None) -> BatchReport:
+        if not chunks:
+            return BatchReport()
+        if embeddings is None:
+            embeddings = self.embedding_model.embed([chunk.text for chunk in chunks], batch_size=100)
+        # exact search over the matrix, reduced vectors (EMBEDDING_REDUCTION) only save memory, no rescoring
+        embeddings = self.embedding_model.reduce(embeddings)
+
+        start = time.perf_counter()
+        inserted = self.index.insert(
+            objects=[chunk.to_dict() for chunk in chunks],
+            vectors=embeddings,
+            uuids=[self.chunk_uuid(chunk) for chunk in chunks]
+        )
+        return BatchReport(objects=len(chunks), inserted=inserted, batch_size=len(chunks), seconds=time.perf_counter() - start)
+
+    def delete_documents(self, file_ids: List[str], verbose: bool = True) -> DeleteReport:
+        start = time.perf_counter()
+        file_ids = set(file_ids)
+        with self.index.lock:
+            rows = [row for file_id in file_ids for row in self.index.rows_by_file.get(file_id, [])]
+            deleted = self.index.delete(rows) if rows else 0
+        report = DeleteReport(
+            files=len(file_ids), matched=len(rows), deleted=deleted, failed=len(rows) - deleted,
+            requests=int(bool(rows)), seconds=time.perf_counter() - start
+        )
+        if verbose:
+            color_print(str(report), color="yellow")
+        return report
+
+    def rights_for(self, file_ids: List[str]) -> Dict[str, str]:
+        rights = {}
+        with self.index.lock:
+            for file_id in file_ids:
+                rows = self.index.rows_by_file.get(file_id)
+                if rows:
+                    # most common rights of the chunks (top occurrence, as the aggregation of Weaviate)
+                    rights[file_id] = Counter(self.index.objects[row]["rights"] for row in rows).most_common(1)[0][0]
+        return rights
+
+    def file_counts(self) -> Dict[str, int]:
+        # one lookup per file (all chunks of a file share its filename)
+        counts = Counter()
+        with self.index.lock:
+            for rows in self.index.rows_by_file.values():
+                counts[self.index.objects[next(iter(rows))]["filename"]] += len(rows)
+        return dict(counts)
+
+    def hybrid_search(self, query: str, rights: str = None, k: int = 5, alpha: float = 0.55, autocut: bool = False, vector: Optional[np.ndarray] = None) -> List[Chunk]:
+        assert 0 <= alpha <= 1, "Alpha must be between 0 and 1."
+
+        embedding = self.query_embedding(query, vector)
+        with self.index.lock:
+            allowed = self.index.mask(rights)
+            # as Weaviate, the keyword search is skipped for alpha 1 and the vector search for alpha 0
+            keyword = self.index.bm25.search(query, self.index.num_rows, allowed, self.CANDIDATES) if alpha < 1 else []
+            vector = self.index.vector_search(embedding, allowed, self.CANDIDATES) if alpha > 0 else []
+            uuids = self.index.uuids
+            fused = fusion.relative_score_fusion(
+                result_sets=[[(uuids[row], score) for row, score in keyword], [(uuids[row], score) for row, score in vector]],
+                weights=[1 - alpha, alpha],
+                names=["keyword,bm25", "vector,hybridVector"]
+            )
+            if autocut:
+                fused = fused[:fusion.autocut([score for _, score, _ in fused], k)]
+            else:
+                fused = fused[:k]
+            objects = [self.index.objects[self.index.rows[uuid]] for uuid, _, _ in fused]
+
+        return [
+            Chunk(**properties, score=score, explain_score=self.format_explain_score(explain))
+            for properties, (_, score, explain) in zip(objects, fused)
+        ]
+
+    def fetch_candidates(self, query: str, rights: str = None, limit: int = BaseVectorStore.CANDIDATES, vector: Optional[np.ndarray] = None) -> Candidates:
+        embedding = self.query_embedding(query, vector)
+        with self.index.lock:
+            allowed = self.index.mask(rights)
+            keyword = self.index.bm25.search(query, self.index.num_rows, allowed, limit)
+            vector = self.index.vector_search(embedding, allowed, limit)
+            objects = self.index.objects
+            return Candidates.from_result_sets(
+                keyword=[(Chunk(**objects[row]), score) for row, score in keyword],
+                vector=[(Chunk(**objects[row]), score) for row, score in vector]
+            )
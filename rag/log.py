@@ -3,10 +3,14 @@
 
 import json
 import logging
+import os
+import threading
 from chunk import Chunk
 from typing import List
 
 LOG_FILE = "rag.log"
+CAPTURE_FILE = "queries.jsonl"  # one JSON line per /query request (replayable), QUERY_CAPTURE_FILE overrides, empty disables
+_capture_lock = threading.Lock()
 logging.basicConfig(
     level=logging.WARNING,
     format="%(asctime)s - %(levelname)s - %(message)s",
@@ -46,3 +50,39 @@ def log(
             logging.warning(f"  {step:25}: {duration:.4f}")
 
     logging.warning("-" * 50 + "\n\n")
+
+def capture(
+    received_at: float,
+    query: str,
+    rights: str,
+    use_history: bool,
+    history: List[str],
+    rewritten_query: str,
+    retrieved_chunks: List[Chunk],
+    reranked_chunks: List[Chunk],
+    llm_response: str,
+    timings: dict
+):
+    # machine-readable counterpart of log(), the request fields make the traffic replayable (scripts/replay.py)
+    capture_file = os.getenv("QUERY_CAPTURE_FILE", CAPTURE_FILE)
+    if not capture_file:
+        return
+
+    record = {
+        "timestamp": received_at,
+        "query": query,
+        "rights": rights,
+        "use_history": use_history,
+        "history": history,
+        "rewritten_query": rewritten_query,
+        "retrieved_chunk_ids": [chunk.chunk_id for chunk in retrieved_chunks],
+        "retrieved_scores": [chunk.score for chunk in retrieved_chunks],
+        "chunk_ids": [chunk.chunk_id for chunk in reranked_chunks],
+        "reranked_scores": [chunk.reranked_score for chunk in reranked_chunks],
+        "response_chars": len(llm_response),
+        "timings": timings
+    }
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    # requests are served by a thread pool, one write per line keeps the lines whole
+    with _capture_lock, open(capture_file, "a", encoding="utf-8") as f:
+        f.write(line)
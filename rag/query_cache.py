@@ -0,0 +1,140 @@
+# File: query_cache.py - in-process LRU cache of the hybrid search results, invalidated by the index generation
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import os
+import threading
+import time
+from chunk import Chunk
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Callable, Hashable, List
+
+
+class QueryCache:
+    '''
+    Results of identical searches (query, rights, k, alpha, autocut) are served from memory. Every write to the
+    store of this process bumps the generation, results of older generations are never returned. Writes of other
+    processes (scripts, ingestion workers) are not seen, TTL_SECONDS bounds how stale their results can be.
+    '''
+    MAX_ENTRIES = 10000
+    MAX_BYTES = 64 * 1024 * 1024  # estimated size of the cached chunks
+    TTL_SECONDS = 600.0           # 0 = no expiry
+    CHUNK_OVERHEAD = 400          # bytes of a Chunk object without its strings
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES, ttl_seconds: float = TTL_SECONDS, enabled: bool = True):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (chunks, size, stored at), LRU order
+        self.generation = 0
+        self.bytes = 0
+
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls) -> "QueryCache":
+        # QUERY_CACHE=0 disables the cache
+        return cls(
+            max_entries=int(os.getenv("QUERY_CACHE_ENTRIES", cls.MAX_ENTRIES)),
+            max_bytes=int(os.getenv("QUERY_CACHE_MB", cls.MAX_BYTES // 1024 ** 2)) * 1024 ** 2,
+            ttl_seconds=float(os.getenv("QUERY_CACHE_TTL", cls.TTL_SECONDS)),
+            enabled=os.getenv("QUERY_CACHE", "1") != "0"
+        )
+
+    @classmethod
+    def size_of(cls, chunks: List[Chunk]) -> int:
+        return sum(
+            cls.CHUNK_OVERHEAD + sum(len(value) for value in vars(chunk).values() if isinstance(value, str))
+            for chunk in chunks
+        )
+
+    @staticmethod
+    def copy(chunks: List[Chunk]) -> List[Chunk]:
+        # callers modify the returned chunks (reranked scores, hydrated metadata)
+        return [replace(chunk) for chunk in chunks]
+
+    def bump_generation(self):
+        # the index changed, all cached results are stale
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self.bytes = 0
+
+    def get_or_search(self, key: Hashable, search: Callable[[], List[Chunk]]) -> List[Chunk]:
+        if not self.enabled:
+            return search()
+
+        with self._lock:
+            generation = self.generation
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds and time.monotonic() - entry[2] > self.ttl_seconds:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self.copy(entry[0])
+            self.misses += 1
+
+        chunks = search()
+        self._put(key, self.copy(chunks), generation)
+        return chunks
+
+    def _put(self, key: Hashable, chunks: List[Chunk], generation: int):
+        size = self.size_of(chunks)
+        with self._lock:
+            # a write during the search made the result stale
+            if generation != self.generation or size > self.max_bytes:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (chunks, size, time.monotonic())
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "generation": self.generation,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# one cache per process, shared by the stores (the API opens a store per request)
+query_cache = QueryCache.from_env()
+
+def bump_generation():
+    query_cache.bump_generation()
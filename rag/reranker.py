@@ -1,6 +1,7 @@
 # File: reranker.py - Reranker module
 # Author: Adam Valík <xvalik05@stud.fit.vut.cz>
 
+import threading
 from chunk import Chunk
 from typing import List
 
@@ -8,27 +9,48 @@ from sentence_transformers import CrossEncoder
 
 
 class Reranker:
+    MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    BATCH_SIZE = 64  # (query, chunk) pairs of one forward pass
+
+    # the cross-encoder is loaded once per process
+    _model = None
+    _model_lock = threading.Lock()
+
+    @classmethod
+    def model(cls) -> CrossEncoder:
+        with cls._model_lock:
+            if cls._model is None:
+                cls._model = CrossEncoder(cls.MODEL)
+            return cls._model
+
     @staticmethod
     def rerank(query: str, candidate_chunks: List[Chunk], cutoff: float = 0.5) -> List[Chunk]:
-        if not candidate_chunks:
-            return []
-        
-        # load the cross-encoder model
-        cross_encoder = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
-        reranks = cross_encoder.rank(query, [chunk.text for chunk in candidate_chunks])
-
-        # rerank the chunks
-        reranked_chunks = []
-        for rerank in reranks:
-            chunk = candidate_chunks[rerank['corpus_id']]
-            chunk.reranked_score = float(rerank['score'])
-            reranked_chunks.append(chunk)
-        
-        # filter out the chunks with low reranked scores
-        if cutoff > 0:
-            reranked_chunks = Reranker.filter_by_relative_score(reranked_chunks, cutoff)
-        return reranked_chunks
-    
+        return Reranker.rerank_many([query], [candidate_chunks], cutoff=cutoff)[0]
+
+    @staticmethod
+    def rerank_many(queries: List[str], candidate_lists: List[List[Chunk]], cutoff: float = 0.5, batch_size: int = BATCH_SIZE) -> List[List[Chunk]]:
+        # the pairs of all queries are scored in shared batches, the chunks of a query are ranked and filtered separately
+        pairs = [(query, chunk.text) for query, chunks in zip(queries, candidate_lists) for chunk in chunks]
+        if not pairs:
+            return [[] for _ in candidate_lists]
+        scores = Reranker.model().predict(pairs, batch_size=batch_size)
+
+        reranked_lists = []
+        start = 0
+        for chunks in candidate_lists:
+            for chunk, score in zip(chunks, scores[start:start + len(chunks)]):
+                chunk.reranked_score = float(score)
+            start += len(chunks)
+
+            # rerank the chunks
+            reranked_chunks = sorted(chunks, key=lambda chunk: chunk.reranked_score, reverse=True)
+
+            # filter out the chunks with low reranked scores
+            if cutoff > 0 and reranked_chunks:
+                reranked_chunks = Reranker.filter_by_relative_score(reranked_chunks, cutoff)
+            reranked_lists.append(reranked_chunks)
+        return reranked_lists
+
     @staticmethod
     def filter_by_relative_score(chunks: List[Chunk], cutoff: float) -> List[Chunk]:
         # shift the scores to be non-negative
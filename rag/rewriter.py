@@ -2,17 +2,19 @@
 # Author: Adam Valík <xvalik05@stud.fit.vut.cz>
 
 import os
-from typing import List
+from typing import List, Optional
 
 import openai
 
+from utils import add_usage
+
 
 class Rewriter:
     CHATHISTORY_SIZE = 3  # number of turns to consider in chat history
     MODEL = "gpt-4o"
     
     @staticmethod
-    def rewrite(query: str) -> str:        
+    def rewrite(query: str, usage: Optional[dict] = None) -> str:        
         prompt = (
             "You are a query rewriting assistant in a Retrieval-Augmented Generation (RAG) system that uses both "
             "semantic and keyword-based search (hybrid retrieval).\n\n"
@@ -40,11 +42,12 @@ class Rewriter:
                 {"role": "user", "content": query}
             ]
         )
+        add_usage(usage, response)
         
         return response.choices[0].message.content.strip()        
     
     @staticmethod
-    def rewrite_with_history(query: str, history: List[str]) -> str:
+    def rewrite_with_history(query: str, history: List[str], usage: Optional[dict] = None) -> str:
         prompt = (
             "You are a query rewriting assistant in a Retrieval-Augmented Generation (RAG) system that uses both "
             "semantic and keyword-based search (hybrid retrieval).\n\n"
@@ -72,5 +75,6 @@ class Rewriter:
                 {"role": "user", "content": [{"type": "text", "text": query}]}
             ]
         )
+        add_usage(usage, response)
         
         return response.choices[0].message.content.strip()    
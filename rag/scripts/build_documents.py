@@ -0,0 +1,14 @@
+# build_documents.py - document vectors of an existing collection for the hierarchical search (HIERARCHICAL_SEARCH=1)
+# Run from rag/: python -m scripts.build_documents
+
+from dotenv import load_dotenv
+
+from vector_store import VectorStore
+
+load_dotenv()
+
+vector_store = VectorStore(hierarchical=True)
+
+vector_store.rebuild_documents()
+
+vector_store.close()
@@ -1,12 +1,19 @@
 from vector_store import VectorStore
+from utils import color_print
 import os
 
 v = VectorStore()
 
 FOLDER = "/Users/adamvalik/Downloads/test-wiki-2nd"
 
-for file in os.listdir(FOLDER):
-    file_path = os.path.join("/Users/adamvalik/Downloads/test-wiki", file)
-    v.delete_document(file_path)
+# file ids of the ingested files are their paths in the ingested folder
+file_paths = [os.path.join("/Users/adamvalik/Downloads/test-wiki", file) for file in os.listdir(FOLDER)]
+existing = v.existing_documents(file_paths)
+color_print(f"{len(existing)} of {len(file_paths)} files found in the collection.", color="yellow")
+for file_path in sorted(set(file_paths) - existing):
+    color_print(f"File {file_path} not found in collection.", color="yellow")
 
-v.close()
\ No newline at end of file
+# chunks of all the files are deleted by a few filtered requests
+v.delete_documents(list(existing))
+
+v.close()
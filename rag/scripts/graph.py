@@ -1,5 +1,12 @@
+import json
+import os
+
 import matplotlib.pyplot as plt
 
+# results of tests/fusion_sweep.py replace the values below (measured on queries_retrieval_cursed.jsonl)
+SWEEP_FILE = os.getenv("GRAPH_SWEEP", "")
+SWEEP_CURVE = os.getenv("GRAPH_SWEEP_CURVE", "rewriting")  # rewriting | original
+
 alpha_values = [
     0.0, 0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 
     0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 1.0
@@ -13,6 +20,11 @@ in_context = [
     0.94, 0.96, 0.96, 0.94, 0.94, 0.95, 0.94, 0.95, 0.95, 0.92, 0.91
 ]
 
+if SWEEP_FILE:
+    with open(SWEEP_FILE, "r", encoding="utf-8") as f:
+        curve = json.load(f)["alpha_curve"][SWEEP_CURVE]
+    alpha_values, recall_at_1, in_context = curve["alpha"], curve["recall@1"], curve["in context"]
+
 max_idx = recall_at_1.index(max(recall_at_1))
 optimal_alpha = alpha_values[max_idx]
 optimal_score = recall_at_1[max_idx]
@@ -0,0 +1,73 @@
+# ingest_coordinator.py - splits the Drive (or a local folder) into file-level tasks for the ingestion workers
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import os
+import time
+
+from dotenv import load_dotenv
+
+from ingestion_worker import file_task
+from task_queue import TaskQueue
+from utils import color_print
+from vector_store import VectorStoreFactory
+
+load_dotenv()
+
+LOCAL_FOLDER = ""   # ingest a local folder (shared with the workers) instead of the Drive root folder
+WAIT = True         # wait until the workers drain the queue and report the throughput
+
+
+def local_manifest(folder: str) -> dict:
+    tasks = {}
+    for root, _, files in os.walk(folder):
+        for filename in files:
+            file_path = os.path.join(root, filename)
+            tasks[file_path] = file_task(file_id=file_path, filename=file_path, path=root, source="local")
+    return tasks
+
+def drive_manifest() -> dict:
+    from google_drive_downloader import GoogleDriveDownloader
+    downloader = GoogleDriveDownloader()
+    root_folder_id = downloader.get_root_id()
+    if not root_folder_id:
+        color_print("Failed to obtain root folder ID. Provide URL of root folder.", "red")
+        exit()
+    return {
+        file["id"]: file_task(file_id=file["id"], filename=file["name"], path=file["path"])
+        for file in downloader.build_manifest(root_folder_id, "root")
+    }
+
+def skip_existing(tasks: dict) -> dict:
+    # avoid duplicate ingestion of files that are already in the vector store
+    vector_store = VectorStoreFactory.get_store()
+    try:
+        existing = vector_store.existing_documents(list(tasks))
+    finally:
+        vector_store.close()
+    if existing:
+        color_print(f"Skipping {len(existing)} files already in the vector store.", color="yellow")
+    return {task_id: task for task_id, task in tasks.items() if task_id not in existing}
+
+
+if __name__ == "__main__":
+    queue = TaskQueue()
+    tasks = local_manifest(LOCAL_FOLDER) if LOCAL_FOLDER else drive_manifest()
+    color_print(f"Discovered {len(tasks)} files.", color="blue")
+
+    tasks = skip_existing(tasks)
+    enqueued = queue.enqueue(tasks)
+    color_print(f"Enqueued {enqueued} tasks to {queue.path} ({len(tasks) - enqueued} already queued).")
+
+    if WAIT:
+        start = time.perf_counter()
+        while not queue.is_drained():
+            stats = queue.stats()
+            elapsed = time.perf_counter() - start
+            print(f"[{elapsed:7.1f}s] {stats}, {stats['done'] / elapsed:.2f} docs/s")
+            time.sleep(5)
+
+        elapsed = time.perf_counter() - start
+        stats = queue.stats()
+        color_print(f"Queue drained in {elapsed:.2f}s: {stats}")
+        for failed in queue.failed_tasks():
+            color_print(f"Failed: {failed['task_id']} after {failed['attempts']} attempts", color="red", additional_text=f" - {failed['error']}")
@@ -0,0 +1,33 @@
+# ingest_worker.py - starts ingestion worker processes consuming the shared task queue
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+from ingestion_worker import run_worker
+from task_queue import TaskQueue
+
+load_dotenv()
+
+NUM_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))      # worker processes in this container/machine
+TORCH_THREADS = int(os.getenv("INGEST_TORCH_THREADS", "0"))  # torch threads per worker (0 = torch default)
+EXIT_WHEN_DRAINED = os.getenv("INGEST_EXIT_WHEN_DRAINED", "false").lower() == "true"
+
+
+if __name__ == "__main__":
+    queue_path = TaskQueue().path
+    if NUM_WORKERS == 1:
+        run_worker(queue_path, exit_when_drained=EXIT_WHEN_DRAINED, torch_threads=TORCH_THREADS)
+    else:
+        # every process loads its own embedding model
+        ctx = multiprocessing.get_context("spawn")
+        processes = [
+            ctx.Process(target=run_worker, args=(queue_path, None, EXIT_WHEN_DRAINED, TORCH_THREADS))
+            for _ in range(NUM_WORKERS)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
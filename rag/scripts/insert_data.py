@@ -15,23 +15,21 @@ dataset_folder = "/Users/adamvalik/Downloads/kaggle-wiki"
 
 def add_documents(folder_path):
     color_print(f"\nIngesting documents from directory: {folder_path}", color="blue")
+    file_paths = [os.path.join(root, filename) for root, _, filenames in os.walk(folder_path) for filename in filenames]
+    # one bulk existence check instead of a query per file
+    existing = vector_store.existing_documents(file_paths)
     buffer = []
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        if os.path.isfile(file_path):
-            if vector_store.document_exists(file_path):
-                # avoid duplicate ingestion
-                color_print(f"Document {file_path} already exists in the vector store. Skipping ingestion...", color="yellow")
-            else:
-                document_processor = DocumentProcessor(filename=file_path)
-                document_processor.add_rights("user")
-                chunks = document_processor.process()
-                if chunks:
-                    buffer.extend(chunks)
-                    color_print(f"Document {file_path} processed.")
-
-        elif os.path.isdir(file_path):
-            add_documents(file_path)
+    for file_path in file_paths:
+        if file_path in existing:
+            # avoid duplicate ingestion
+            color_print(f"Document {file_path} already exists in the vector store. Skipping ingestion...", color="yellow")
+        else:
+            document_processor = DocumentProcessor(filename=file_path)
+            document_processor.add_rights("user")
+            chunks = document_processor.process()
+            if chunks:
+                buffer.extend(chunks)
+                color_print(f"Document {file_path} processed.")
 
     if buffer:
         vector_store.insert_chunks_batch(buffer)
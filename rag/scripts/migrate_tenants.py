@@ -0,0 +1,84 @@
+# migrate_tenants.py - copies the chunks of the single collection into the rights-partitioned collection
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+#
+# The stored vectors are copied (no re-embedding). The copies get the object ids derived from chunk_id
+# (chunk_uuid), so objects of the source with random ids get new ids, and a re-run overwrites the copied
+# chunks. Afterwards run the API and the workers with VECTOR_STORE=tenants (tenant_vector_store.py).
+# Run from rag/: python -m scripts.migrate_tenants
+
+import os
+from chunk import Chunk
+
+import numpy as np
+from dotenv import load_dotenv
+from tqdm import tqdm
+from weaviate.classes.query import Filter
+
+from tenant_vector_store import TenantVectorStore
+from utils import color_print
+
+load_dotenv()
+
+SOURCE = os.getenv("MIGRATE_SOURCE", "DocumentChunks")
+TARGET = os.getenv("MIGRATE_TARGET", "DocumentChunksByRights")
+BATCH = 2000                    # chunks read from the source per insert
+DELETE_SOURCE = False           # drop the source collection after a complete migration
+
+
+def migrate(store: TenantVectorStore, source) -> int:
+    chunks, vectors = [], []
+    copied = 0
+
+    def flush():
+        nonlocal copied
+        report = store.insert_chunks_batch(chunks, embeddings=np.array(vectors, dtype=np.float32))
+        copied += report.inserted
+        chunks.clear()
+        vectors.clear()
+
+    for obj in tqdm(source.iterator(include_vector=True), desc=f"Migrating {SOURCE}", unit="chunks"):
+        chunks.append(Chunk(**obj.properties))
+        vectors.append(obj.vector["default"])
+        if len(chunks) >= BATCH:
+            flush()
+    if chunks:
+        flush()
+    return copied
+
+def count(collection, rights: str = None) -> int:
+    filters = Filter.by_property("rights").equal(rights) if rights else None
+    return collection.aggregate.over_all(filters=filters, total_count=True).total_count
+
+def expected_counts(source) -> dict:
+    # chunks per rights in the source, the empty rights are the rest (an empty string cannot be filtered)
+    expected = {rights: count(source, rights) for rights in TenantVectorStore.TENANTS if rights}
+    expected[""] = count(source) - sum(expected.values())
+    return expected
+
+
+if __name__ == "__main__":
+    store = TenantVectorStore(collection_name=TARGET)
+    if not store.client.collections.exists(SOURCE):
+        color_print(f"Source collection {SOURCE} does not exist.", color="red")
+        store.close()
+        exit()
+    source = store.client.collections.get(SOURCE)
+
+    copied = migrate(store, source)
+    color_print(f"Copied {copied} chunks from {SOURCE} to {TARGET}.", color="blue")
+
+    # every tenant must hold the chunks of its rights
+    complete = True
+    for rights, expected in expected_counts(source).items():
+        stored = count(store.partitions[rights])
+        complete &= expected == stored
+        color_print(
+            f"Tenant {store.tenant_for(rights)}: ",
+            color="green" if expected == stored else "red",
+            additional_text=f"{stored} / {expected} chunks"
+        )
+
+    if complete and DELETE_SOURCE:
+        store.client.collections.delete(SOURCE)
+        color_print(f"Source collection {SOURCE} deleted.", color="yellow")
+    store.close()
@@ -0,0 +1,109 @@
+# reduce_dimensions.py - fits the dimension reduction, re-indexes the chunks with reduced vectors and measures recall
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+#
+# The PCA projection is fitted on the full vectors of the source collection (Matryoshka models need no fitting),
+# the target collection gets the reduced vectors and the full vectors are kept in the side store for rescoring.
+# Recall@k of queries_retrieval.jsonl and the search latency are compared for the full index, the reduced index
+# and the reduced index with rescoring. Afterwards run with EMBEDDING_REDUCTION, EMBEDDING_DIMENSION and
+# WEAVIATE_COLLECTION=<target>. Run from rag/: python -m scripts.reduce_dimensions
+
+import copy
+import json
+import os
+import time
+from chunk import Chunk
+from datetime import datetime
+
+import numpy as np
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+from embedding_model import DimensionReduction, HuggingFaceEmbeddingModel
+from query_cache import query_cache
+from utils import color_print
+from vector_store import VectorStore
+
+load_dotenv()
+
+SOURCE = os.getenv("REDUCE_SOURCE", "DocumentChunks")
+METHOD = os.getenv("EMBEDDING_REDUCTION") or "pca"
+DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "256"))
+TARGET = os.getenv("REDUCE_TARGET", f"{SOURCE}Reduced{DIMENSION}")
+QUERY_FILE = "tests/test-sets/queries_retrieval.jsonl"
+TOP_K = [1, 5]
+ALPHAS = [0.55, 1.0]        # default hybrid search and the vector search alone
+RESULTS_DIR = "tests/test-sets/results"
+
+# the reduced and the rescored search of the target share the cache keys, every search is measured
+query_cache.enabled = False
+
+
+def load_source(store: VectorStore):
+    chunks, vectors = [], []
+    for obj in tqdm(store.collection.iterator(include_vector=True), desc=f"Reading {SOURCE}", unit="chunks"):
+        chunks.append(Chunk(**obj.properties))
+        vectors.append(obj.vector["default"])
+    return chunks, np.array(vectors, dtype=np.float32)
+
+def evaluate(store: VectorStore, test_cases: list, alpha: float) -> dict:
+    hits = {k: 0 for k in TOP_K}
+    latencies = []
+    for case in test_cases:
+        start = time.perf_counter()
+        chunks = store.hybrid_search(case["query"], k=max(TOP_K), alpha=alpha)
+        latencies.append(time.perf_counter() - start)
+        retrieved = [chunk.chunk_id.split("/")[-1] for chunk in chunks]
+        for k in TOP_K:
+            hits[k] += case["expected_chunk_id"] in retrieved[:k]
+
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    return {**{f"recall@{k}": hits[k] / len(test_cases) for k in TOP_K}, "p50_ms": float(p50), "p95_ms": float(p95)}
+
+
+if __name__ == "__main__":
+    with open(QUERY_FILE, "r", encoding="utf-8") as f:
+        test_cases = [json.loads(line) for line in f]
+
+    os.environ.pop("EMBEDDING_REDUCTION", None)  # describes the target, the source model embeds full vectors
+    full_model = HuggingFaceEmbeddingModel(VectorStore.EMBEDDING_MODEL)
+    source = VectorStore(collection_name=SOURCE, embedding_model=full_model)
+    chunks, vectors = load_source(source)
+
+    path = os.getenv("EMBEDDING_PROJECTION") or DimensionReduction.projection_path(VectorStore.EMBEDDING_MODEL, DIMENSION)
+    if METHOD == "pca":
+        explained = DimensionReduction.fit_pca(vectors, DIMENSION, path)
+        color_print(f"PCA fitted on {len(vectors)} vectors: {DIMENSION} components explain {explained:.1%} of the variance, saved to {path}", color="blue")
+
+    reduced_model = copy.copy(full_model)
+    reduced_model.reduction = DimensionReduction(METHOD, DIMENSION, path)
+    target = VectorStore(collection_name=TARGET, embedding_model=reduced_model)
+    target.delete_schema()
+    target.get_schema()
+    target.full_vectors.clear()
+    report = target.insert_chunks_batch(chunks, embeddings=vectors)
+    color_print(f"{report.inserted} chunks re-indexed into {TARGET}", color="blue")
+
+    results = {}
+    full_vectors = target.full_vectors
+    for alpha in ALPHAS:
+        results[f"full alpha={alpha}"] = evaluate(source, test_cases, alpha)
+        target.full_vectors = None
+        results[f"reduced alpha={alpha}"] = evaluate(target, test_cases, alpha)
+        target.full_vectors = full_vectors
+        results[f"rescored alpha={alpha}"] = evaluate(target, test_cases, alpha)
+    for name, result in results.items():
+        color_print(f"{name}: ", color="yellow", additional_text=", ".join(f"{key} {value:.3f}" for key, value in result.items()))
+
+    memory = {
+        "full_index_mb": vectors.shape[0] * vectors.shape[1] * 4 / 1024 ** 2,
+        "reduced_index_mb": vectors.shape[0] * DIMENSION * 4 / 1024 ** 2
+    }
+    color_print(f"Vector memory of the index: {memory['full_index_mb']:.1f} MB -> {memory['reduced_index_mb']:.1f} MB (full vectors on disk)", color="blue")
+    source.close()
+    target.close()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = os.path.join(RESULTS_DIR, f"reduce_dimensions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"method": METHOD, "dimension": DIMENSION, "source": SOURCE, "target": TARGET, "memory": memory, "results": results}, f, indent=4)
+    color_print(f"Results saved to {output}", color="blue")
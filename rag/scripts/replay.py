@@ -0,0 +1,195 @@
+# replay.py - replays captured /query traffic against a running instance and compares two runs
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+#
+# replay:  REPLAY_CAPTURE (queries.jsonl written by log.capture) -> REPLAY_TARGET, results to REPLAY_OUTPUT
+# compare: REPLAY_BASELINE vs. REPLAY_CANDIDATE (captures or replay outputs of the same capture),
+#          latency distributions per stage and the returned chunk IDs per query
+# Run from rag/: python -m scripts.replay. The query rewriting (LLM) is not deterministic, compare two
+# replays of the same build first to see the noise floor of the chunk agreement.
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+
+import httpx
+import numpy as np
+from dotenv import load_dotenv
+
+from utils import color_print, parse_server_timing
+
+load_dotenv()
+
+MODE = os.getenv("REPLAY_MODE", "replay")                          # replay | compare
+CAPTURE = os.getenv("REPLAY_CAPTURE", "queries.jsonl")
+TARGET = os.getenv("REPLAY_TARGET", "http://localhost:8000")
+SPEED = float(os.getenv("REPLAY_SPEED", "1.0"))                    # 2.0 = twice as fast as captured, 0 = back-to-back
+CONCURRENCY = int(os.getenv("REPLAY_CONCURRENCY", "64"))           # requests in flight at most
+LIMIT = int(os.getenv("REPLAY_LIMIT", "0"))                        # replay only the first N requests (0 = all)
+OUTPUT = os.getenv("REPLAY_OUTPUT", f"replay_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+BASELINE = os.getenv("REPLAY_BASELINE", "")
+CANDIDATE = os.getenv("REPLAY_CANDIDATE", "")
+DIVERGENT = 10                                                     # most divergent queries listed by compare
+
+
+def load_records(path: str) -> List[dict]:
+    # every record is keyed by its line number in the capture (replay outputs keep the key)
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            if line.strip():
+                record = json.loads(line)
+                record.setdefault("index", index)
+                records.append(record)
+    return records
+
+def send(client: httpx.Client, record: dict) -> dict:
+    result = {
+        "index": record["index"],
+        "query": record["query"],
+        "sent_at": time.time(),
+        "status": None,
+        "error": None,
+        "chunk_ids": [],
+        "timings": {}
+    }
+    body = {key: record[key] for key in ["query", "rights", "history", "use_history"]}
+    start = time.perf_counter()
+    try:
+        with client.stream("POST", "/query", json=body) as response:
+            result["status"] = response.status_code
+            if response.status_code != 200:
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+            result["timings"].update(parse_server_timing(response.headers.get("server-timing", "")))
+
+            answer = []
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                if message["metadata"] is not None:
+                    result["chunk_ids"] = [chunk["chunk_id"] for chunk in message["metadata"]["chunks"]]
+                    result["timings"]["time_to_chunks"] = time.perf_counter() - start
+                elif message["text"]:
+                    if not answer:
+                        result["timings"]["time_to_first_token"] = time.perf_counter() - start
+                    answer.append(message["text"])
+        result["response_chars"] = len("".join(answer))
+        if "".join(answer).startswith("[ERROR]"):
+            result["error"] = "".join(answer)
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["timings"]["total"] = time.perf_counter() - start
+    return result
+
+def replay(records: List[dict]) -> List[dict]:
+    # requests are sent at their captured offsets divided by SPEED, responses do not delay the schedule
+    records = sorted(records, key=lambda record: record["timestamp"])  # lines are written when the answer finished
+    first = records[0]["timestamp"]
+    results = []
+    lock = threading.Lock()
+    in_flight = threading.Semaphore(CONCURRENCY)
+    client = httpx.Client(base_url=TARGET, timeout=300, limits=httpx.Limits(max_connections=CONCURRENCY))
+
+    def task(record):
+        try:
+            result = send(client, record)
+        finally:
+            in_flight.release()
+        with lock:
+            results.append(result)
+            if result["error"]:
+                color_print(f"[{record['index']}] {result['error']}", color="red")
+            if len(results) % 50 == 0:
+                print(f"{len(results)}/{len(records)} requests replayed")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        for record in records:
+            if SPEED > 0:
+                time.sleep(max(0.0, (record["timestamp"] - first) / SPEED - (time.perf_counter() - start)))
+            in_flight.acquire()
+            executor.submit(task, record)
+    client.close()
+
+    elapsed = time.perf_counter() - start
+    color_print(f"Replayed {len(results)} requests in {elapsed:.1f}s ({len(results) / elapsed:.2f} req/s)")
+    return sorted(results, key=lambda result: result["index"])
+
+# ----------------------------------------------------------------------------------------------------
+def latency_table(baseline: List[dict], candidate: List[dict]):
+    stages = sorted(
+        {stage for record in baseline for stage in record["timings"]} &
+        {stage for record in candidate for stage in record["timings"]}
+    )
+    print(f"{'stage':24} {'p50 ms (base -> cand)':>26} {'p95 ms (base -> cand)':>26} {'p99 ms (base -> cand)':>26}")
+    for stage in stages:
+        base = [record["timings"][stage] for record in baseline if stage in record["timings"]]
+        cand = [record["timings"][stage] for record in candidate if stage in record["timings"]]
+        columns = []
+        for b, c in zip(np.percentile(base, [50, 95, 99]) * 1000, np.percentile(cand, [50, 95, 99]) * 1000):
+            change = (c - b) / b if b else 0.0
+            columns.append(f"{b:8.1f} -> {c:8.1f} ({change:+5.0%})")
+        print(f"{stage:24} " + " ".join(f"{column:>26}" for column in columns))
+
+def chunk_agreement(baseline: Dict[int, dict], candidate: Dict[int, dict]):
+    common = sorted(set(baseline) & set(candidate))
+    if not common:
+        color_print("No common requests to compare.", color="red")
+        return
+
+    exact = top1 = 0
+    jaccards = []
+    divergent = []
+    for index in common:
+        base, cand = baseline[index]["chunk_ids"], candidate[index]["chunk_ids"]
+        exact += base == cand
+        top1 += bool(base) and bool(cand) and base[0] == cand[0]
+        union = set(base) | set(cand)
+        jaccard = len(set(base) & set(cand)) / len(union) if union else 1.0
+        jaccards.append(jaccard)
+        divergent.append((jaccard, index))
+
+    print(f"\nRequests compared: {len(common)}")
+    print(f"Identical chunk lists: {exact / len(common):.1%}")
+    print(f"Same top-1 chunk:      {top1 / len(common):.1%}")
+    print(f"Mean Jaccard:          {np.mean(jaccards):.3f}")
+
+    print("\nMost divergent queries:")
+    for jaccard, index in sorted(divergent)[:DIVERGENT]:
+        if jaccard == 1.0:
+            break
+        color_print(f"[{index}] Jaccard {jaccard:.2f}: ", color="yellow", additional_text=baseline[index]["query"])
+        print(f"    baseline:  {baseline[index]['chunk_ids']}")
+        print(f"    candidate: {candidate[index]['chunk_ids']}")
+
+def compare(baseline_path: str, candidate_path: str):
+    baseline = [record for record in load_records(baseline_path) if not record.get("error")]
+    candidate = [record for record in load_records(candidate_path) if not record.get("error")]
+    color_print(f"Baseline: {baseline_path} ({len(baseline)} ok), candidate: {candidate_path} ({len(candidate)} ok)", color="blue")
+
+    latency_table(baseline, candidate)
+    chunk_agreement({record["index"]: record for record in baseline}, {record["index"]: record for record in candidate})
+
+
+if __name__ == "__main__":
+    if MODE == "compare":
+        compare(BASELINE, CANDIDATE)
+    else:
+        records = load_records(CAPTURE)
+        records = records[:LIMIT] if LIMIT else records
+        if not records:
+            color_print(f"No captured requests to replay in {CAPTURE}.", "red")
+            exit()
+        color_print(f"Replaying {len(records)} captured requests against {TARGET} (speed {SPEED}x)", color="blue")
+        results = replay(records)
+
+        with open(OUTPUT, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        errors = sum(1 for result in results if result["error"])
+        color_print(f"Results saved to {OUTPUT}, {errors} errors ({errors / max(len(results), 1):.1%})", color="red" if errors else "green")
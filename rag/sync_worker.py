@@ -0,0 +1,146 @@
+# File: sync_worker.py - Background worker for webhook-driven Google Drive synchronization
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import threading
+import time
+from typing import Callable, Optional
+
+from utils import color_print
+
+
+class SyncWorker:
+    DEBOUNCE_SECONDS = 2.0    # quiet period after the last notification before the sync starts
+    MAX_DELAY_SECONDS = 30.0  # a continuous burst of notifications cannot postpone the sync longer than this
+
+    def __init__(
+        self,
+        sync_fn: Callable[[], Optional[dict]],
+        debounce_seconds: float = DEBOUNCE_SECONDS,
+        max_delay_seconds: float = MAX_DELAY_SECONDS
+    ):
+        '''sync_fn runs one complete sync, it is only ever called from the single worker thread'''
+        self.sync_fn = sync_fn
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # queue state (notifications waiting for the next sync)
+        self.pending = 0
+        self.first_pending_at = None
+        self.last_notification_at = None
+        self.running = False
+
+        # metrics
+        self.notifications_total = 0
+        self.syncs_total = 0
+        self.coalesced_total = 0
+        self.sync_errors = 0
+        self.last_queue_lag = None
+        self.max_queue_lag = 0.0
+        self.last_sync_duration = None
+        self.last_sync_finished = None
+        self.last_result = None
+        self.last_error = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sync-worker", daemon=True)
+        self._thread.start()
+        color_print("[Sync] Background sync worker started.", color="yellow")
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+        color_print("[Sync] Background sync worker stopped.", color="yellow")
+
+    def notify(self, immediate: bool = False):
+        # enqueue a sync request, bursts are coalesced into a single sync
+        now = time.monotonic()
+        with self._lock:
+            self.notifications_total += 1
+            self.pending += 1
+            if self.first_pending_at is None:
+                self.first_pending_at = now
+            # immediate requests (manual sync) skip the debounce window
+            self.last_notification_at = now - self.debounce_seconds if immediate else now
+        self._wakeup.set()
+
+    def _wait_for_quiet_period(self) -> bool:
+        # debounce: wait until no notification arrived for DEBOUNCE_SECONDS (bounded by MAX_DELAY_SECONDS)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                remaining_quiet = self.debounce_seconds - (now - self.last_notification_at)
+                remaining_delay = self.max_delay_seconds - (now - self.first_pending_at)
+            if remaining_quiet <= 0 or remaining_delay <= 0:
+                return True
+            if self._stop.wait(min(remaining_quiet, remaining_delay)):
+                return False
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait()
+            if self._stop.is_set():
+                break
+            if not self._wait_for_quiet_period():
+                break
+
+            with self._lock:
+                coalesced = self.pending
+                queue_lag = time.monotonic() - self.first_pending_at
+                self.coalesced_total += coalesced - 1
+                self.pending = 0
+                self.first_pending_at = None
+                self.running = True
+                # notifications arriving during the sync wake the worker up again afterwards
+                self._wakeup.clear()
+
+            color_print(f"[Sync] Starting sync for {coalesced} notification(s), queue lag {queue_lag:.2f}s", color="blue")
+            start = time.perf_counter()
+            result = None
+            error = None
+            try:
+                result = self.sync_fn()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                color_print(f"[Sync] Sync failed: {error}", color="red")
+            duration = time.perf_counter() - start
+
+            with self._lock:
+                self.running = False
+                self.syncs_total += 1
+                self.last_queue_lag = queue_lag
+                self.max_queue_lag = max(self.max_queue_lag, queue_lag)
+                self.last_sync_duration = duration
+                self.last_sync_finished = time.time()
+                self.last_result = result
+                if error:
+                    self.sync_errors += 1
+                    self.last_error = error
+
+    def metrics(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "running": self.running,
+                "pending_notifications": self.pending,
+                "queue_lag_seconds": now - self.first_pending_at if self.first_pending_at is not None else 0.0,
+                "notifications_total": self.notifications_total,
+                "syncs_total": self.syncs_total,
+                "coalesced_notifications": self.coalesced_total,
+                "sync_errors": self.sync_errors,
+                "last_queue_lag_seconds": self.last_queue_lag,
+                "max_queue_lag_seconds": self.max_queue_lag,
+                "last_sync_duration_seconds": self.last_sync_duration,
+                "last_sync_finished": self.last_sync_finished,
+                "last_result": self.last_result,
+                "last_error": self.last_error,
+            }
@@ -0,0 +1,146 @@
+# File: task_queue.py - Durable SQLite task queue with leases and retries
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, List
+
+
+@dataclass
+class Task:
+    task_id: str
+    payload: dict
+    attempts: int
+
+
+class TaskQueue:
+    '''
+    Tasks are shared through one SQLite file, so any number of worker processes (or containers with
+    the file on a shared volume) can consume them. A leased task that is not completed before its lease
+    expires (worker crashed) becomes available again, failed tasks are retried with a backoff.
+    '''
+    LEASE_SECONDS = 300
+    MAX_ATTEMPTS = 3
+    RETRY_BACKOFF_SECONDS = 10
+
+    def __init__(self, path: str = None, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path or os.getenv("TASK_QUEUE_PATH", "tasks.db")
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL,
+                    lease_owner TEXT,
+                    lease_until REAL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, available_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # autocommit mode, transactions are opened explicitly where needed (closing rolls back unfinished ones)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, tasks: Dict[str, dict]) -> int:
+        # task_id -> payload, already enqueued tasks are ignored (enqueueing is idempotent)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO tasks (task_id, payload, available_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(task_id, json.dumps(payload), now, now, now) for task_id, payload in tasks.items()]
+            )
+            conn.execute("COMMIT")
+            return cursor.rowcount
+
+    def lease(self, worker_id: str, n: int = 1) -> List[Task]:
+        # atomically take up to n available tasks (pending or with an expired lease)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # worker died too many times on the same task
+            conn.execute(
+                "UPDATE tasks SET status = 'failed', last_error = 'lease expired', updated_at = ? WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            rows = conn.execute(
+                """
+                SELECT task_id, payload, attempts FROM tasks
+                WHERE (status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_until < ?)
+                ORDER BY created_at LIMIT ?
+                """,
+                (now, now, n)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET status = 'leased', lease_owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? WHERE task_id = ?",
+                [(worker_id, now + self.lease_seconds, now, row[0]) for row in rows]
+            )
+            conn.execute("COMMIT")
+        return [Task(task_id=row[0], payload=json.loads(row[1]), attempts=row[2] + 1) for row in rows]
+
+    def extend_lease(self, task_ids: List[str], worker_id: str):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE tasks SET lease_until = ?, updated_at = ? WHERE task_id = ? AND lease_owner = ? AND status = 'leased'",
+                [(now + self.lease_seconds, now, task_id, worker_id) for task_id in task_ids]
+            )
+
+    def complete(self, task_ids: List[str], worker_id: str):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE tasks SET status = 'done', lease_owner = NULL, lease_until = NULL, updated_at = ? WHERE task_id = ? AND lease_owner = ?",
+                [(now, task_id, worker_id) for task_id in task_ids]
+            )
+
+    def fail(self, task: Task, worker_id: str, error: str):
+        # retry later (exponential backoff) or give up after max_attempts
+        now = time.time()
+        status = "failed" if task.attempts >= self.max_attempts else "pending"
+        available_at = now + self.RETRY_BACKOFF_SECONDS * 2 ** (task.attempts - 1)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE tasks SET status = ?, available_at = ?, lease_owner = NULL, lease_until = NULL, last_error = ?, updated_at = ?
+                WHERE task_id = ? AND lease_owner = ?
+                """,
+                (status, available_at, error, now, task.task_id, worker_id)
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        stats = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+        stats.update(dict(rows))
+        return stats
+
+    def is_drained(self) -> bool:
+        stats = self.stats()
+        return stats["pending"] == 0 and stats["leased"] == 0
+
+    def failed_tasks(self) -> List[dict]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT task_id, attempts, last_error FROM tasks WHERE status = 'failed'").fetchall()
+        return [{"task_id": row[0], "attempts": row[1], "error": row[2]} for row in rows]
+
+    def reset(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM tasks")
@@ -0,0 +1,216 @@
+# File: tenant_vector_store.py - TenantVectorStore module (chunks partitioned by rights into Weaviate tenants)
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import copy
+import os
+import time
+from chunk import Chunk
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from weaviate.classes.config import Configure
+from weaviate.classes.data import DataObject
+from weaviate.classes.query import HybridFusion, MetadataQuery
+from weaviate.classes.tenants import Tenant
+
+import fusion
+from batch_writer import BatchReport, BatchWriter
+from embedding_model import BaseEmbeddingModel
+from fusion import Candidates
+from query_cache import bump_generation
+from utils import color_print
+from vector_store import BaseVectorStore, DeleteReport, VectorStore
+
+
+class TenantVectorStore(VectorStore):
+    '''
+    Multi-tenant collection with one tenant per rights value. A query with rights searches only its tenant
+    (the HNSW and BM25 indexes of the allowed chunks, no filtering of the whole index, autocut over the
+    allowed results), a query without rights searches all tenants and merges the results on the client (fusion.py).
+    Migration from the single collection: scripts/migrate_tenants.py
+    '''
+    TENANTS = {"user": "user", "superior": "superior", "": "unassigned"}  # rights -> tenant (tenant names cannot be empty)
+
+    def __init__(self, collection_name: Optional[str] = None, index: Optional[dict] = None, embedding_model: Optional[BaseEmbeddingModel] = None):
+        super().__init__(
+            collection_name=collection_name or os.getenv("WEAVIATE_TENANT_COLLECTION", "DocumentChunksByRights"),
+            index=index,
+            embedding_model=embedding_model,
+            hierarchical=False  # a tenant is already the searched subset of the chunks
+        )
+
+    def collection_config(self) -> dict:
+        return {**super().collection_config(), "multi_tenancy_config": Configure.multi_tenancy(enabled=True)}
+
+    def get_schema(self):
+        super().get_schema()
+        existing = self.collection.tenants.get()
+        missing = [Tenant(name=tenant) for tenant in self.TENANTS.values() if tenant not in existing]
+        if missing:
+            self.collection.tenants.create(missing)
+        self.partitions = {rights: self.collection.with_tenant(tenant) for rights, tenant in self.TENANTS.items()}
+
+    def tenant_for(self, rights: str) -> str:
+        if rights not in self.TENANTS:
+            raise ValueError(f"No tenant for rights '{rights}'")
+        return self.TENANTS[rights]
+
+    def visible(self, rights: Optional[str]) -> List[str]:
+        # same visibility as the rights filter of VectorStore: rights see their own chunks, no rights see everything
+        return [rights] if rights else list(self.TENANTS)
+
+    def existing_documents(self, file_ids: List[str]) -> Set[str]:
+        # one aggregation per tenant and FILTER_BATCH files
+        existing = set()
+        for batch in self.batches(file_ids):
+            filters = self.file_ids_filter(batch, self.field_file_ids)
+            for partition in self.partitions.values():
+                existing.update(set(self.group_counts(partition, "file_id", filters=filters, limit=len(batch))) & set(batch))
+        return existing
+
+    def insert_chunks(self, chunks: List[Chunk], embeddings: Optional[np.ndarray] = None):
+        # objects of a multi-tenant collection are written per tenant
+        self.insert_chunks_batch(chunks, embeddings=embeddings)
+
+    def insert_chunks_batch(self, chunks: List[Chunk], embeddings: Optional[np.ndarray] = None, batch_writer: Optional[BatchWriter] = None) -> BatchReport:
+        # one batch per tenant (a batch writes into the tenant of its collection), batch_writer sets the mode
+        if not chunks:
+            return BatchReport()
+        for chunk in chunks:
+            self.tenant_for(chunk.rights)
+        embeddings = self.index_vectors(chunks, embeddings, batch_size=100)
+
+        report = BatchReport()
+        for rights, partition in self.partitions.items():
+            indices = [i for i, chunk in enumerate(chunks) if chunk.rights == rights]
+            if not indices:
+                continue
+            writer = copy.copy(batch_writer or BatchWriter(partition))
+            writer.collection = partition
+            partial = writer.write(
+                objects=[chunks[i].to_dict() for i in indices],
+                vectors=embeddings[indices],
+                uuids=[self.chunk_uuid(chunks[i]) for i in indices]
+            )
+            report.objects += partial.objects
+            report.inserted += partial.inserted
+            report.failed += partial.failed
+            report.retried += partial.retried
+            report.seconds += partial.seconds
+            report.batch_size = max(report.batch_size, partial.batch_size)
+            report.errors = sorted(set(report.errors + partial.errors))
+        bump_generation()
+        return report
+
+    def insert_many_chunks(self, chunks: List[Chunk], embeddings: Optional[np.ndarray] = None):
+        # one request per tenant
+        embeddings = self.index_vectors(chunks, embeddings)
+
+        for rights, partition in self.partitions.items():
+            chunk_objs = [
+                DataObject(properties=chunk.to_dict(), vector=embeddings[i], uuid=self.chunk_uuid(chunk))
+                for i, chunk in enumerate(chunks) if chunk.rights == rights
+            ]
+            if not chunk_objs:
+                continue
+            response = partition.data.insert_many(chunk_objs)
+            if response.has_errors:
+                color_print(f"{len(response.errors)} of {len(chunk_objs)} chunks failed to insert into tenant {self.TENANTS[rights]}.", color="red")
+        bump_generation()
+
+    def delete_documents(self, file_ids: List[str], verbose: bool = True) -> DeleteReport:
+        # a file is stored in one tenant, its tenant is not known without a query (one delete per tenant and FILTER_BATCH files)
+        start = time.perf_counter()
+        batches = self.batches(file_ids)
+        report = DeleteReport(files=sum(len(batch) for batch in batches))
+        for batch in batches:
+            filters = self.file_ids_filter(batch, self.field_file_ids)
+            for partition in self.partitions.values():
+                self._delete_where(partition, filters, report)
+        if batches:
+            self.delete_full_vectors(file_ids)
+            bump_generation()
+        report.seconds = time.perf_counter() - start
+        if verbose:
+            color_print(str(report), color="yellow")
+        return report
+
+    def rights_for(self, file_ids: List[str]) -> Dict[str, str]:
+        # the tenant of a stored file is its rights, one aggregation per tenant and FILTER_BATCH files
+        rights = {}
+        for batch in self.batches(file_ids):
+            filters = self.file_ids_filter(batch, self.field_file_ids)
+            for partition_rights, partition in self.partitions.items():
+                for file_id in set(self.group_counts(partition, "file_id", filters=filters, limit=len(batch))) & set(batch):
+                    rights.setdefault(file_id, partition_rights)
+        return rights
+
+    def file_counts(self) -> Dict[str, int]:
+        counts = Counter()
+        for partition in self.partitions.values():
+            counts.update(self.group_counts(partition, "filename"))
+        return dict(counts)
+
+    def _hybrid_search(self, query: str, rights: str = None, k: int = 5, alpha: float = 0.55, autocut: bool = False, vector: Optional[np.ndarray] = None) -> List[Chunk]:
+        assert 0 <= alpha <= 1, "Alpha must be between 0 and 1."
+
+        tenants = self.visible(rights)
+        if len(tenants) > 1 or self.full_vectors is not None:
+            return fusion.hybrid_from_candidates(self.fetch_candidates(query, rights, vector=vector), alpha=alpha, k=k, autocut=autocut)
+
+        embedding = self.query_embedding(query, vector)
+        response = self.partitions[tenants[0]].query.hybrid(
+            query=query,
+            vector=embedding,
+            alpha=alpha,
+            fusion_type=HybridFusion.RELATIVE_SCORE,
+            return_metadata=MetadataQuery(score=True, explain_score=True),
+            limit = k if not autocut else None,
+            auto_limit= k if autocut else None
+        )
+        return self.get_chunks_from_objs(response.objects)
+
+    def _hybrid_search_lean(self, query: str, rights: str = None, k: int = 5, alpha: float = 0.55, autocut: bool = False, explain: bool = False) -> List[Chunk]:
+        tenants = self.visible(rights)
+        if len(tenants) > 1 or self.full_vectors is not None:
+            return self._hybrid_search(query, rights=rights, k=k, alpha=alpha, autocut=autocut)
+
+        embedding = self.embedding_model.embed(query)[0]
+        response = self.partitions[tenants[0]].query.hybrid(
+            query=query,
+            vector=embedding,
+            alpha=alpha,
+            fusion_type=HybridFusion.RELATIVE_SCORE,
+            return_metadata=MetadataQuery(score=True, explain_score=explain),
+            return_properties=self.LEAN_PROPERTIES,
+            limit = k if not autocut else None,
+            auto_limit= k if autocut else None
+        )
+        chunks = self.get_lean_chunks_from_objs(response.objects, explain)
+        for chunk in chunks:
+            chunk.rights = tenants[0]  # the tenant of the chunks is known
+        return chunks
+
+    def hydrate(self, chunks: List[Chunk]) -> List[Chunk]:
+        # one fetch per tenant of the lean chunks
+        for rights, partition in self.partitions.items():
+            missing = [chunk for chunk in chunks if not chunk.file_id and chunk.rights == rights]
+            if missing:
+                self.fill_metadata(partition, missing)
+        return chunks
+
+    def fetch_candidates(self, query: str, rights: str = None, limit: int = BaseVectorStore.CANDIDATES, vector: Optional[np.ndarray] = None) -> Candidates:
+        # result sets of the visible tenants merged by the raw scores, the BM25 scores use the statistics
+        # of their tenant (per-tenant IDF), the cosine similarities are comparable across tenants
+        embedding, full = self.query_vectors(query, vector)
+        tenants = self.visible(rights)
+        with ThreadPoolExecutor(max_workers=len(tenants)) as executor:
+            results = list(executor.map(
+                lambda tenant: self.result_sets(self.partitions[tenant], query, embedding, limit), tenants
+            ))
+
+        keyword = sorted((pair for result in results for pair in result[0]), key=lambda pair: pair[1], reverse=True)
+        vector = sorted((pair for result in results for pair in result[1]), key=lambda pair: pair[1], reverse=True)
+        return self.rescore(Candidates.from_result_sets(keyword=keyword[:limit], vector=vector[:limit]), full)
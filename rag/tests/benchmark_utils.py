@@ -0,0 +1,237 @@
+# benchmark_utils.py - synthetic corpus, result recording and baseline comparison for the benchmark suite
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from chunk import Chunk
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+RESULTS_DIR = "tests/test-sets/benchmarks"
+BASELINE_FILE = os.path.join(RESULTS_DIR, "baseline.json")
+TOLERANCE = 0.2  # relative slowdown reported as a regression
+
+
+def parse_size(size: str) -> int:
+    '''"1000", "10k", "1M" -> number of chunks'''
+    size = size.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(size[-1], 1)
+    return int(float(size.rstrip("km")) * multiplier)
+
+def benchmark_sizes() -> List[int]:
+    # BENCHMARK_SIZES="1k,10k,100k,1M"
+    return [parse_size(size) for size in os.getenv("BENCHMARK_SIZES", "1k").split(",") if size.strip()]
+
+
+class SyntheticCorpus:
+    '''
+    Deterministic text corpus with a Zipf-like word distribution (realistic BM25 posting lists).
+    A chunk is a title and WORDS_PER_CHUNK words (~300 tokens of the embedding model), a document
+    has CHUNKS_PER_DOCUMENT chunks.
+    '''
+    VOCABULARY_SIZE = 20000
+    WORDS_PER_CHUNK = 200
+    WORDS_PER_SENTENCE = 20
+    CHUNKS_PER_DOCUMENT = 20
+    SYLLABLES = ["ka", "lo", "mi", "ne", "ra", "tu", "vi", "so", "pe", "da", "zu", "ri", "mo", "ta", "le", "an", "ex", "or"]
+
+    def __init__(self, seed: int = 42):
+        self.rng = random.Random(seed)
+        self.np_rng = np.random.default_rng(seed)
+        self.vocabulary = np.array(self.make_vocabulary(), dtype=object)
+        # word rank r has probability ~ 1/r
+        self.cumulative = np.cumsum(1.0 / np.arange(1, len(self.vocabulary) + 1))
+
+    def make_vocabulary(self) -> List[str]:
+        words = set()
+        while len(words) < self.VOCABULARY_SIZE:
+            words.add("".join(self.rng.choice(self.SYLLABLES) for _ in range(self.rng.randint(2, 4))))
+        # random ranks, frequent words are not alphabetically related
+        words = sorted(words)
+        self.rng.shuffle(words)
+        return words
+
+    def words(self, n: int) -> List[str]:
+        draws = np.searchsorted(self.cumulative, self.np_rng.random(n) * self.cumulative[-1])
+        return self.vocabulary[np.minimum(draws, len(self.vocabulary) - 1)].tolist()
+
+    def sentences(self, num_words: int) -> str:
+        words = self.words(num_words)
+        sentences = []
+        for i in range(0, len(words), self.WORDS_PER_SENTENCE):
+            sentence = " ".join(words[i:i + self.WORDS_PER_SENTENCE])
+            sentences.append(sentence.capitalize() + ".")
+        return " ".join(sentences)
+
+    def document(self, num_chunks: int) -> str:
+        # titles separated by blank lines from paragraphs, partition_text makes Title and NarrativeText elements
+        sections = []
+        for _ in range(num_chunks):
+            title = " ".join(self.words(3)).title()
+            sections.append(f"{title}\n\n{self.sentences(self.WORDS_PER_CHUNK)}")
+        return "\n\n".join(sections) + "\n"
+
+    def write_documents(self, folder: str, num_chunks: int) -> List[str]:
+        '''writes .txt documents with about num_chunks chunks in total, returns their paths'''
+        os.makedirs(folder, exist_ok=True)
+        paths = []
+        for i in range(0, num_chunks, self.CHUNKS_PER_DOCUMENT):
+            path = os.path.join(folder, f"synthetic_{i // self.CHUNKS_PER_DOCUMENT}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.document(min(self.CHUNKS_PER_DOCUMENT, num_chunks - i)))
+            paths.append(path)
+        return paths
+
+    def chunks(self, num_chunks: int, prefix: str = "synthetic") -> List[Chunk]:
+        '''chunks without partitioning (insert and search benchmarks at sizes the processing cannot reach)'''
+        chunks = []
+        for i in range(num_chunks):
+            file_id = f"{prefix}_{i // self.CHUNKS_PER_DOCUMENT}.txt"
+            chunks.append(Chunk(
+                chunk_id=f"{file_id}_{i % self.CHUNKS_PER_DOCUMENT}",
+                file_id=file_id,
+                text=self.sentences(self.WORDS_PER_CHUNK),
+                filename=file_id,
+                file_directory="benchmark",
+                title=" ".join(self.words(3)).title(),
+                rights="user" if i % 2 else "superior"
+            ))
+        return chunks
+
+    def queries(self, n: int, words_per_query: int = 4) -> List[str]:
+        return [" ".join(self.words(words_per_query)) for _ in range(n)]
+
+    @staticmethod
+    def vectors(n: int, dimension: int, seed: int = 42) -> np.ndarray:
+        # unit vectors, cosine distance behaves as with real embeddings
+        vectors = np.random.default_rng(seed).standard_normal((n, dimension), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+
+def machine_info() -> dict:
+    info = {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        info["memory_gb"] = round(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3, 1)
+    except (ValueError, OSError, AttributeError):
+        pass
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+        info["cuda"] = torch.cuda.get_device_name(0) if torch.cuda.is_available() else None
+    except ImportError:
+        pass
+    try:
+        info["commit"] = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return info
+
+
+class BenchmarkRecorder:
+    '''
+    Collects results of the benchmark stages, saves them as JSON with the machine info and compares
+    them against a stored baseline. Results are keyed by "stage[size]".
+    '''
+    def __init__(self, baseline_file: str = BASELINE_FILE, tolerance: float = TOLERANCE):
+        self.baseline_file = baseline_file
+        self.tolerance = tolerance
+        self.results: Dict[str, dict] = {}
+
+    def record(
+        self,
+        stage: str,
+        size: int,
+        items: int,
+        seconds: float,
+        unit: str = "chunks",
+        latencies: Optional[List[float]] = None,
+        **extra
+    ) -> dict:
+        result = {
+            "stage": stage,
+            "size": size,
+            "items": items,
+            "unit": unit,
+            "seconds": seconds,
+            "throughput": items / seconds if seconds > 0 else 0.0,
+            **extra
+        }
+        if latencies:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            result.update({"p50_ms": p50 * 1000, "p95_ms": p95 * 1000, "p99_ms": p99 * 1000})
+        self.results[f"{stage}[{size}]"] = result
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "machine": machine_info(),
+            "results": self.results
+        }
+
+    def save(self, path: Optional[str] = None) -> str:
+        path = path or os.path.join(RESULTS_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=4)
+        return path
+
+    def load_baseline(self) -> Optional[dict]:
+        if not os.path.exists(self.baseline_file):
+            return None
+        with open(self.baseline_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def compare(self, baseline: dict) -> List[str]:
+        '''regressions against the baseline: lower throughput or higher p95 latency beyond the tolerance'''
+        regressions = []
+        for name, result in self.results.items():
+            reference = baseline["results"].get(name)
+            if reference is None:
+                continue
+            if reference["throughput"] and result["throughput"] < reference["throughput"] * (1 - self.tolerance):
+                regressions.append(
+                    f"{name}: throughput {result['throughput']:.1f} {result['unit']}/s "
+                    f"< baseline {reference['throughput']:.1f} {result['unit']}/s"
+                )
+            if "p95_ms" in result and "p95_ms" in reference and result["p95_ms"] > reference["p95_ms"] * (1 + self.tolerance):
+                regressions.append(f"{name}: p95 {result['p95_ms']:.1f} ms > baseline {reference['p95_ms']:.1f} ms")
+        return regressions
+
+
+class Timer:
+    '''with Timer() as timer: ...; timer.seconds'''
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+
+
+def search_latencies(vector_store, queries: List[str], **kwargs) -> Tuple[List[float], List[List[Chunk]]]:
+    '''latency and results of hybrid_search(query, **kwargs) for each query, after one warm-up search'''
+    vector_store.hybrid_search(queries[0], **kwargs)
+    latencies, results = [], []
+    for query in queries:
+        with Timer() as timer:
+            chunks = vector_store.hybrid_search(query, **kwargs)
+        latencies.append(timer.seconds)
+        results.append(chunks)
+    return latencies, results
@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+from query_cache import query_cache
+from tests.benchmark_utils import BenchmarkRecorder
+from utils import color_print
+
+
+@pytest.fixture(scope="module")
+def benchmark_query_cache():
+    # the benchmarks repeat their queries and measure the searches, not the cache (BENCHMARK_QUERY_CACHE=1 keeps it),
+    # the process-wide cache is restored for the other modules
+    enabled = query_cache.enabled
+    query_cache.enabled = os.getenv("BENCHMARK_QUERY_CACHE") == "1"
+    yield
+    query_cache.enabled = enabled
+
+@pytest.fixture(scope="module")
+def recorder(benchmark_query_cache):
+    # one recorder per benchmark module, its results are saved after the module
+    recorder = BenchmarkRecorder()
+    yield recorder
+    color_print(f"Benchmark results saved to {recorder.save()}", color="blue")
@@ -0,0 +1,75 @@
+# eval_cache.py - persistent cache of the expensive evaluation inputs (rewrites, candidate lists, reranker scores)
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable
+
+CACHE_FILE = "tests/test-sets/cache/eval_cache.jsonl"
+
+
+class EvalCache:
+    '''
+    Append-only JSON lines file of {"kind", "key", "value"} entries, loaded into memory on open.
+    The key is built from everything the value depends on (model, index state, query, ...),
+    a changed parameter makes a new entry instead of reusing a stale one.
+    '''
+    def __init__(self, path: str = CACHE_FILE):
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[(entry["kind"], entry["key"])] = entry["value"]
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha1(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, kind: str, *parts) -> Any:
+        return self.entries.get((kind, self.key(*parts)))
+
+    def put(self, kind: str, value: Any, *parts):
+        key = self.key(*parts)
+        with self._lock:
+            self.entries[(kind, key)] = value
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"kind": kind, "key": key, "value": value}, ensure_ascii=False) + "\n")
+
+    def get_or_compute(self, kind: str, compute: Callable[[], Any], *parts) -> Any:
+        # compute must return a JSON serializable value
+        value = self.get(kind, *parts)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = compute()
+        self.put(kind, value, *parts)
+        return value
+
+
+def index_state(vector_store) -> dict:
+    '''the searched index in the retrieval keys, a re-ingest or a changed index setting makes new entries'''
+    counts = vector_store.file_counts()
+    reduction = getattr(vector_store.embedding_model, "reduction", None)
+    index = getattr(vector_store, "index", None)
+    return {
+        "store": type(vector_store).__name__,
+        "collection": vector_store.collection_name,
+        "embedding_model": vector_store.EMBEDDING_MODEL,
+        "files": len(counts),
+        "chunks": sum(counts.values()),
+        "config": EvalCache.key(
+            index if isinstance(index, dict) else None,
+            getattr(vector_store, "hierarchical", False),
+            [reduction.method, reduction.dimension, reduction.path] if reduction else None
+        )
+    }
@@ -0,0 +1,118 @@
+# eval_report.py - quality vs. latency and cost of the evaluated configurations (Pareto frontier)
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+#
+# Input is a run file of tests/eval_runner.py (every record has the stage timings and token usage of its case).
+# Latencies are measured when a value is computed and cached with it, a cached re-run reports the same costs.
+# Run the measured evaluation with EVAL_WORKERS=1 for latencies without contention between the cases.
+# Run from rag/: EVAL_REPORT_RUN=<run file> python -m tests.eval_report
+
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from utils import color_print
+
+# USD per 1M tokens (input, output)
+PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60)
+}
+STAGES = ["rewrite_query", "hybrid_search", "reranking", "llm_query", "total"]
+QUALITY = {"retrieval": "recall@1", "ragas": "factual_correctness(mode=f1)"}  # EVAL_QUALITY overrides (any summary metric)
+RUN_FILE = os.getenv("EVAL_REPORT_RUN", "")
+
+
+def price(model: str, prompt_tokens: float, completion_tokens: float) -> float:
+    input_price, output_price = PRICES.get(model, PRICES["gpt-4o"])
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+def cost_summary(records: List[dict]) -> dict:
+    # latency percentiles per stage and tokens / cost per query
+    latency = {}
+    for stage in STAGES:
+        values = [record["timings"][stage] for record in records if stage in record.get("timings", {})]
+        if values:
+            p50, p95 = np.percentile(values, [50, 95]) * 1000
+            latency[stage] = {"p50_ms": float(p50), "p95_ms": float(p95)}
+
+    tokens = {}
+    cost = 0.0
+    for step in ["rewrite", "generation"]:
+        usages = [record["usage"][step] for record in records if step in record.get("usage", {})]
+        if not usages:
+            continue
+        prompt = sum(usage.get("prompt_tokens", 0) for usage in usages) / len(records)
+        completion = sum(usage.get("completion_tokens", 0) for usage in usages) / len(records)
+        tokens[step] = {"prompt_tokens": prompt, "completion_tokens": completion}
+        cost += price(usages[0].get("model", ""), prompt, completion)
+
+    # retrieval runs do not generate, the context is counted as the prompt of the answer
+    context = [record["usage"]["context_tokens"] for record in records if "context_tokens" in record.get("usage", {})]
+    if context and "generation" not in tokens:
+        tokens["context"] = {"prompt_tokens": sum(context) / len(records)}
+        cost += price(records[0]["config"]["model"], tokens["context"]["prompt_tokens"], 0)
+    return {"latency": latency, "tokens": tokens, "cost_per_query": cost}
+
+def pareto_frontier(rows: List[dict], quality: str) -> List[dict]:
+    # configurations no other configuration beats in quality, p95 latency and cost at once
+    def point(row):
+        return (row[quality], -row["latency"]["total"]["p95_ms"], -row["cost_per_query"])
+
+    frontier = []
+    for row in rows:
+        dominated = any(
+            all(a >= b for a, b in zip(point(other), point(row))) and point(other) != point(row)
+            for other in rows
+        )
+        if not dominated:
+            frontier.append(row)
+    return sorted(frontier, key=lambda row: row["latency"]["total"]["p95_ms"])
+
+def print_frontier(frontier: List[dict], quality: str, parameters: List[str]):
+    color_print(f"\n=== Pareto frontier ({quality} vs. p95 latency and cost) ===")
+    for row in frontier:
+        color_print(
+            ", ".join(f"{name}={row[name]}" for name in parameters) + ": ",
+            color="yellow",
+            additional_text=(
+                f"{quality} {row[quality]:.3f}, p95 {row['latency']['total']['p95_ms']:.0f} ms, "
+                f"${row['cost_per_query'] * 1000:.3f} / 1k queries"
+            )
+        )
+
+def report(rows: List[dict], mode: str, parameters: List[str]) -> Dict[str, list]:
+    # rows: configuration + quality metrics + cost_summary(), returns the report saved by the runner
+    quality = os.getenv("EVAL_QUALITY") or QUALITY[mode]
+    measured = [row for row in rows if quality in row and "total" in row["latency"]]
+    if not measured:
+        color_print(f"No configuration has {quality} and the latencies, Pareto frontier skipped.", color="red")
+        return {"quality": quality, "pareto": []}
+    frontier = pareto_frontier(measured, quality)
+    print_frontier(frontier, quality, parameters)
+    return {"quality": quality, "pareto": frontier}
+
+
+if __name__ == "__main__":
+    from tests.eval_runner import DEFAULTS, retrieval_summary
+
+    with open(RUN_FILE, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    mode = "retrieval" if "rank" in records[0] else "ragas"
+    if mode == "ragas":
+        color_print("RAGAS scores are not part of the run file, use the runner with EVAL_RAGAS_SCORE=1.", color="red")
+        exit()
+
+    grouped: Dict[str, List[dict]] = {}
+    for record in records:
+        grouped.setdefault(record["config_id"], []).append(record)
+    rows = [{**retrieval_summary(group[0]["config"], group), **cost_summary(group)} for group in grouped.values()]
+
+    result = report(rows, mode, list(DEFAULTS))
+    output = os.path.splitext(RUN_FILE)[0] + "_report.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"run_file": RUN_FILE, "configurations": rows, **result}, f, indent=4)
+    color_print(f"Report saved to {output}", color="blue")
@@ -0,0 +1,312 @@
+# eval_runner.py - parallel, cached and resumable evaluation over a parameter grid
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+#
+# modes: retrieval - metrics of retrieval_eval.py per configuration
+#        ragas     - responses in the format of ragas_evaluation.py per configuration (EVAL_RAGAS_SCORE=1 scores them)
+# EVAL_GRID: JSON file {"mode": "retrieval", "testset": "...", "grid": {"alpha": [0.5, 0.55], "top_k": [1, 3]}}
+#            (example tests/test-sets/eval_grid.json),
+#            parameters missing in the grid use DEFAULTS, every combination is one configuration
+# Rewrites, retrieval results and answers are cached (tests/eval_cache.py) under all parameters they depend on,
+# the run file gets one line per finished case, EVAL_RESUME=<run file> continues an interrupted run.
+# Every case records its stage latencies and token usage, the summary adds the cost of each configuration
+# and the Pareto frontier of quality vs. p95 latency and cost (tests/eval_report.py).
+# Run from rag/: python -m tests.eval_runner
+
+import itertools
+import json
+import os
+import threading
+import time
+from chunk import Chunk
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+from llm_wraper import LLMWrapper
+from rewriter import Rewriter
+from tests.eval_cache import CACHE_FILE, EvalCache, index_state
+from tests.eval_report import cost_summary, report
+from utils import color_print
+from vector_store import VectorStoreFactory
+
+load_dotenv()
+
+DEFAULTS = {
+    "rewriting": True,
+    "alpha": 0.55,
+    "autocut": True,
+    "top_k": 1,
+    "reranking": False,
+    "reranker_cutoff": 0.5,
+    "model": "gpt-4o",
+    "temperature": 0.2
+}
+TESTSETS = {
+    "retrieval": "tests/test-sets/queries_retrieval_cursed.jsonl",
+    "ragas": "tests/test-sets/ragas_multi_hop.jsonl"
+}
+GRID_FILE = os.getenv("EVAL_GRID", "")
+MODE = os.getenv("EVAL_MODE", "retrieval")                       # used without a grid file
+WORKERS = int(os.getenv("EVAL_WORKERS", "8"))                    # test cases evaluated concurrently
+LLM_CONCURRENCY = int(os.getenv("EVAL_LLM_CONCURRENCY", "4"))    # OpenAI requests in flight (rate limits)
+RESUME = os.getenv("EVAL_RESUME", "")
+RAGAS_SCORE = bool(os.getenv("EVAL_RAGAS_SCORE"))
+RESULTS_DIR = "tests/test-sets/results"
+
+
+def load_grid() -> Tuple[str, str, List[dict]]:
+    spec = {"mode": MODE, "grid": {}}
+    if GRID_FILE:
+        with open(GRID_FILE, "r", encoding="utf-8") as f:
+            spec.update(json.load(f))
+    mode = spec["mode"]
+    testset = spec.get("testset") or TESTSETS[mode]
+
+    unknown = set(spec["grid"]) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown grid parameters: {', '.join(sorted(unknown))}")
+    values = {name: spec["grid"].get(name, [default]) for name, default in DEFAULTS.items()}
+    configs = [dict(zip(values, combination)) for combination in itertools.product(*values.values())]
+    return mode, testset, configs
+
+def config_id(config: dict) -> str:
+    return EvalCache.key(config)[:12]
+
+def cached_rewrite(cache: EvalCache, query: str, llm_slots: Optional[threading.BoundedSemaphore] = None) -> dict:
+    # rewritten query with the latency and token usage of the rewrite (shared with tests/fusion_sweep.py)
+    def compute():
+        usage = {"model": Rewriter.MODEL}
+        with llm_slots or nullcontext():
+            start = time.perf_counter()
+            text = Rewriter.rewrite(query, usage=usage)
+            return {"text": text, "seconds": time.perf_counter() - start, "usage": usage}
+    return cache.get_or_compute("rewrite", compute, Rewriter.MODEL, query)
+
+
+class EvalRunner:
+    def __init__(self, mode: str, testset: str, configs: List[dict], cache: EvalCache, run_file: str):
+        self.mode = mode
+        self.configs = configs
+        self.cache = cache
+        self.run_file = run_file
+        with open(testset, "r", encoding="utf-8") as f:
+            self.cases = [json.loads(line) for line in f if line.strip()]
+
+        self.vector_store = VectorStoreFactory.get_store()
+        self.index_state = index_state(self.vector_store)
+        self.llm_wrapper = LLMWrapper() if mode == "ragas" else None
+        self.llm_slots = threading.BoundedSemaphore(LLM_CONCURRENCY)
+        self._write_lock = threading.Lock()
+
+        # finished cases of the resumed run
+        self.records: List[dict] = []
+        if os.path.exists(run_file):
+            with open(run_file, "r", encoding="utf-8") as f:
+                self.records = [json.loads(line) for line in f if line.strip()]
+        self.done = {(record["config_id"], record["index"]) for record in self.records}
+
+    # ----------------------------------------------------------------------------------------------------
+    # cached values keep the latency and token usage measured when they were computed
+    def rewrite(self, query: str, config: dict) -> dict:
+        if not config["rewriting"]:
+            return {"text": query, "seconds": 0.0, "usage": {}}
+        return cached_rewrite(self.cache, query, self.llm_slots)
+
+    def retrieve(self, search_query: str, config: dict) -> dict:
+        def compute():
+            start = time.perf_counter()
+            chunks = self.vector_store.hybrid_search(query=search_query, alpha=config["alpha"], autocut=config["autocut"], k=config["top_k"])
+            return {"chunks": [vars(chunk) for chunk in chunks], "seconds": time.perf_counter() - start}
+
+        parameters = {name: config[name] for name in ["alpha", "autocut", "top_k"]}
+        return self.cache.get_or_compute("retrieval", compute, self.index_state, search_query, parameters)
+
+    def rerank(self, search_query: str, chunks: List[Chunk], config: dict) -> dict:
+        from reranker import Reranker
+
+        def compute():
+            start = time.perf_counter()
+            reranked = Reranker.rerank(search_query, chunks, cutoff=config["reranker_cutoff"])
+            return {"chunks": [vars(chunk) for chunk in reranked], "seconds": time.perf_counter() - start}
+
+        chunk_ids = [chunk.chunk_id for chunk in chunks]
+        return self.cache.get_or_compute("rerank", compute, Reranker.MODEL, search_query, chunk_ids, config["reranker_cutoff"])
+
+    def answer(self, query: str, chunks: List[Chunk], config: dict) -> dict:
+        # keyed by the messages, a changed prompt or context is a new entry
+        messages = LLMWrapper.construct_messages(query, chunks)
+
+        def compute():
+            usage = {"model": config["model"]}
+            with self.llm_slots:
+                start = time.perf_counter()
+                result = self.llm_wrapper.get_response(query=query, chunks=chunks, model=config["model"], temperature=config["temperature"], usage=usage)
+                seconds = time.perf_counter() - start
+            if isinstance(result, str):  # API error, not cached
+                raise RuntimeError(result)
+            response, input_tokens = result
+            return {"response": response, "input_tokens": input_tokens, "seconds": seconds, "usage": usage}
+
+        return self.cache.get_or_compute("answer", compute, config["model"], config["temperature"], messages)
+
+    # ----------------------------------------------------------------------------------------------------
+    def run_case(self, config: dict, index: int, case: dict) -> dict:
+        query = case["query"] if self.mode == "retrieval" else case["user_input"]
+        rewrite = self.rewrite(query, config)
+        search_query = rewrite["text"]
+        retrieval = self.retrieve(search_query, config)
+        chunks = [Chunk(**chunk) for chunk in retrieval["chunks"]]
+
+        # stages named as the Server-Timing of /query
+        timings = {"rewrite_query": rewrite["seconds"], "hybrid_search": retrieval["seconds"]}
+        usage = {"rewrite": rewrite["usage"]} if rewrite["usage"] else {}
+        if config["reranking"]:
+            reranking = self.rerank(search_query, chunks, config)
+            chunks = [Chunk(**chunk) for chunk in reranking["chunks"]]
+            timings["reranking"] = reranking["seconds"]
+
+        record = {"config_id": config_id(config), "config": config, "index": index, "query": query, "search_query": search_query}
+        if self.mode == "retrieval":
+            retrieved_ids = [chunk.chunk_id.split("/")[-1] for chunk in chunks]
+            expected_id = case["expected_chunk_id"]
+            # prompt of the answer that would be generated from the retrieved context
+            usage["context_tokens"] = LLMWrapper.count_tokens(LLMWrapper.construct_messages(query, chunks), config["model"])
+            record.update(
+                expected_chunk_id=expected_id,
+                retrieved_ids=retrieved_ids,
+                rank=retrieved_ids.index(expected_id) + 1 if expected_id in retrieved_ids else None
+            )
+        else:
+            answer = self.answer(query, chunks, config)
+            timings["llm_query"] = answer["seconds"]
+            usage["generation"] = answer["usage"]
+            record.update(
+                retrieved_contexts=[chunk.text for chunk in chunks],
+                reference_contexts=case["reference_contexts"],
+                response=answer["response"],
+                reference=case["reference"],
+                input_tokens=answer["input_tokens"]
+            )
+
+        timings["total"] = sum(timings.values())
+        record.update(timings=timings, usage=usage)
+        return record
+
+    def save(self, record: dict):
+        with self._write_lock:
+            self.records.append(record)
+            with open(self.run_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def run(self):
+        pending = [
+            (config, index, case)
+            for config in self.configs
+            for index, case in enumerate(self.cases)
+            if (config_id(config), index) not in self.done
+        ]
+        color_print(f"{len(self.configs)} configurations x {len(self.cases)} cases, {len(pending)} to run", color="yellow")
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            futures = {executor.submit(self.run_case, *task): task for task in pending}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Evaluating", unit="case"):
+                try:
+                    self.save(future.result())
+                except Exception as e:
+                    # the case stays pending, EVAL_RESUME runs it again
+                    failed += 1
+                    config, index, _ = futures[future]
+                    color_print(f"[{config_id(config)}:{index}] {type(e).__name__}: {e}", color="red")
+        self.vector_store.close()
+        return failed
+
+    def records_by_config(self) -> Dict[str, List[dict]]:
+        grouped = {config_id(config): [] for config in self.configs}
+        for record in self.records:
+            if record["config_id"] in grouped:
+                grouped[record["config_id"]].append(record)
+        for records in grouped.values():
+            records.sort(key=lambda record: record["index"])
+        return grouped
+
+
+def retrieval_summary(config: dict, records: List[dict]) -> dict:
+    # metrics of retrieval_eval.py
+    total = len(records)
+    ranks = [record["rank"] for record in records if record["rank"]]
+    return {
+        **config,
+        "total": total,
+        "recall@1": sum(rank == 1 for rank in ranks) / total,
+        "in context": len(ranks) / total,
+        "not found": total - len(ranks),
+        "average_rank": sum(ranks) / len(ranks) if ranks else 0,
+        "average_context_size": sum(len(record["retrieved_ids"]) for record in records) / total
+    }
+
+def save_ragas_dataset(testset: str, config: dict, records: List[dict], timestamp: str) -> str:
+    # dataset file of ragas_evaluation.py (metadata line + samples), input of its evaluation()
+    tokens = [record["input_tokens"] for record in records if record["input_tokens"] is not None]
+    metadata = {"__metadata__": {
+        "TESTSET": testset,
+        **{name.upper(): value for name, value in config.items()},
+        "average_input_tokens": sum(tokens) / len(tokens) if tokens else 0
+    }}
+    path = os.path.join(RESULTS_DIR, f"ragas_results_{timestamp}_{config_id(config)}.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(metadata) + "\n")
+        for record in records:
+            sample = {key: record[key] for key in ["retrieved_contexts", "reference_contexts", "response", "reference"]}
+            f.write(json.dumps({"user_input": record["query"], **sample}) + "\n")
+    return path
+
+
+if __name__ == "__main__":
+    mode, testset, configs = load_grid()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    run_file = RESUME or os.path.join(RESULTS_DIR, f"eval_run_{timestamp}.jsonl")
+
+    cache = EvalCache(CACHE_FILE)
+    runner = EvalRunner(mode, testset, configs, cache, run_file)
+    start = time.perf_counter()
+    failed = runner.run()
+    color_print(f"Run file: {run_file}, {time.perf_counter() - start:.1f}s, cache hits {cache.hits}, misses {cache.misses}", color="yellow")
+    if failed:
+        color_print(f"{failed} cases failed, continue with EVAL_RESUME={run_file}", color="red")
+
+    grouped = runner.records_by_config()
+    if mode == "retrieval":
+        summaries = [
+            {**retrieval_summary(config, grouped[config_id(config)]), **cost_summary(grouped[config_id(config)])}
+            for config in configs if grouped[config_id(config)]
+        ]
+        color_print("\n=== Retrieval Evaluation Summary ===")
+        color_print(f"File: {testset}", color="yellow")
+        for summary in sorted(summaries, key=lambda s: (s["recall@1"], s["in context"]), reverse=True):
+            parameters = ", ".join(f"{name}={summary[name]}" for name in DEFAULTS)
+            color_print(f"{parameters}: ", color="yellow", additional_text=f"recall@1 {summary['recall@1']:.3f}, in context {summary['in context']:.3f}, context size {summary['average_context_size']:.2f}")
+    else:
+        summaries = []
+        for config in configs:
+            records = grouped[config_id(config)]
+            if len(records) < len(runner.cases):
+                color_print(f"[{config_id(config)}] incomplete ({len(records)}/{len(runner.cases)}), not saved", color="red")
+                continue
+            path = save_ragas_dataset(testset, config, records, timestamp)
+            color_print(f"[{config_id(config)}] responses saved to {path}", color="blue")
+            summary = {**config, "dataset": path, **cost_summary(records)}
+            if RAGAS_SCORE:
+                from tests.ragas_evaluation import evaluation
+                summary.update(evaluation(dataset_name=path))
+            summaries.append(summary)
+
+    output = os.path.join(RESULTS_DIR, f"eval_summary_{timestamp}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"testset": testset, "run_file": run_file, "summaries": summaries, **report(summaries, mode, list(DEFAULTS))}, f, indent=4)
+    color_print(f"Summary saved to {output}", color="blue")
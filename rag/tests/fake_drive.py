@@ -0,0 +1,238 @@
+# fake_drive.py - local stand-in for the Google Drive v3 API (load tests)
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import json
+import re
+import threading
+import time
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Union
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeDriveServer:
+    '''
+    Serves the part of Drive v3 used by GoogleDriveDownloader: files.list/get/get_media,
+    changes.getStartPageToken/list/watch and channels.stop. Every change is announced to the
+    watching channels with a webhook (X-Goog-Resource-State: change), as the Drive does.
+    Usage: with FakeDriveServer() as drive: os.environ["GOOGLE_DRIVE_API_ENDPOINT"] = drive.api_endpoint
+    '''
+    FOLDER = "application/vnd.google-apps.folder"
+
+    def __init__(self, latency: float = 0.0, webhooks: bool = True):
+        self.latency = latency      # seconds per request
+        self.webhooks = webhooks    # notify the watch channels about changes
+        self.files = {}             # file id -> metadata and content
+        self.changes = []           # file ids in the order of changes, page token n = changes[n - 1:]
+        self.channels = {}          # channel id -> webhook address
+        self.requests = []          # (method, endpoint) of every request
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def api_endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/drive/v3/"
+
+    @staticmethod
+    def folder_url(folder_id: str) -> str:
+        return f"https://drive.google.com/drive/folders/{folder_id}"
+
+    # ----------------------------------------------------------------------------------------------------
+    def add_folder(self, name: str, parent: Optional[str] = None) -> str:
+        return self._add(name, self.FOLDER, b"", parent)
+
+    def add_file(self, name: str, content: Union[str, bytes], parent: Optional[str] = None, mime_type: str = "text/plain") -> str:
+        return self._add(name, mime_type, content, parent)
+
+    def update_file(self, file_id: str, content: Union[str, bytes]):
+        with self._lock:
+            self.files[file_id]["content"] = content.encode("utf-8") if isinstance(content, str) else content
+        self._change(file_id)
+
+    def trash_file(self, file_id: str):
+        with self._lock:
+            self.files[file_id]["trashed"] = True
+        self._change(file_id)
+
+    def delete_file(self, file_id: str):
+        with self._lock:
+            del self.files[file_id]
+        self._change(file_id)
+
+    def _add(self, name, mime_type, content, parent) -> str:
+        file_id = uuid.uuid4().hex
+        with self._lock:
+            self.files[file_id] = {
+                "id": file_id,
+                "name": name,
+                "mimeType": mime_type,
+                "parents": [parent] if parent else [],
+                "trashed": False,
+                "content": content.encode("utf-8") if isinstance(content, str) else content
+            }
+        self._change(file_id)
+        return file_id
+
+    def _change(self, file_id: str):
+        with self._lock:
+            self.changes.append(file_id)
+            channels = list(self.channels.items())
+        if self.webhooks:
+            for channel_id, address in channels:
+                threading.Thread(target=self._notify, args=(channel_id, address), daemon=True).start()
+
+    @staticmethod
+    def _notify(channel_id: str, address: str):
+        request = urllib.request.Request(address, data=b"", method="POST", headers={
+            "X-Goog-Channel-Id": channel_id,
+            "X-Goog-Resource-Id": "fake-resource",
+            "X-Goog-Resource-State": "change"
+        })
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+        except OSError:
+            pass  # the Drive does not retry failed notifications either
+
+    def metadata(self, file_id: str) -> Optional[dict]:
+        file = self.files.get(file_id)
+        if file is None:
+            return None
+        return {key: value for key, value in file.items() if key != "content"}
+
+    # ----------------------------------------------------------------------------------------------------
+    def start(self) -> "FakeDriveServer":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status: int, body: Optional[dict] = None):
+                payload = json.dumps(body).encode("utf-8") if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def not_found(self, what: str):
+                self.send_json(404, {"error": {"code": 404, "message": f"{what} not found", "errors": [{"reason": "notFound"}]}})
+
+            def route(self, method: str):
+                url = urlsplit(self.path)
+                endpoint = url.path.split("/drive/v3/", 1)[-1].strip("/")
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                with fake._lock:
+                    fake.requests.append((method, endpoint))
+                if fake.latency:
+                    time.sleep(fake.latency)
+                return endpoint, params
+
+            def do_GET(self):
+                endpoint, params = self.route("GET")
+                if endpoint == "files":
+                    self.list_files(params)
+                elif endpoint.startswith("files/"):
+                    self.get_file(endpoint.split("/", 1)[1], params)
+                elif endpoint == "changes/startPageToken":
+                    with fake._lock:
+                        self.send_json(200, {"kind": "drive#startPageToken", "startPageToken": str(len(fake.changes) + 1)})
+                elif endpoint == "changes":
+                    self.list_changes(params)
+                else:
+                    self.not_found(f"Endpoint {endpoint}")
+
+            def do_POST(self):
+                endpoint, params = self.route("POST")
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if endpoint == "changes/watch":
+                    with fake._lock:
+                        fake.channels[body["id"]] = body["address"]
+                    self.send_json(200, {
+                        "kind": "api#channel",
+                        "id": body["id"],
+                        "resourceId": "fake-resource",
+                        "expiration": str(int((time.time() + 3600) * 1000))
+                    })
+                elif endpoint == "channels/stop":
+                    with fake._lock:
+                        fake.channels.pop(body.get("id"), None)
+                    self.send_json(204)
+                else:
+                    self.not_found(f"Endpoint {endpoint}")
+
+            def list_files(self, params: dict):
+                # only the query used by the downloader: "'<folder id>' in parents and trashed=false"
+                match = re.search(r"'([^']+)' in parents", params.get("q", ""))
+                folder_id = match.group(1) if match else None
+                with fake._lock:
+                    files = [
+                        fake.metadata(file_id) for file_id, file in fake.files.items()
+                        if not file["trashed"] and (folder_id is None or folder_id in file["parents"])
+                    ]
+                offset = int(params.get("pageToken") or 0)
+                page_size = int(params.get("pageSize") or 100)
+                body = {"kind": "drive#fileList", "files": files[offset:offset + page_size]}
+                if offset + page_size < len(files):
+                    body["nextPageToken"] = str(offset + page_size)
+                self.send_json(200, body)
+
+            def get_file(self, file_id: str, params: dict):
+                with fake._lock:
+                    file = fake.files.get(file_id)
+                    metadata = fake.metadata(file_id)
+                if file is None:
+                    self.not_found(f"File {file_id}")
+                elif params.get("alt") == "media":
+                    self.send_response(200)
+                    self.send_header("Content-Type", file["mimeType"])
+                    self.send_header("Content-Length", str(len(file["content"])))
+                    self.end_headers()
+                    self.wfile.write(file["content"])
+                else:
+                    self.send_json(200, metadata)
+
+            def list_changes(self, params: dict):
+                token = int(params["pageToken"])
+                page_size = int(params.get("pageSize") or 100)
+                with fake._lock:
+                    file_ids = fake.changes[token - 1:token - 1 + page_size]
+                    changes = []
+                    for file_id in file_ids:
+                        metadata = fake.metadata(file_id)
+                        change = {"kind": "drive#change", "changeType": "file", "fileId": file_id, "removed": metadata is None}
+                        if metadata is not None:
+                            change["file"] = metadata
+                        changes.append(change)
+                    next_token = token + len(file_ids)
+                    body = {"kind": "drive#changeList", "changes": changes}
+                    if next_token <= len(fake.changes):
+                        body["nextPageToken"] = str(next_token)
+                    else:
+                        body["newStartPageToken"] = str(next_token)
+                self.send_json(200, body)
+
+        return Handler
@@ -0,0 +1,186 @@
+# fake_openai.py - local stand-in for the OpenAI API (tests and benchmarks)
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+
+class FakeOpenAIServer:
+    '''
+    Serves POST /v1/embeddings with deterministic vectors derived from the input text
+    and POST /v1/chat/completions (a non-streaming request echoes the user message, which makes it
+    an identity query rewriter, a streaming request answers with completion_tokens tokens).
+    Usage: with FakeOpenAIServer() as server: OpenAI(base_url=server.base_url, api_key="fake")
+    '''
+    def __init__(
+        self,
+        dimension: int = 8,
+        latency: float = 0.0,
+        fail_first: int = 0,
+        max_inputs: int = 2048,
+        shuffle: bool = True,
+        completion_tokens: int = 50,
+        tokens_per_second: float = 0.0
+    ):
+        self.dimension = dimension
+        self.latency = latency                      # seconds per request (time to first token when streaming)
+        self.fail_first = fail_first                # number of requests answered with 429 before serving
+        self.max_inputs = max_inputs                # requests with more inputs are rejected with 400
+        self.shuffle = shuffle                      # return the data items in a random order (clients must use index)
+        self.completion_tokens = completion_tokens  # tokens of a streamed answer
+        self.tokens_per_second = tokens_per_second  # streaming rate, 0 streams without delay
+        self.requests = []              # (endpoint, number of inputs) of every request
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @staticmethod
+    def fake_embedding(text: str, dimension: int) -> List[float]:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [digest[i % len(digest)] / 255.0 for i in range(dimension)]
+
+    @staticmethod
+    def message_text(message: dict) -> str:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            return " ".join(part.get("text", "") for part in content)
+        return content
+
+    def start(self) -> "FakeOpenAIServer":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _record(self, endpoint: str, num_inputs: int) -> int:
+        with self._lock:
+            self.requests.append((endpoint, num_inputs))
+            return len(self.requests)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status: int, body: dict, headers: dict = None):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def read_json(self) -> dict:
+                length = int(self.headers.get("Content-Length", 0))
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_POST(self):
+                if self.path.rstrip("/").endswith("/embeddings"):
+                    self.embeddings(self.read_json())
+                elif self.path.rstrip("/").endswith("/chat/completions"):
+                    self.chat_completions(self.read_json())
+                else:
+                    self.send_json(404, {"error": {"message": f"Unknown endpoint {self.path}"}})
+
+            def embeddings(self, body: dict):
+                inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+                request_number = fake._record("embeddings", len(inputs))
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                if request_number <= fake.fail_first:
+                    self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}, {"retry-after": "0"})
+                    return
+                if len(inputs) > fake.max_inputs or any(not text for text in inputs):
+                    self.send_json(400, {"error": {"message": "Invalid input", "type": "invalid_request_error"}})
+                    return
+
+                data = [
+                    {"object": "embedding", "index": i, "embedding": fake.fake_embedding(text, fake.dimension)}
+                    for i, text in enumerate(inputs)
+                ]
+                if fake.shuffle:
+                    random.shuffle(data)
+                tokens = sum(len(text.split()) for text in inputs)
+                self.send_json(200, {
+                    "object": "list",
+                    "data": data,
+                    "model": body.get("model", ""),
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+                })
+
+            def chat_completions(self, body: dict):
+                request_number = fake._record("chat/completions", len(body.get("messages", [])))
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                if request_number <= fake.fail_first:
+                    self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}, {"retry-after": "0"})
+                    return
+
+                query = fake.message_text(body["messages"][-1])
+                prompt_tokens = sum(len(fake.message_text(message).split()) for message in body["messages"])
+                common = {"id": f"chatcmpl-fake-{request_number}", "created": int(time.time()), "model": body.get("model", "")}
+
+                if not body.get("stream"):
+                    self.send_json(200, {
+                        **common,
+                        "object": "chat.completion",
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": query}, "finish_reason": "stop"}],
+                        "usage": {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": len(query.split()),
+                            "total_tokens": prompt_tokens + len(query.split())
+                        }
+                    })
+                    return
+
+                # server-sent events, the connection is closed after [DONE] (HTTP/1.0)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+
+                def event(delta: dict, finish_reason=None):
+                    chunk = {**common, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                try:
+                    event({"role": "assistant", "content": ""})
+                    for i in range(fake.completion_tokens):
+                        if fake.tokens_per_second:
+                            time.sleep(1.0 / fake.tokens_per_second)
+                        event({"content": f"token{i} "})
+                    event({}, finish_reason="stop")
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client stopped reading the stream
+                    pass
+
+        return Handler
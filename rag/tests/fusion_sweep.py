@@ -0,0 +1,213 @@
+# fusion_sweep.py - retrieval evaluation over an alpha x k x autocut x reranker cutoff grid
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+#
+# The BM25 and vector candidate lists of every query are fetched once (and cached with the rewrites and
+# the reranker scores in tests/eval_cache.py), the hybrid fusion, autocut and reranking of the whole grid
+# run locally (fusion.py). Same metrics as retrieval_eval.py. Run from rag/: python -m tests.fusion_sweep
+
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from tqdm import tqdm
+
+import fusion
+from fusion import Candidates
+from tests.eval_cache import CACHE_FILE, EvalCache, index_state
+from utils import color_print
+from vector_store import BaseVectorStore, VectorStoreFactory
+
+load_dotenv()
+
+def env_list(name: str, default: str, cast=float) -> list:
+    return [cast(value) for value in os.getenv(name, default).split(",") if value.strip()]
+
+QUERY_FILE = os.getenv("SWEEP_QUERY_FILE", "tests/test-sets/queries_retrieval_cursed.jsonl")
+ALPHAS = np.round(np.array(env_list("SWEEP_ALPHAS", ",".join(str(a / 20) for a in range(21)))), 4)
+TOP_KS = env_list("SWEEP_TOP_K", "1,3,5", int)
+AUTOCUTS = [bool(value) for value in env_list("SWEEP_AUTOCUT", "0,1", int)]
+RERANK_CUTOFFS = [None] + env_list("SWEEP_RERANK_CUTOFFS", "")     # None = without reranking, e.g. "0,0.5"
+REWRITING = [bool(value) for value in env_list("SWEEP_REWRITING", "0,1", int)]
+RIGHTS = os.getenv("SWEEP_RIGHTS") or None
+CURVE = {"k": 1, "autocut": True, "rerank_cutoff": None}          # configuration of the alpha plot (scripts/graph.py)
+RESULTS_DIR = "tests/test-sets/results"
+
+
+def search_query(cache: EvalCache, query: str, rewriting: bool) -> str:
+    if not rewriting:
+        return query
+    from tests.eval_runner import cached_rewrite
+    return cached_rewrite(cache, query)["text"]
+
+def fetch_candidates(cache: EvalCache, vector_store: BaseVectorStore, state: dict, query: str) -> Candidates:
+    data = cache.get_or_compute(
+        "candidates",
+        lambda: vector_store.fetch_candidates(query, rights=RIGHTS).to_dict(),
+        state, query, RIGHTS, vector_store.CANDIDATES
+    )
+    return Candidates.from_dict(data)
+
+def rerank_scores(cache: EvalCache, query: str, candidates: Candidates) -> np.ndarray:
+    # cross-encoder score of every candidate, the reranking of any retrieved subset is a lookup
+    from reranker import Reranker
+
+    def compute():
+        chunks = Reranker.rerank(query, candidates.chunks, cutoff=0)
+        scores = {chunk.chunk_id: chunk.reranked_score for chunk in chunks}
+        return [scores[chunk.chunk_id] for chunk in candidates.chunks]
+
+    chunk_ids = [chunk.chunk_id for chunk in candidates.chunks]
+    return np.array(cache.get_or_compute("rerank", compute, Reranker.MODEL, query, chunk_ids))
+
+def rerank_order(retrieved: np.ndarray, scores: np.ndarray, cutoff: float) -> np.ndarray:
+    # Reranker.rerank on the retrieved candidates: sorted by the reranker score, relative score cutoff
+    retrieved = retrieved[np.argsort(-scores[retrieved], kind="stable")]
+    if cutoff > 0 and len(retrieved):
+        shifted = scores[retrieved] - scores[retrieved].min()
+        retrieved = retrieved[shifted >= cutoff * shifted.max()]
+    return retrieved
+
+# ----------------------------------------------------------------------------------------------------
+class GridMetrics:
+    '''sums of the retrieval_eval.py metrics per configuration, one value per alpha'''
+    def __init__(self):
+        self.totals = defaultdict(int)
+        self.sums = defaultdict(lambda: {name: np.zeros(len(ALPHAS)) for name in ["recall@1", "in context", "rank", "context"]})
+
+    def add(self, config: tuple, position: np.ndarray, count: np.ndarray):
+        # position of the expected chunk in the retrieved list (len = not retrieved), count = context size
+        found = position < count
+        sums = self.sums[config]
+        sums["recall@1"] += found & (position == 0)
+        sums["in context"] += found
+        sums["rank"] += np.where(found, position + 1, 0)
+        sums["context"] += count
+
+    def add_query(self, config: tuple):
+        self.totals[config] += 1
+
+    def results(self) -> List[dict]:
+        results = []
+        for config, sums in self.sums.items():
+            rewriting, k, autocut, cutoff = config
+            total = self.totals[config]
+            for i, alpha in enumerate(ALPHAS):
+                found = sums["in context"][i]
+                results.append({
+                    "alpha": float(alpha),
+                    "k": k,
+                    "autocut": autocut,
+                    "rerank_cutoff": cutoff,
+                    "rewriting": rewriting,
+                    "total": total,
+                    "recall@1": sums["recall@1"][i] / total,
+                    "in context": found / total,
+                    "not found": int(total - found),
+                    "average_rank": sums["rank"][i] / found if found else 0,
+                    "average_context_size": sums["context"][i] / total
+                })
+        return results
+
+def evaluate(metrics: GridMetrics, rewriting: bool, candidates: Candidates, expected_id: str, scores: Optional[np.ndarray]):
+    ids = np.array([chunk.chunk_id.split("/")[-1] for chunk in candidates.chunks])
+    fused = fusion.fuse_many(candidates, ALPHAS)
+    order, sorted_scores = fusion.rank_many(fused)
+    valid = np.isfinite(sorted_scores).sum(axis=1)
+
+    # position of the expected chunk in the ranking of every alpha (len(ids) when it is not a candidate)
+    expected = np.flatnonzero(ids == expected_id)
+    matches = order == expected[0] if len(expected) else np.zeros_like(order, dtype=bool)
+    position = np.where(matches.any(axis=1), matches.argmax(axis=1), len(ids))
+
+    for k in TOP_KS:
+        for autocut in AUTOCUTS:
+            count = fusion.autocut_many(sorted_scores, k) if autocut else np.minimum(k, valid)
+            for cutoff in RERANK_CUTOFFS:
+                config = (rewriting, k, autocut, cutoff)
+                metrics.add_query(config)
+                if cutoff is None:
+                    metrics.add(config, position, count)
+                    continue
+                reranked = [rerank_order(order[i, :count[i]], scores, cutoff) for i in range(len(ALPHAS))]
+                reranked_position = np.array([
+                    int(np.flatnonzero(retrieved == expected[0])[0]) if len(expected) and expected[0] in retrieved else len(ids)
+                    for retrieved in reranked
+                ])
+                metrics.add(config, reranked_position, np.array([len(retrieved) for retrieved in reranked]))
+
+def print_summary(results: List[dict]):
+    color_print("\n=== Best configurations (recall@1, in context) ===")
+    best = sorted(results, key=lambda r: (r["recall@1"], r["in context"], -r["average_context_size"]), reverse=True)[:10]
+    for r in best:
+        color_print(
+            f"alpha={r['alpha']:.2f} k={r['k']} autocut={r['autocut']} rerank_cutoff={r['rerank_cutoff']} rewriting={r['rewriting']}: ",
+            color="yellow",
+            additional_text=f"recall@1 {r['recall@1']:.3f}, in context {r['in context']:.3f}, context size {r['average_context_size']:.2f}"
+        )
+
+def alpha_curve(results: List[dict]) -> Dict[str, dict]:
+    # recall per alpha of the CURVE configuration, input of scripts/graph.py
+    curves = {}
+    for rewriting in REWRITING:
+        rows = [r for r in results if r["rewriting"] == rewriting and all(r[key] == value for key, value in CURVE.items())]
+        rows.sort(key=lambda r: r["alpha"])
+        curves["rewriting" if rewriting else "original"] = {
+            "alpha": [r["alpha"] for r in rows],
+            "recall@1": [r["recall@1"] for r in rows],
+            "in context": [r["in context"] for r in rows]
+        }
+    return curves
+
+
+if __name__ == "__main__":
+    with open(QUERY_FILE, "r", encoding="utf-8") as f:
+        test_cases = [json.loads(line) for line in f]
+
+    cache = EvalCache(CACHE_FILE)
+    vector_store = VectorStoreFactory.get_store()
+    state = index_state(vector_store)
+    metrics = GridMetrics()
+    fetch_seconds = sweep_seconds = 0.0
+    reranking = any(cutoff is not None for cutoff in RERANK_CUTOFFS)
+
+    for rewriting in REWRITING:
+        for case in tqdm(test_cases, desc=f"Sweeping (rewriting: {rewriting})", unit="case"):
+            start = time.perf_counter()
+            query = search_query(cache, case["query"], rewriting)
+            candidates = fetch_candidates(cache, vector_store, state, query)
+            scores = rerank_scores(cache, query, candidates) if reranking else None
+            fetch_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            evaluate(metrics, rewriting, candidates, case["expected_chunk_id"], scores)
+            sweep_seconds += time.perf_counter() - start
+    vector_store.close()
+
+    results = metrics.results()
+    configurations = len(results) // len(REWRITING)
+    color_print(f"File: {QUERY_FILE}, {len(test_cases)} queries, {configurations} configurations per rewriting mode", color="yellow")
+    color_print(f"Candidates fetched in {fetch_seconds:.1f}s (cache hits {cache.hits}, misses {cache.misses}), grid evaluated in {sweep_seconds:.2f}s", color="yellow")
+    print_summary(results)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = os.path.join(RESULTS_DIR, f"fusion_sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "query_file": QUERY_FILE,
+            "parameters": {
+                "alphas": ALPHAS.tolist(),
+                "top_k": TOP_KS,
+                "autocut": AUTOCUTS,
+                "rerank_cutoffs": RERANK_CUTOFFS,
+                "rewriting": REWRITING,
+                "rights": RIGHTS
+            },
+            "alpha_curve": alpha_curve(results),
+            "results": results
+        }, f, indent=4)
+    color_print(f"Results saved to {output}", color="blue")
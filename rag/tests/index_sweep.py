@@ -0,0 +1,164 @@
+# index_sweep.py - re-indexes the chunks with HNSW / quantizer settings and measures recall@k, latency and memory
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+#
+# The objects and vectors of the source collection are copied (no re-embedding) into a new collection per
+# build setting (VectorStore.INDEX), ef changes at query time and is swept without re-indexing.
+# Recall@k is measured twice: against the exact cosine neighbours of the query (ANN recall of the index)
+# and as the expected chunk of queries_retrieval.jsonl in the top k (retrieval quality of the vector search).
+# Memory is the estimate of the in-memory vector cache and graph, and the Weaviate heap when its metrics are exposed
+# (PROMETHEUS_MONITORING_ENABLED=true). Run from rag/: python -m tests.index_sweep
+
+import json
+import os
+import re
+import time
+from datetime import datetime
+from typing import List, Optional
+
+import httpx
+import numpy as np
+from dotenv import load_dotenv
+from tqdm import tqdm
+from weaviate.classes.config import Reconfigure
+from weaviate.classes.query import MetadataQuery
+
+from batch_writer import BatchWriter
+from tests.benchmark_utils import Timer
+from utils import color_print
+from vector_store import VectorStore
+
+load_dotenv()
+
+QUERY_FILE = os.getenv("INDEX_QUERY_FILE", "tests/test-sets/queries_retrieval.jsonl")
+SOURCE = os.getenv("INDEX_SOURCE", os.getenv("WEAVIATE_COLLECTION", "DocumentChunks"))
+SETTINGS = [                                            # INDEX_SETTINGS=<JSON file with a list> overrides
+    {},                                                 # Weaviate defaults
+    {"max_connections": 16, "ef_construction": 64},
+    {"max_connections": 64, "ef_construction": 256},
+    {"quantizer": "sq", "rescore_limit": 64},
+    {"quantizer": "bq", "rescore_limit": 128},
+    {"quantizer": "pq", "segments": 192}                # 768 / 4 dimensions per segment
+]
+EFS = [-1, 16, 64, 128, 256]                            # -1 = dynamic ef
+TOP_K = [1, 5, 10]
+METRICS_URL = os.getenv("WEAVIATE_METRICS_URL", "http://localhost:2112/metrics")
+KEEP = False                                            # keep the re-indexed collections
+RESULTS_DIR = "tests/test-sets/results"
+
+
+def load_source(store: VectorStore):
+    objects, vectors, uuids = [], [], []
+    for obj in tqdm(store.collection.iterator(include_vector=True), desc=f"Reading {SOURCE}", unit="chunks"):
+        objects.append(obj.properties)
+        vectors.append(obj.vector["default"])
+        uuids.append(obj.uuid)
+    return objects, np.array(vectors, dtype=np.float32), uuids
+
+def exact_neighbours(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    # brute-force cosine neighbours, the reference of the ANN recall
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    similarities = queries @ normalized.T
+    return np.argsort(-similarities, axis=1)[:, :k]
+
+def estimated_memory(settings: dict, count: int, dimension: int) -> int:
+    # vector cache (compressed vectors when quantized) + layer 0 of the graph (2 * max_connections 8 B ids)
+    vector_bytes = {
+        None: 4 * dimension,
+        "sq": dimension,
+        "bq": dimension // 8,
+        "pq": settings.get("segments") or dimension // 4
+    }[settings.get("quantizer")]
+    graph_bytes = 2 * (settings.get("max_connections") or 32) * 8
+    return count * (vector_bytes + graph_bytes)
+
+def heap_bytes() -> Optional[int]:
+    try:
+        text = httpx.get(METRICS_URL, timeout=2).text
+    except httpx.HTTPError:
+        return None
+    match = re.search(r"^go_memstats_heap_inuse_bytes ([\d.e+]+)$", text, re.MULTILINE)
+    return int(float(match.group(1))) if match else None
+
+def evaluate(collection, query_vectors: np.ndarray, uuids: list, neighbours: np.ndarray, expected: List[str]) -> dict:
+    limit = max(TOP_K)
+    index_of = {str(uuid): i for i, uuid in enumerate(uuids)}
+    latencies, ann_hits, expected_hits = [], {k: 0 for k in TOP_K}, {k: 0 for k in TOP_K}
+    for vector, exact, expected_id in zip(query_vectors, neighbours, expected):
+        with Timer() as timer:
+            response = collection.query.near_vector(near_vector=vector, limit=limit, return_metadata=MetadataQuery(distance=True))
+        latencies.append(timer.seconds)
+
+        found = [index_of[str(obj.uuid)] for obj in response.objects]
+        chunk_ids = [obj.properties["chunk_id"].split("/")[-1] for obj in response.objects]
+        for k in TOP_K:
+            ann_hits[k] += len(set(found[:k]) & set(exact[:k].tolist())) / k
+            expected_hits[k] += expected_id in chunk_ids[:k]
+
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    total = len(query_vectors)
+    return {
+        **{f"ann_recall@{k}": ann_hits[k] / total for k in TOP_K},
+        **{f"recall@{k}": expected_hits[k] / total for k in TOP_K},
+        "p50_ms": float(p50),
+        "p95_ms": float(p95)
+    }
+
+
+if __name__ == "__main__":
+    if os.getenv("INDEX_SETTINGS"):
+        with open(os.getenv("INDEX_SETTINGS"), "r", encoding="utf-8") as f:
+            SETTINGS = json.load(f)
+    with open(QUERY_FILE, "r", encoding="utf-8") as f:
+        test_cases = [json.loads(line) for line in f]
+
+    store = VectorStore(collection_name=SOURCE)
+    objects, vectors, uuids = load_source(store)
+    query_vectors = store.embedding_model.embed([case["query"] for case in test_cases])
+    neighbours = exact_neighbours(vectors, query_vectors, max(TOP_K))
+    expected = [case["expected_chunk_id"] for case in test_cases]
+    color_print(f"{len(objects)} chunks of {SOURCE}, {len(test_cases)} queries from {QUERY_FILE}", color="yellow")
+
+    results = []
+    for i, settings in enumerate(SETTINGS):
+        name = f"{SOURCE}Index{i}"
+        index = {**VectorStore.INDEX, **settings}
+        store.client.collections.delete(name)
+        collection = store.client.collections.create(
+            name=name, **{**store.collection_config(), "vector_index_config": VectorStore.index_config(index)}
+        )
+
+        heap_before = heap_bytes()
+        start = time.perf_counter()
+        report = BatchWriter(collection).write(objects, vectors, uuids)
+        build_seconds = time.perf_counter() - start
+        heap_after = heap_bytes()
+
+        for ef in EFS:
+            collection.config.update(vector_index_config=Reconfigure.VectorIndex.hnsw(ef=ef))
+            row = {
+                "settings": settings,
+                "ef": ef,
+                "build_seconds": build_seconds,
+                "inserted": report.inserted,
+                "estimated_memory_mb": estimated_memory(index, len(objects), vectors.shape[1]) / 1024 ** 2,
+                "heap_delta_mb": (heap_after - heap_before) / 1024 ** 2 if heap_before and heap_after else None,
+                **evaluate(collection, query_vectors, uuids, neighbours, expected)
+            }
+            results.append(row)
+            color_print(
+                f"{json.dumps(settings)} ef={ef}: ",
+                color="yellow",
+                additional_text=(
+                    f"ann recall@10 {row['ann_recall@10']:.3f}, recall@1 {row['recall@1']:.3f}, "
+                    f"p95 {row['p95_ms']:.1f} ms, ~{row['estimated_memory_mb']:.1f} MB"
+                )
+            )
+        if not KEEP:
+            store.client.collections.delete(name)
+    store.close()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = os.path.join(RESULTS_DIR, f"index_sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"source": SOURCE, "query_file": QUERY_FILE, "chunks": len(objects), "results": results}, f, indent=4)
+    color_print(f"Results saved to {output}", color="blue")
@@ -0,0 +1,297 @@
+# load_test.py - load test of the FastAPI app with local stand-ins for OpenAI and Google Drive
+# Author: Adam Valík <xvalik05@stud.fit.vut.cz>
+#
+# Run from rag/ with Weaviate running: python -m tests.load_test
+# Phases (LOAD_PHASES): ingest - /ingest_folder of a synthetic Drive folder tree,
+# sync - Drive changes announced by webhooks, query - /query under closed-loop (LOAD_USERS)
+# or open-loop (LOAD_RATE) load. No OpenAI or Google Drive request leaves the machine.
+
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+import httpx
+import numpy as np
+import uvicorn
+
+from tests.benchmark_utils import SyntheticCorpus
+from tests.fake_drive import FakeDriveServer
+from tests.fake_openai import FakeOpenAIServer
+from utils import color_print, parse_server_timing
+
+PHASES = os.getenv("LOAD_PHASES", "ingest,sync,query").split(",")
+USERS = int(os.getenv("LOAD_USERS", "8"))                               # closed loop: users sending back-to-back queries
+RATE = float(os.getenv("LOAD_RATE", "0"))                               # open loop: Poisson arrivals (queries/s), 0 = closed loop
+MAX_IN_FLIGHT = int(os.getenv("LOAD_MAX_IN_FLIGHT", "256"))             # open loop: arrivals above this are counted as errors
+DURATION = float(os.getenv("LOAD_DURATION", "60"))                      # seconds of query load
+LLM_LATENCY = float(os.getenv("LOAD_LLM_LATENCY", "0.3"))               # fake OpenAI: seconds per request (time to first token)
+TOKENS_PER_SECOND = float(os.getenv("LOAD_TOKENS_PER_SECOND", "50"))    # fake OpenAI: streaming rate
+COMPLETION_TOKENS = int(os.getenv("LOAD_COMPLETION_TOKENS", "200"))     # fake OpenAI: tokens of an answer
+DRIVE_LATENCY = float(os.getenv("LOAD_DRIVE_LATENCY", "0.05"))          # fake Drive: seconds per request
+FILES = int(os.getenv("LOAD_FILES", "50"))                              # documents in the fake Drive
+CHUNKS_PER_FILE = int(os.getenv("LOAD_CHUNKS_PER_FILE", "10"))
+SYNC_CHANGES = int(os.getenv("LOAD_SYNC_CHANGES", "20"))                # Drive changes made in the sync phase
+COLLECTION = os.getenv("LOAD_COLLECTION", "LoadTestChunks")             # Weaviate collection of the test (deleted afterwards)
+PORT = int(os.getenv("LOAD_PORT", "8765"))
+TIMEOUT = float(os.getenv("LOAD_TIMEOUT", "600"))                       # seconds to wait for ingestion and sync
+
+
+class StageStats:
+    '''latencies and errors per stage, shared by the client threads'''
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.messages = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.latencies[stage].append(seconds)
+
+    def error(self, stage: str, message: str):
+        with self._lock:
+            self.errors[stage] += 1
+            if len(self.messages[stage]) < 5:
+                self.messages[stage].add(message)
+
+    def report(self, elapsed: float):
+        print(f"{'stage':32} {'count':>7} {'errors':>7} {'err %':>6} {'per s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for stage in sorted(set(self.latencies) | set(self.errors)):
+            latencies = self.latencies.get(stage, [])
+            errors = self.errors.get(stage, 0)
+            total = len(latencies) + errors
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000 if latencies else (0.0, 0.0, 0.0)
+            print(
+                f"{stage:32} {len(latencies):7d} {errors:7d} {errors / total:6.1%} {len(latencies) / elapsed:8.2f} "
+                f"{p50:9.1f} {p95:9.1f} {p99:9.1f}"
+            )
+        for stage, messages in self.messages.items():
+            color_print(f"{stage} errors:", color="red", additional_text=" " + "; ".join(sorted(messages)))
+
+
+def populate_drive(drive: FakeDriveServer, corpus: SyntheticCorpus) -> dict:
+    # root/superior and root/user folders, the folder names determine the rights
+    root = drive.add_folder("root")
+    folders = {rights: drive.add_folder(rights, root) for rights in ["superior", "user"]}
+    files = []
+    for i in range(FILES):
+        rights = "superior" if i % 2 else "user"
+        files.append(drive.add_file(f"doc_{i}.txt", corpus.document(CHUNKS_PER_FILE), folders[rights]))
+    return {"root": root, "folders": folders, "files": files}
+
+def start_app(app) -> Tuple[uvicorn.Server, threading.Thread]:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=PORT, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.1)
+    return server, thread
+
+# ----------------------------------------------------------------------------------------------------
+def run_ingestion(client: httpx.Client, drive: FakeDriveServer, tree: dict, stats: StageStats):
+    color_print(f"[Ingest] {FILES} files, {CHUNKS_PER_FILE} chunks per file", color="blue")
+    start = time.perf_counter()
+    response = client.post("/ingest_folder", json={"driveURL": drive.folder_url(tree["root"])})
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+
+    while time.perf_counter() - start < TIMEOUT:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            break
+        time.sleep(1)
+    elapsed = time.perf_counter() - start
+
+    stats.add("ingest.job", elapsed)
+    for error in job["errors"]:
+        stats.error("ingest.job", error)
+    if job["status"] != "completed":
+        stats.error("ingest.job", f"job {job['status']}")
+    color_print(
+        f"[Ingest] {job['status']} in {elapsed:.1f}s: {job['files_partitioned']} files ({job['files_partitioned'] / elapsed:.2f} files/s), "
+        f"{job['chunks_inserted']} chunks ({job['chunks_inserted'] / elapsed:.1f} chunks/s), {len(job['errors'])} errors",
+        color="green" if job["status"] == "completed" else "red"
+    )
+
+def run_sync(client: httpx.Client, drive: FakeDriveServer, tree: dict, corpus: SyntheticCorpus, stats: StageStats):
+    color_print(f"[Sync] {SYNC_CHANGES} Drive changes (added, updated, trashed files)", color="blue")
+    before = client.get("/sync_status").json()
+    rng = random.Random(0)
+    files = list(tree["files"])
+
+    start = time.perf_counter()
+    for i in range(SYNC_CHANGES):
+        action = rng.random()
+        if action < 0.4 or not files:
+            folder = tree["folders"][rng.choice(["superior", "user"])]
+            files.append(drive.add_file(f"new_{i}.txt", corpus.document(CHUNKS_PER_FILE), folder))
+        elif action < 0.8:
+            drive.update_file(rng.choice(files), corpus.document(CHUNKS_PER_FILE))
+        else:
+            drive.trash_file(files.pop(rng.randrange(len(files))))
+    last_change = time.perf_counter()
+
+    # every change is announced by one webhook, the sync is done when all were received and applied
+    while time.perf_counter() - start < TIMEOUT:
+        status = client.get("/sync_status").json()
+        received = status["notifications_total"] - before["notifications_total"]
+        if received >= SYNC_CHANGES and status["pending_notifications"] == 0 and not status["running"] and status["syncs_total"] > before["syncs_total"]:
+            break
+        time.sleep(0.5)
+    else:
+        stats.error("sync.freshness", f"not synced within {TIMEOUT:.0f}s: {status}")
+        return
+    done = time.perf_counter()
+
+    stats.add("sync.freshness", done - last_change)  # last change -> applied to the vector store
+    for _ in range(status["sync_errors"] - before["sync_errors"]):
+        stats.error("sync.run", status["last_error"] or "sync failed")
+    result = status["last_result"] or {}
+    color_print(
+        f"[Sync] {received} webhooks, {status['syncs_total'] - before['syncs_total']} syncs, "
+        f"{status['coalesced_notifications'] - before['coalesced_notifications']} coalesced, "
+        f"applied {done - last_change:.1f}s after the last change, last sync: {result}",
+        color="green"
+    )
+
+def send_query(client: httpx.Client, stats: StageStats, query: str, rights: str):
+    start = time.perf_counter()
+    try:
+        body = {"query": query, "rights": rights, "history": [], "use_history": False}
+        with client.stream("POST", "/query", json=body) as response:
+            if response.status_code != 200:
+                stats.error("query.total", f"HTTP {response.status_code}")
+                return
+            for stage, seconds in parse_server_timing(response.headers.get("server-timing", "")).items():
+                stats.add(f"query.server.{stage}", seconds)
+
+            first_token = None
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                if message["metadata"] is not None:
+                    stats.add("query.time_to_chunks", time.perf_counter() - start)
+                elif message["text"]:
+                    if message["text"].startswith("[ERROR]"):
+                        stats.error("query.total", message["text"])
+                        return
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                        stats.add("query.time_to_first_token", first_token - start)
+        end = time.perf_counter()
+        if first_token is not None:
+            stats.add("query.llm_stream", end - first_token)
+        stats.add("query.total", end - start)
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
+        stats.error("query.total", f"{type(e).__name__}: {e}")
+
+def run_queries(client: httpx.Client, corpus: SyntheticCorpus, stats: StageStats) -> float:
+    queries = corpus.queries(1000)
+    rng = random.Random(1)
+    deadline = time.perf_counter() + DURATION
+
+    def next_query():
+        return rng.choice(queries), rng.choice(["user", "superior"])
+
+    start = time.perf_counter()
+    if RATE > 0:
+        # open loop: arrivals do not wait for responses, overload shows as growing latency and errors
+        color_print(f"[Query] open loop, {RATE:.1f} queries/s for {DURATION:.0f}s", color="blue")
+        in_flight = threading.Semaphore(MAX_IN_FLIGHT)
+
+        def task(query, rights):
+            try:
+                send_query(client, stats, query, rights)
+            finally:
+                in_flight.release()
+
+        with ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT) as executor:
+            arrival = time.perf_counter()
+            while arrival < deadline:
+                time.sleep(max(0.0, arrival - time.perf_counter()))
+                if in_flight.acquire(blocking=False):
+                    executor.submit(task, *next_query())
+                else:
+                    stats.error("query.total", f"more than {MAX_IN_FLIGHT} requests in flight")
+                arrival += rng.expovariate(RATE)
+    else:
+        # closed loop: every user sends the next query after the previous answer
+        color_print(f"[Query] closed loop, {USERS} users for {DURATION:.0f}s", color="blue")
+
+        def user():
+            while time.perf_counter() < deadline:
+                send_query(client, stats, *next_query())
+
+        threads = [threading.Thread(target=user) for _ in range(USERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    corpus = SyntheticCorpus()
+    stats = StageStats()
+    # page token, root url and rag.log of the test do not overwrite the real ones
+    workdir = tempfile.mkdtemp(prefix="rag-load-test-")
+    os.chdir(workdir)
+    color_print(f"Working directory: {workdir}", color="yellow")
+
+    with FakeOpenAIServer(latency=LLM_LATENCY, completion_tokens=COMPLETION_TOKENS, tokens_per_second=TOKENS_PER_SECOND) as openai_server, \
+            FakeDriveServer(latency=DRIVE_LATENCY) as drive:
+        os.environ.update({
+            "OPENAI_API_KEY": "fake-key",
+            "OPENAI_BASE_URL": openai_server.base_url,
+            "GOOGLE_DRIVE_API_ENDPOINT": drive.api_endpoint,
+            "WEBHOOK_URL": f"http://127.0.0.1:{PORT}",
+            "WEAVIATE_COLLECTION": COLLECTION
+        })
+        # the files exist before the app obtains its start page token, the sync phase sees only its own changes
+        tree = populate_drive(drive, corpus)
+
+        import api
+        from vector_store import VectorStore
+
+        vector_store = VectorStore()
+        vector_store.delete_schema()
+        vector_store.close()
+
+        server, server_thread = start_app(api.app)
+        client = httpx.Client(
+            base_url=f"http://127.0.0.1:{PORT}",
+            timeout=120,
+            limits=httpx.Limits(max_connections=max(USERS, MAX_IN_FLIGHT))
+        )
+        start = time.perf_counter()
+        try:
+            if "ingest" in PHASES:
+                run_ingestion(client, drive, tree, stats)
+            if "sync" in PHASES:
+                run_sync(client, drive, tree, corpus, stats)
+            query_seconds = run_queries(client, corpus, stats) if "query" in PHASES else 0.0
+        finally:
+            client.close()
+            # lifespan shutdown stops the watch channel, the sync worker and the ingestion jobs
+            server.should_exit = True
+            server_thread.join()
+
+            vector_store = VectorStore()
+            vector_store.delete_schema()
+            vector_store.close()
+
+    elapsed = time.perf_counter() - start
+    color_print(f"\nLoad test finished in {elapsed:.1f}s, OpenAI requests: {len(openai_server.requests)}, Drive requests: {len(drive.requests)}", color="blue")
+    # throughput of the query stages is relative to the query phase
+    stats.report(query_seconds or elapsed)
+
+
+if __name__ == "__main__":
+    main()
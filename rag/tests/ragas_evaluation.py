@@ -163,6 +163,7 @@ def evaluation(dataset_name: str):
             
     # result.upload()
     color_print("-" * 50, color="yellow")
+    return average_metrics.to_dict()
 
 
 if __name__ == "__main__":
@@ -34,15 +34,16 @@ for REWRITING in [False, True]:
         ranks = []
 
 
-        for c in tqdm(test_cases, desc="Evaluating", unit="case"):
+        search_queries = [c["query"] for c in test_cases]
+        if REWRITING:
+            search_queries = [Rewriter.rewrite(query) for query in tqdm(search_queries, desc="Rewriting", unit="case")]
+        # one embedding batch, concurrent searches
+        searches = vector_store.hybrid_search_many(search_queries, alpha=ALPHA, autocut=AUTOCUT, k=TOP_K)
+
+        for c, search_query, search in zip(tqdm(test_cases, desc="Evaluating", unit="case"), search_queries, searches):
             query = c["query"]
             expected_id = c["expected_chunk_id"]
-            
-            search_query = query
-            if REWRITING:
-                search_query = Rewriter.rewrite(query)
-
-            chunks = vector_store.hybrid_search(query=search_query, alpha=ALPHA, autocut=AUTOCUT, k=TOP_K)
+            chunks = search.chunks
             
             if RERANKING:
                 chunks = Reranker.rerank(search_query, chunks, cutoff=RERANKER_CUTOFF)
@@ -0,0 +1,158 @@
+import pytest
+
+import changes_state
+from changes_state import load_page_token
+from local_vector_store import LocalIndex, LocalVectorStore
+from tests.fake_drive import FakeDriveServer
+from tests.test_local_vector_store import HashEmbeddingModel, make_chunk
+
+# document_processor needs the unstructured/transformers stack
+GoogleDriveDownloader = pytest.importorskip("google_drive_downloader").GoogleDriveDownloader
+
+FOLDER_RIGHTS = "user"
+
+
+def change(file_id: str, text: str = "", trashed: bool = False, parent: str = "folder") -> dict:
+    return {"fileId": file_id, "file": {"name": f"{file_id}.txt", "mimeType": "text/plain", "trashed": trashed, "parents": [parent], "text": text}}
+
+def removal(file_id: str) -> dict:
+    return {"fileId": file_id, "removed": True}
+
+def texts(store: LocalVectorStore, file_id: str):
+    index = store.index
+    return sorted(index.objects[row]["text"] for row in index.rows_by_file.get(file_id, ()))
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalVectorStore(collection_name="SyncChunks", path=str(tmp_path / "store"), embedding_model=HashEmbeddingModel())
+    store.insert_chunks_batch([
+        make_chunk("kept", 0, "an unchanged file"),
+        make_chunk("report", 0, "first version of the report", rights="superior"),
+        make_chunk("report", 1, "second chunk of the old report", rights="superior"),
+        make_chunk("removed", 0, "a removed file"),
+        make_chunk("trashed", 0, "a trashed file"),
+    ])
+    yield store
+    LocalIndex._shared.pop(store.path, None)
+
+@pytest.fixture
+def downloader(monkeypatch, store):
+    # no partitioning: process_change makes one chunk of the text carried by the change (or of the file
+    # content in the fake Drive), folder rights are fixed
+    monkeypatch.setenv("GOOGLE_DRIVE_API_ENDPOINT", "http://127.0.0.1:9/drive/v3/")
+    downloader = GoogleDriveDownloader()
+    downloader.failing = set()
+    downloader.rights_lookups = []
+
+    def process_change(change):
+        if change["fileId"] in downloader.failing:
+            return None, False
+        text = change["file"].get("text")
+        if text is None:
+            text = downloader.download_file_in_memory(change["fileId"]).decode("utf-8")
+        return [make_chunk(change["fileId"], 0, text, rights="")], True
+
+    def get_folder_rights(folder_id):
+        downloader.rights_lookups.append(folder_id)
+        return FOLDER_RIGHTS
+
+    monkeypatch.setattr(downloader, "process_change", process_change)
+    monkeypatch.setattr(downloader, "get_folder_rights", get_folder_rights)
+    return downloader
+
+@pytest.fixture
+def drive(monkeypatch, tmp_path, downloader):
+    # sync_changes against the local Drive stand-in, the page token is kept in tmp_path
+    monkeypatch.setattr(changes_state, "PAGE_TOKEN_FILE", str(tmp_path / "page_token.json"))
+    with FakeDriveServer(webhooks=False) as drive:
+        downloader.api_endpoint = drive.api_endpoint
+        downloader.initialize_changes_page_token()
+        yield drive
+
+@pytest.fixture
+def delete_calls(monkeypatch, store):
+    calls = []
+    delete_documents = store.delete_documents
+
+    def spy(file_ids, verbose=True):
+        calls.append(list(file_ids))
+        return delete_documents(file_ids, verbose)
+
+    monkeypatch.setattr(store, "delete_documents", spy)
+    return calls
+
+# ----------------------------------------------------------------------------------------------------
+def test_coalesce_keeps_last_change_per_file():
+    changes = [change("a", "a1"), change("b", "b1"), change("a", "a2"), removal("b"), change("c", "c1")]
+    coalesced = GoogleDriveDownloader.coalesce_changes(changes)
+
+    # one change per file, ordered by the latest change of each file
+    assert [c["fileId"] for c in coalesced] == ["a", "b", "c"]
+    assert coalesced[0]["file"]["text"] == "a2"
+    assert coalesced[1].get("removed")
+
+def test_last_change_wins(downloader, store):
+    changes = [change("report", "draft of the report"), change("report", "final report"), change("report", "", trashed=True), change("report", "restored report")]
+    stats = downloader.apply_changes(GoogleDriveDownloader.coalesce_changes(changes), store)
+
+    assert stats["files"] == 1 and stats["deleted_files"] == 0
+    assert texts(store, "report") == ["restored report"]
+
+def test_removed_and_trashed_in_one_delete(downloader, store, delete_calls):
+    stats = downloader.apply_changes([removal("removed"), change("trashed", trashed=True), change("new", "a new file")], store)
+
+    # removed, trashed and replaced files go through a single delete
+    assert len(delete_calls) == 1
+    assert sorted(delete_calls[0]) == ["new", "removed", "trashed"]
+    assert stats["deleted_files"] == 2
+    assert stats["deleted_objects"] == 2
+    assert store.existing_documents(["kept", "removed", "trashed", "new"]) == {"kept", "new"}
+
+def test_failed_download_is_retried(downloader, store, drive, delete_calls):
+    file_id = drive.add_file("report.txt", "first version")
+    downloader.sync_changes(store)
+    assert texts(store, file_id) == ["first version"]
+    token = load_page_token()
+
+    # the download fails, the old version stays and the change is not consumed
+    drive.update_file(file_id, "second version")
+    downloader.failing = {file_id}
+    delete_calls.clear()
+    stats = downloader.sync_changes(store)
+    assert stats["failed"] == 1 and stats["files"] == 0
+    assert delete_calls == []
+    assert texts(store, file_id) == ["first version"]
+    assert load_page_token() == token
+
+    # the next sync delivers the change again
+    downloader.failing = set()
+    stats = downloader.sync_changes(store)
+    assert stats["failed"] == 0 and stats["files"] == 1
+    assert texts(store, file_id) == ["second version"]
+    assert load_page_token() != token
+
+def test_rights_are_reused_for_existing_files(downloader, store):
+    stats = downloader.apply_changes([change("report", "updated report"), change("new", "a new file")], store)
+
+    assert stats["files"] == 2 and stats["chunks"] == 2
+    # the updated file keeps its stored rights, only the new file looks up its folder
+    assert store.rights_for(["report", "new"]) == {"report": "superior", "new": FOLDER_RIGHTS}
+    assert downloader.rights_lookups == ["folder"]
+
+def test_sync_stops_at_page_with_failures(downloader, store, drive):
+    downloader.CHANGES_PAGE_SIZE = 2
+    start_token = load_page_token()
+    first, failing, last = (drive.add_file(f"file{i}.txt", f"content {i}") for i in range(3))
+    downloader.failing = {failing}
+
+    # the first page has a failure, the token stays at its start and the second page is not synced
+    stats = downloader.sync_changes(store)
+    assert stats["changes"] == 2 and stats["failed"] == 1
+    assert load_page_token() == start_token
+    assert store.existing_documents([first, failing, last]) == {first}
+
+    downloader.failing = set()
+    stats = downloader.sync_changes(store)
+    assert stats["changes"] == 3 and stats["failed"] == 0
+    assert store.existing_documents([first, failing, last]) == {first, failing, last}
+    assert load_page_token() == str(len(drive.changes) + 1)
@@ -0,0 +1,65 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from document_processor import DocumentProcessor
+from embedding_model import EmbeddingModelFactory
+from utils import color_print
+
+TEST_FILE_PATH = "tests/test-files/long.txt"
+CORPUS_FOLDER = os.getenv("BENCHMARK_CORPUS", "")  # folder with a real corpus (.txt files), long.txt by default
+BATCH_SIZE = 100
+
+@pytest.fixture(scope="module")
+def texts():
+    files = [TEST_FILE_PATH]
+    if CORPUS_FOLDER:
+        files = [os.path.join(CORPUS_FOLDER, f) for f in sorted(os.listdir(CORPUS_FOLDER)) if f.endswith(".txt")]
+
+    texts = []
+    for file_path in files:
+        texts.extend(chunk.text for chunk in DocumentProcessor(file_path).process())
+    return texts
+
+@pytest.fixture(scope="module")
+def embedding_model():
+    return EmbeddingModelFactory.get_model(model_type="huggingface", model_name="all-mpnet-base-v2")
+
+def run(embedding_model, texts, bucketing):
+    num_tokens = int(embedding_model.token_lengths(texts).sum())
+    embedding_model.embed(texts[:BATCH_SIZE], batch_size=BATCH_SIZE, bucketing=bucketing)  # warm-up
+
+    start = time.perf_counter()
+    embeddings = embedding_model.embed(texts, batch_size=BATCH_SIZE, bucketing=bucketing)
+    elapsed = time.perf_counter() - start
+    return embeddings, num_tokens / elapsed
+
+def test_length_bucketing_benchmark(embedding_model, texts):
+    """Benchmark of arrival-order batches vs. length-bucketed batches (tokens/sec)"""
+    arrival_embeddings, arrival_tps = run(embedding_model, texts, bucketing=False)
+    bucketed_embeddings, bucketed_tps = run(embedding_model, texts, bucketing=True)
+
+    color_print(f"{len(texts)} chunks", color="blue")
+    color_print(f"Arrival order:   {arrival_tps:.0f} tokens/sec", color="blue")
+    color_print(f"Length bucketed: {bucketed_tps:.0f} tokens/sec ({bucketed_tps / arrival_tps:.2f}x)", color="blue")
+
+    # same vectors in the same order (fp16 model, padding changes the numerics slightly)
+    assert bucketed_embeddings.dtype == np.float32 and bucketed_embeddings.flags["C_CONTIGUOUS"]
+    assert bucketed_embeddings.shape == arrival_embeddings.shape
+    assert np.allclose(bucketed_embeddings, arrival_embeddings, atol=1e-2)
+
+@pytest.mark.parametrize("num_workers", [1, 2, 4, 8, 16])
+def test_multiprocess_scaling_benchmark(num_workers, texts):
+    """Benchmark of the multi-process embedding (tokens/sec per number of worker processes)"""
+    if num_workers > (os.cpu_count() or 1):
+        pytest.skip(f"only {os.cpu_count()} cores available")
+
+    embedding_model = EmbeddingModelFactory.get_model(model_type="huggingface", model_name="all-mpnet-base-v2", num_workers=num_workers)
+    try:
+        _, tokens_per_second = run(embedding_model, texts, bucketing=True)
+    finally:
+        embedding_model.close()
+
+    color_print(f"{num_workers} workers: {tokens_per_second:.0f} tokens/sec", color="blue")
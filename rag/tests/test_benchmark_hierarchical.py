@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from tests.benchmark_utils import (SyntheticCorpus, Timer, benchmark_sizes,
+                                   search_latencies)
+from utils import color_print
+from vector_store import VectorStore
+
+# flat hybrid search vs. the two-level search (documents, then their chunks) at BENCHMARK_SIZES chunks.
+# Synthetic vectors carry no meaning, the retrieval quality of the hierarchical search is measured on the
+# real corpus (tests/retrieval_eval.py or tests/eval_runner.py with HIERARCHICAL_SEARCH=1)
+SIZES = benchmark_sizes()
+NUM_QUERIES = int(os.getenv("BENCHMARK_QUERIES", "50"))
+FLAT_COLLECTION = "BenchmarkFlatChunks"
+HIERARCHICAL_COLLECTION = "BenchmarkHierarchicalChunks"
+
+corpus = SyntheticCorpus()
+
+@pytest.fixture(scope="module")
+def stores():
+    flat = VectorStore(collection_name=FLAT_COLLECTION, hierarchical=False)
+    hierarchical = VectorStore(collection_name=HIERARCHICAL_COLLECTION, hierarchical=True)
+    yield flat, hierarchical
+    for store in (flat, hierarchical):
+        store.delete_schema()
+        store.close()
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda size: f"{size}chunks")
+def indexed(request, stores, recorder):
+    # chunks of a document are close to its random center (documents are separable as in a real corpus)
+    size = request.param
+    chunks = corpus.chunks(size, prefix=f"hierarchy{size}")
+    dimension = stores[0].embedding_model.embed("dimension").shape[1]
+    centers = SyntheticCorpus.vectors(-(-size // SyntheticCorpus.CHUNKS_PER_DOCUMENT), dimension, seed=1)
+    vectors = centers[[i // SyntheticCorpus.CHUNKS_PER_DOCUMENT for i in range(size)]] + 0.5 * SyntheticCorpus.vectors(size, dimension)
+
+    for name, store in zip(["flat", "hierarchical"], stores):
+        store.delete_schema()
+        store.get_schema()
+        with Timer() as timer:
+            report = store.insert_chunks_batch(chunks, embeddings=vectors)
+        assert report.failed == 0
+        recorder.record(f"insert_{name}", size, report.inserted, timer.seconds)
+    return size
+
+def test_hierarchical_search(indexed, stores, recorder):
+    """Benchmark of the flat and the two-level hybrid search (k=3, autocut, user rights as in /query)"""
+    size = indexed
+    queries = corpus.queries(NUM_QUERIES)
+    results = {}
+    for name, store in zip(["flat", "hierarchical"], stores):
+        latencies, chunk_lists = search_latencies(store, queries, k=3, rights="user", autocut=True)
+        results[name] = [[chunk.chunk_id for chunk in chunks] for chunks in chunk_lists]
+        result = recorder.record(f"search_{name}", size, len(queries), sum(latencies), unit="queries", latencies=latencies)
+        color_print(f"search_{name} [{size}]: p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms", color="blue")
+
+    # chunks of the hierarchical search come from at most DOCUMENTS_K documents
+    for chunk_ids in results["hierarchical"]:
+        assert len({chunk_id.rsplit("_", 1)[0] for chunk_id in chunk_ids}) <= VectorStore.DOCUMENTS_K
+    agreement = sum(a[:1] == b[:1] for a, b in zip(results["flat"], results["hierarchical"])) / len(queries)
+    color_print(f"top-1 agreement [{size}]: {agreement:.2f}", color="blue")
@@ -4,6 +4,7 @@ from document_processor import DocumentProcessor
 from embedding_model import EmbeddingModelFactory
 import time
 import weaviate
+from batch_writer import BatchWriter
 from utils import color_print
 
 TEST_FILE_PATH = "tests/test-files/long.txt"
@@ -64,4 +65,15 @@ def test_insert_many_chunks_benchmark(vector_store, chunks_and_embeddings):
     
     vector_store.delete_document(TEST_FILE_PATH)
 
+@pytest.mark.parametrize("mode", ["fixed", "rate_limit"])
+def test_batch_writer_benchmark(vector_store, chunks_and_embeddings, mode):
+    """Benchmark for BatchWriter modes (NumPy vectors, failure accounting)"""
+    chunks, embeddings = chunks_and_embeddings
+    vector_store.delete_document(TEST_FILE_PATH)
 
+    report = vector_store.insert_chunks_batch(chunks, embeddings=embeddings, batch_writer=BatchWriter(vector_store.collection, mode=mode))
+    color_print(f"BatchWriter ({mode}): {report}", color="blue")
+    assert report.failed == 0
+    assert report.inserted == len(chunks)
+
+    vector_store.delete_document(TEST_FILE_PATH)
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from reranker import Reranker
+from tests.benchmark_utils import SyntheticCorpus, Timer, benchmark_sizes
+from utils import color_print
+from vector_store import VectorStore
+
+# full hybrid search (all properties, parsed explain scores) vs. the lean search (chunk_id, text, score)
+# with the metadata fetched for the chunks kept by the relative score filter of the reranker, BENCHMARK_SIZES chunks
+SIZES = benchmark_sizes()
+NUM_QUERIES = int(os.getenv("BENCHMARK_QUERIES", "50"))
+K = int(os.getenv("BENCHMARK_K", "20"))  # more hits than /query (k=3) show the payload difference
+COLLECTION = "BenchmarkLeanChunks"
+
+corpus = SyntheticCorpus()
+
+@pytest.fixture(scope="module")
+def store():
+    store = VectorStore(collection_name=COLLECTION, hierarchical=False)
+    yield store
+    store.delete_schema()
+    store.close()
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda size: f"{size}chunks")
+def indexed(request, store):
+    size = request.param
+    chunks = corpus.chunks(size, prefix=f"lean{size}")
+    dimension = store.embedding_model.embed("dimension").shape[1]
+    store.delete_schema()
+    store.get_schema()
+    report = store.insert_chunks_batch(chunks, embeddings=SyntheticCorpus.vectors(size, dimension))
+    assert report.failed == 0
+    return size
+
+def kept(chunks):
+    # stand-in for the cross-encoder scores (the model is not part of the measured retrieval)
+    for i, chunk in enumerate(chunks):
+        chunk.reranked_score = -i
+    return Reranker.filter_by_relative_score(chunks, 0.5) if chunks else []
+
+def test_lean_search(indexed, store, recorder):
+    """Benchmark of the full and the lean hybrid search including the hydration of the kept chunks"""
+    size = indexed
+    queries = corpus.queries(NUM_QUERIES)
+    searches = {
+        "full": lambda query: kept(store.hybrid_search(query, k=K, rights="user")),
+        "lean": lambda query: store.hydrate(kept(store.hybrid_search_lean(query, k=K, rights="user")))
+    }
+    results = {}
+    for name, search in searches.items():
+        search(queries[0])  # warm-up
+        latencies, results[name] = [], []
+        for query in queries:
+            with Timer() as timer:
+                chunks = search(query)
+            latencies.append(timer.seconds)
+            results[name].append(chunks)
+        result = recorder.record(f"search_{name}", size, len(queries), sum(latencies), unit="queries", latencies=latencies)
+        color_print(f"search_{name} [{size}]: p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms", color="blue")
+
+    # the hydrated chunks are the same as the chunks of the full search
+    for full, lean in zip(results["full"], results["lean"]):
+        assert [chunk.to_dict() for chunk in lean] == [chunk.to_dict() for chunk in full]
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from tenant_vector_store import TenantVectorStore
+from tests.benchmark_utils import (SyntheticCorpus, benchmark_sizes,
+                                   search_latencies)
+from utils import color_print
+from vector_store import VectorStore
+
+# filtered search of one collection (rights filter) vs. rights-partitioned tenants, BENCHMARK_SIZES chunks
+# of which BENCHMARK_SUPERIOR_SHARES are superior-only (the rest is visible to users)
+SIZES = benchmark_sizes()
+SUPERIOR_SHARES = [float(share) for share in os.getenv("BENCHMARK_SUPERIOR_SHARES", "0.5,0.9").split(",") if share.strip()]
+NUM_QUERIES = int(os.getenv("BENCHMARK_QUERIES", "50"))
+FILTERED_COLLECTION = "BenchmarkFilteredChunks"
+TENANT_COLLECTION = "BenchmarkTenantChunks"
+
+corpus = SyntheticCorpus()
+
+@pytest.fixture(scope="module")
+def stores():
+    filtered = VectorStore(collection_name=FILTERED_COLLECTION)
+    partitioned = TenantVectorStore(collection_name=TENANT_COLLECTION)
+    yield filtered, partitioned
+    for store in (filtered, partitioned):
+        store.delete_schema()
+        store.close()
+
+@pytest.fixture(scope="module", params=[(size, share) for size in SIZES for share in SUPERIOR_SHARES], ids=lambda p: f"{p[0]}chunks-{p[1]}superior")
+def indexed(request, stores):
+    # the same chunks and vectors in both stores
+    size, share = request.param
+    chunks = corpus.chunks(size, prefix=f"partition{size}")
+    for i, chunk in enumerate(chunks):
+        chunk.rights = "superior" if (i * 0.618034) % 1 < share else "user"
+    dimension = stores[0].embedding_model.embed("dimension").shape[1]
+    vectors = SyntheticCorpus.vectors(size, dimension)
+
+    for store in stores:
+        store.delete_schema()
+        store.get_schema()
+        report = store.insert_chunks_batch(chunks, embeddings=vectors)
+        assert report.failed == 0
+    return size, share
+
+def test_filtered_search(indexed, stores, recorder):
+    """Benchmark of the /query search of a user (k=3, autocut) and of a superior (no rights) in both layouts"""
+    size, share = indexed
+    queries = corpus.queries(NUM_QUERIES)
+    for rights in ["user", None]:
+        results = {}
+        for layout, store in zip(["filtered", "tenants"], stores):
+            latencies, results[layout] = search_latencies(store, queries, k=3, rights=rights, autocut=True)
+            stage = f"{layout}_{rights or 'all'}_{share}"
+            result = recorder.record(stage, size, len(queries), sum(latencies), unit="queries", latencies=latencies)
+            color_print(f"{stage} [{size}]: p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms", color="blue")
+
+        # both layouts return only the allowed chunks, the top results mostly agree (BM25 statistics differ per tenant)
+        if rights:
+            assert all(chunk.rights == rights for chunks in results.values() for result in chunks for chunk in result)
+        agreement = sum(
+            [chunk.chunk_id for chunk in a[:1]] == [chunk.chunk_id for chunk in b[:1]]
+            for a, b in zip(results["filtered"], results["tenants"])
+        ) / len(queries)
+        color_print(f"top-1 agreement ({rights or 'all'}) [{size}, {share}]: {agreement:.2f}", color="blue")
@@ -0,0 +1,204 @@
+import os
+
+import pytest
+
+from document_processor import DocumentProcessor
+from reranker import Reranker
+from tests.benchmark_utils import (BenchmarkRecorder, SyntheticCorpus, Timer,
+                                   benchmark_sizes, search_latencies)
+from tests.fake_openai import FakeOpenAIServer
+from utils import color_print
+from vector_store import VectorStore
+
+# BENCHMARK_SIZES="1k,10k,100k,1M" chunks in the index, partitioning and embedding are linear
+# in the corpus size and run on at most BENCHMARK_PROCESS_LIMIT / BENCHMARK_EMBED_LIMIT chunks
+SIZES = benchmark_sizes()
+PROCESS_LIMIT = int(os.getenv("BENCHMARK_PROCESS_LIMIT", "1000"))
+EMBED_LIMIT = int(os.getenv("BENCHMARK_EMBED_LIMIT", "2000"))
+NUM_QUERIES = int(os.getenv("BENCHMARK_QUERIES", "50"))
+COLLECTION = "BenchmarkChunks"
+
+corpus = SyntheticCorpus()
+
+@pytest.fixture(scope="module", autouse=True)
+def recorder(benchmark_query_cache):
+    # results are saved after the module, BENCHMARK_UPDATE_BASELINE=1 stores them as the new baseline
+    recorder = BenchmarkRecorder()
+    yield recorder
+
+    color_print(f"Benchmark results saved to {recorder.save()}", color="blue")
+    if os.getenv("BENCHMARK_UPDATE_BASELINE"):
+        color_print(f"Baseline updated: {recorder.save(recorder.baseline_file)}", color="blue")
+        return
+
+    baseline = recorder.load_baseline()
+    if baseline is None:
+        color_print(f"No baseline in {recorder.baseline_file}, comparison skipped.", color="yellow")
+        return
+    machine = recorder.to_dict()["machine"]
+    if (baseline["machine"].get("cpu_count"), baseline["machine"].get("processor")) != (machine["cpu_count"], machine["processor"]):
+        color_print("Baseline was recorded on a different machine, the comparison is indicative only.", color="yellow")
+
+    regressions = recorder.compare(baseline)
+    if regressions:
+        pytest.fail("Performance regressions:\n" + "\n".join(regressions))
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda size: f"{size}chunks")
+def size(request):
+    return request.param
+
+@pytest.fixture(scope="module")
+def vector_store():
+    store = VectorStore(collection_name=COLLECTION)
+    yield store
+    store.delete_schema()
+    store.close()
+
+@pytest.fixture(scope="module")
+def indexed(vector_store, size, recorder):
+    # fresh collection with `size` synthetic chunks and random unit vectors (embedding is benchmarked separately)
+    vector_store.delete_schema()
+    vector_store.get_schema()
+
+    chunks = corpus.chunks(size, prefix=f"bench{size}")
+    dimension = vector_store.embedding_model.embed("dimension").shape[1]
+    vectors = SyntheticCorpus.vectors(size, dimension)
+
+    report = vector_store.insert_chunks_batch(chunks, embeddings=vectors)
+    recorder.record("insert", size, report.inserted, report.seconds, failed=report.failed, batch_size=report.batch_size)
+    return report
+
+def test_processing(size, recorder, tmp_path):
+    """Benchmark of partitioning, cleaning and chunking of synthetic .txt documents"""
+    num_chunks = min(size, PROCESS_LIMIT)
+    paths = corpus.write_documents(str(tmp_path), num_chunks)
+    processors = [DocumentProcessor(path) for path in paths]
+
+    with Timer() as partition:
+        for processor in processors:
+            processor.partition_elements()
+    with Timer() as cleaning:
+        for processor in processors:
+            processor.clean_elements(remove_titles=True, remove_formulas=True, remove_list_of_titles=True)
+    with Timer() as chunking:
+        for processor in processors:
+            processor.chunk_elements()
+
+    elements = sum(len(processor.elements) for processor in processors)
+    chunks = sum(len(processor.chunks) for processor in processors)
+    assert chunks > 0
+
+    for stage, timer, items, unit in [
+        ("partition", partition, len(paths), "docs"),
+        ("clean", cleaning, elements, "elements"),
+        ("chunk", chunking, chunks, "chunks"),
+    ]:
+        result = recorder.record(stage, size, items, timer.seconds, unit=unit)
+        color_print(f"{stage} [{size}]: {result['throughput']:.1f} {unit}/s", color="blue")
+
+def test_embedding(size, vector_store, recorder):
+    """Benchmark of chunk embedding (chunks/sec)"""
+    texts = [chunk.text for chunk in corpus.chunks(min(size, EMBED_LIMIT))]
+    vector_store.embedding_model.embed(texts[:8])  # warm-up
+
+    with Timer() as timer:
+        embeddings = vector_store.embedding_model.embed(texts, batch_size=100)
+    assert embeddings.shape[0] == len(texts)
+
+    result = recorder.record("embed", size, len(texts), timer.seconds)
+    color_print(f"embed [{size}]: {result['throughput']:.1f} chunks/s", color="blue")
+
+def test_insert(size, indexed, recorder):
+    """Benchmark of batch insert into an empty collection"""
+    assert indexed.failed == 0
+    assert indexed.inserted == size
+    color_print(f"insert [{size}]: {recorder.results[f'insert[{size}]']['throughput']:.0f} chunks/s", color="blue")
+
+def test_hybrid_search(size, vector_store, indexed, recorder):
+    """Benchmark of hybrid search latency (query embedding included)"""
+    queries = corpus.queries(NUM_QUERIES)
+    for stage, kwargs in [
+        ("hybrid", {"k": 5}),
+        ("hybrid_rights_autocut", {"k": 3, "rights": "user", "autocut": True}),  # as in /query
+    ]:
+        latencies, _ = search_latencies(vector_store, queries, **kwargs)
+        result = recorder.record(stage, size, len(queries), sum(latencies), unit="queries", latencies=latencies)
+        color_print(f"{stage} [{size}]: {result['throughput']:.1f} queries/s, p95 {result['p95_ms']:.1f} ms", color="blue")
+
+def test_hybrid_search_many(size, vector_store, indexed, recorder):
+    """Benchmark of the batched hybrid search (one embedding batch, concurrent searches) against the loop"""
+    queries = corpus.queries(NUM_QUERIES)
+    vector_store.hybrid_search_many(queries[:2], k=3, rights="user", autocut=True)  # warm-up
+    with Timer() as timer:
+        results = vector_store.hybrid_search_many(queries, k=3, rights="user", autocut=True)
+    assert [result.query for result in results] == queries
+
+    latencies = [result.seconds for result in results]
+    result = recorder.record("hybrid_many", size, len(queries), timer.seconds, unit="queries", latencies=latencies)
+    color_print(f"hybrid_many [{size}]: {result['throughput']:.1f} queries/s, p95 {result['p95_ms']:.1f} ms", color="blue")
+
+def test_rerank(size, vector_store, indexed, recorder):
+    """Benchmark of cross-encoder reranking of the hybrid search candidates"""
+    queries = corpus.queries(min(NUM_QUERIES, 20))
+    candidates = [vector_store.hybrid_search(query, k=10) for query in queries]
+    Reranker.rerank(queries[0], candidates[0])  # warm-up
+
+    latencies = []
+    for query, chunks in zip(queries, candidates):
+        with Timer() as timer:
+            Reranker.rerank(query, chunks)
+        latencies.append(timer.seconds)
+
+    result = recorder.record("rerank", size, len(queries), sum(latencies), unit="queries", latencies=latencies)
+    color_print(f"rerank [{size}]: p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms", color="blue")
+
+def test_query_end_to_end(size, indexed, recorder, monkeypatch):
+    """Benchmark of the /query endpoint with a fake LLM (rewrite + stream) on the benchmark collection"""
+    from fastapi.testclient import TestClient
+
+    import api
+
+    with FakeOpenAIServer(completion_tokens=50) as server:
+        monkeypatch.setenv("OPENAI_API_KEY", "fake-key")
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        monkeypatch.setenv("WEAVIATE_COLLECTION", COLLECTION)
+        client = TestClient(api.app)  # no lifespan, the sync worker is not started
+
+        queries = corpus.queries(min(NUM_QUERIES, 20))
+        latencies = []
+        for query in queries:
+            with Timer() as timer:
+                response = client.post("/query", json={"query": query, "rights": "user", "history": [], "use_history": False})
+            assert response.status_code == 200
+            latencies.append(timer.seconds)
+
+    result = recorder.record("query_end_to_end", size, len(queries), sum(latencies), unit="queries", latencies=latencies)
+    color_print(f"/query [{size}]: p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms", color="blue")
+
+def test_query_batch_end_to_end(size, indexed, recorder, monkeypatch):
+    """Benchmark of the /query_batch endpoint with a fake LLM (NDJSON stream of all answers)"""
+    import json
+
+    from fastapi.testclient import TestClient
+
+    import api
+
+    with FakeOpenAIServer(completion_tokens=50) as server:
+        monkeypatch.setenv("OPENAI_API_KEY", "fake-key")
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        monkeypatch.setenv("WEAVIATE_COLLECTION", COLLECTION)
+        client = TestClient(api.app)
+
+        queries = corpus.queries(NUM_QUERIES)
+        with Timer() as timer:
+            response = client.post("/query_batch", json={
+                "queries": [{"query": query, "rights": "user", "history": [], "use_history": False} for query in queries]
+            })
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.text.splitlines()]
+
+    results = [line for line in lines if line["index"] is not None]
+    assert sorted(line["index"] for line in results) == list(range(len(queries)))
+    assert not any("error" in line for line in results)
+    result = recorder.record("query_batch_end_to_end", size, len(queries), timer.seconds, unit="queries")
+    color_print(f"/query_batch [{size}]: {result['throughput']:.1f} queries/s ({lines[-1]['timings']})", color="blue")
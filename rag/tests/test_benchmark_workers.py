@@ -0,0 +1,64 @@
+import multiprocessing
+import os
+import shutil
+import time
+
+import pytest
+
+from ingestion_worker import file_task, run_worker
+from task_queue import TaskQueue
+from utils import color_print
+from vector_store import VectorStore
+
+TEST_FILE_PATH = "tests/test-files/long.txt"
+NUM_DOCUMENTS = int(os.getenv("BENCHMARK_WORKER_DOCS", "32"))
+WORKER_COUNTS = [1, 2, 4]
+
+results = {}
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    # copies of one document with unique names (unique file_id and chunk_id)
+    folder = tmp_path_factory.mktemp("worker-corpus")
+    for i in range(NUM_DOCUMENTS):
+        shutil.copy(TEST_FILE_PATH, folder / f"doc_{i}.txt")
+    return sorted(str(path) for path in folder.iterdir())
+
+def delete_corpus(corpus):
+    vector_store = VectorStore()
+    vector_store.delete_documents(corpus)
+    vector_store.close()
+
+@pytest.mark.parametrize("num_workers", WORKER_COUNTS)
+def test_worker_scaling(num_workers, corpus, tmp_path):
+    """Benchmark of docs/sec with N ingestion worker processes"""
+    delete_corpus(corpus)
+    queue = TaskQueue(str(tmp_path / "tasks.db"))
+    queue.enqueue({path: file_task(file_id=path, filename=path, path="user", source="local") for path in corpus})
+
+    # split the cores between the workers
+    torch_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=run_worker, args=(queue.path, f"bench-{i}", True, torch_threads))
+        for i in range(num_workers)
+    ]
+
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    stats = queue.stats()
+    assert stats["done"] == NUM_DOCUMENTS, stats
+
+    results[num_workers] = NUM_DOCUMENTS / elapsed
+    speedup = results[num_workers] / results[WORKER_COUNTS[0]] if WORKER_COUNTS[0] in results else 1.0
+    color_print(
+        f"{num_workers} workers: {results[num_workers]:.2f} docs/sec, speedup {speedup:.2f}x "
+        f"(efficiency {speedup / num_workers * WORKER_COUNTS[0]:.0%})",
+        color="blue"
+    )
+    delete_corpus(corpus)
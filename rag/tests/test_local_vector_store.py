@@ -0,0 +1,356 @@
+import hashlib
+import os
+import uuid
+from chunk import Chunk
+
+import numpy as np
+import pytest
+
+import fusion
+from embedding_model import BaseEmbeddingModel, DimensionReduction
+from local_vector_store import LocalIndex, LocalVectorStore
+from query_cache import QueryCache
+from tests.benchmark_utils import SyntheticCorpus
+
+# parity with Weaviate: PARITY_CHUNKS synthetic chunks, PARITY_QUERIES queries, top-PARITY_K compared
+PARITY_CHUNKS = int(os.getenv("PARITY_CHUNKS", "500"))
+PARITY_QUERIES = int(os.getenv("PARITY_QUERIES", "30"))
+PARITY_K = 5
+PARITY_COLLECTION = "ParityChunks"
+
+
+class HashEmbeddingModel(BaseEmbeddingModel):
+    '''deterministic bag-of-words embedding (sum of a random vector per word), texts sharing words are similar'''
+    def __init__(self, dimension: int = 32):
+        self.dimension = dimension
+
+    def word_vector(self, word: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.md5(word.encode("utf-8")).digest()[:4], "little")
+        return np.random.default_rng(seed).standard_normal(self.dimension)
+
+    def embed(self, texts, batch_size: int = 0, full: bool = False):
+        if isinstance(texts, str):
+            texts = [texts]
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[i] += self.word_vector(word)
+        return vectors if full else self.reduce(vectors)
+
+
+def make_chunk(file_id: str, index: int, text: str, rights: str = "user") -> Chunk:
+    return Chunk(chunk_id=f"{file_id}_{index}", file_id=file_id, text=text, filename=f"{file_id}.txt",
+                 file_directory="docs", title="", page="1", rights=rights)
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalVectorStore(collection_name="TestChunks", path=str(tmp_path / "store"), embedding_model=HashEmbeddingModel())
+    yield store
+    LocalIndex._shared.pop(store.path, None)
+
+@pytest.fixture
+def filled(store):
+    store.insert_chunks_batch([
+        make_chunk("animals", 0, "the quick brown fox jumps over the lazy dog"),
+        make_chunk("animals", 1, "cats sleep most of the day", rights="superior"),
+        make_chunk("space", 0, "the rocket reached the orbit of the moon"),
+        make_chunk("space", 1, "astronauts train for months before a launch"),
+        make_chunk("cooking", 0, "boil the pasta and add tomato sauce"),
+    ])
+    return store
+
+# ----------------------------------------------------------------------------------------------------
+def test_normalize_scores():
+    assert fusion.normalize_scores([("a", 4.0), ("b", 3.0), ("c", 2.0)]) == [1.0, 0.5, 0.0]
+    assert fusion.normalize_scores([("a", 0.7)]) == [1.0]
+    assert fusion.normalize_scores([]) == []
+
+def test_relative_score_fusion():
+    fused = fusion.relative_score_fusion(
+        [[("a", 10.0), ("b", 5.0), ("c", 0.0)], [("c", 0.9), ("a", 0.5)]],
+        weights=[0.5, 0.5],
+        names=["keyword,bm25", "vector,hybridVector"]
+    )
+    assert [object_id for object_id, _, _ in fused] == ["a", "c", "b"]
+    assert [round(score, 6) for _, score, _ in fused] == [0.5, 0.5, 0.25]
+    assert LocalVectorStore.format_explain_score(fused[0][2]) == "keyword: 1.00 | vector: 0.00"
+
+def test_autocut():
+    assert fusion.autocut([0.9, 0.88, 0.87, 0.3, 0.29, 0.28], 1) == 3
+    assert fusion.autocut([1.0, 0.99, 0.6, 0.59, 0.2, 0.19], 1) == 2
+    assert fusion.autocut([1.0, 0.99, 0.6, 0.59, 0.2, 0.19], 2) == 4
+    assert fusion.autocut([0.5, 0.5, 0.5], 1) == 3
+    assert fusion.autocut([0.5], 1) == 1
+
+def test_fuse_many_matches_relative_score_fusion():
+    rng = np.random.default_rng(0)
+    chunks = [Chunk(chunk_id=f"c{i}") for i in range(30)]
+    for _ in range(20):
+        keyword = [(chunks[i], float(rng.uniform(0, 10))) for i in rng.choice(30, 12, replace=False)]
+        vector = [(chunks[i], float(rng.uniform(0.2, 0.9))) for i in rng.choice(30, 12, replace=False)]
+        keyword.sort(key=lambda item: -item[1])
+        vector.sort(key=lambda item: -item[1])
+        candidates = fusion.Candidates.from_result_sets(keyword, vector)
+
+        alphas = np.array([0.0, 0.25, 0.55, 1.0])
+        order, scores = fusion.rank_many(fusion.fuse_many(candidates, alphas))
+        for row, alpha in enumerate(alphas):
+            expected = fusion.relative_score_fusion(
+                [[(c.chunk_id, s) for c, s in keyword] if alpha < 1 else [], [(c.chunk_id, s) for c, s in vector] if alpha > 0 else []],
+                weights=[1 - alpha, alpha],
+                names=["keyword,bm25", "vector,hybridVector"]
+            )
+            valid = np.isfinite(scores[row])
+            assert [candidates.chunks[i].chunk_id for i in order[row][valid]] == [object_id for object_id, _, _ in expected]
+            assert scores[row][valid] == pytest.approx([score for _, score, _ in expected])
+
+def test_autocut_many_matches_autocut():
+    rng = np.random.default_rng(1)
+    rows = [sorted(rng.uniform(0, 1, n), reverse=True) for n in [0, 1, 2, 5, 8, 20, 20]] + [[0.5] * 4]
+    scores = np.full((len(rows), 20), -np.inf)
+    for i, row in enumerate(rows):
+        scores[i, :len(row)] = row
+    for cut_off in [1, 2, 3]:
+        assert fusion.autocut_many(scores, cut_off).tolist() == [fusion.autocut(list(row), cut_off) for row in rows]
+
+def test_candidates_serialization():
+    candidates = fusion.Candidates.from_result_sets([(make_chunk("a", 0, "x"), 2.0)], [(make_chunk("b", 0, "y"), 0.5)])
+    restored = fusion.Candidates.from_dict(candidates.to_dict())
+    assert [chunk.chunk_id for chunk in restored.chunks] == ["a_0", "b_0"]
+    assert np.array_equal(restored.keyword_scores, candidates.keyword_scores, equal_nan=True)
+    assert np.array_equal(restored.vector_scores, candidates.vector_scores, equal_nan=True)
+
+def test_query_cache():
+    cache = QueryCache(max_entries=2)
+    calls = []
+    def search(name):
+        calls.append(name)
+        return [make_chunk(name, 0, f"text of {name}")]
+
+    assert cache.get_or_search("a", lambda: search("a"))[0].file_id == "a"
+    hit = cache.get_or_search("a", lambda: search("a"))
+    hit[0].reranked_score = 1.0  # callers modify the returned chunks, the cached copy stays unchanged
+    assert cache.get_or_search("a", lambda: search("a"))[0].reranked_score == 0.0
+    cache.get_or_search("b", lambda: search("b"))
+    cache.get_or_search("c", lambda: search("c"))  # evicts the least recently used "a"
+    cache.get_or_search("a", lambda: search("a"))
+    assert calls == ["a", "b", "c", "a"]
+    metrics = cache.metrics()
+    assert (metrics["hits"], metrics["misses"], metrics["evictions"], metrics["entries"]) == (2, 4, 2, 2)
+    assert metrics["hit_rate"] == pytest.approx(2 / 6)
+
+    # a write makes all results stale, also the result of a search running during the write
+    cache.bump_generation()
+    assert cache.metrics()["entries"] == 0
+    cache.get_or_search("c", lambda: (cache.bump_generation(), search("c"))[1])
+    assert cache.metrics()["entries"] == 0
+
+def test_query_cache_memory_cap():
+    chunks = [make_chunk("big", i, "x" * 1000) for i in range(3)]
+    cache = QueryCache(max_bytes=2 * QueryCache.size_of(chunks))
+    for key in ["a", "b", "c"]:
+        cache.get_or_search(key, lambda: chunks)
+    assert cache.metrics()["entries"] == 2
+    assert cache.metrics()["bytes"] <= cache.max_bytes
+    cache = QueryCache(max_bytes=QueryCache.size_of(chunks) - 1)
+    cache.get_or_search("a", lambda: chunks)
+    assert cache.metrics()["entries"] == 0  # larger than the whole cache
+
+# ----------------------------------------------------------------------------------------------------
+def test_insert_and_lookup(filled):
+    assert filled.document_exists("animals")
+    assert not filled.document_exists("missing")
+    assert filled.get_rights("animals") == "user"
+    assert filled.get_rights("missing") is None
+    assert filled.rights_for(["space", "missing"]) == {"space": "user"}
+    assert filled.existing_documents(["space", "missing", "cooking"]) == {"space", "cooking"}
+    assert sorted(filled.get_all_filenames()) == ["animals.txt", "cooking.txt", "space.txt"]
+
+def test_file_catalog(filled):
+    files, total = filled.file_catalog(offset=1, limit=1)
+    assert total == 3
+    assert files == [{"filename": "cooking.txt", "chunks": 1}]
+    assert filled.file_catalog()[0][0] == {"filename": "animals.txt", "chunks": 2}
+    filled.delete_document("animals")
+    assert filled.file_counts() == {"cooking.txt": 1, "space.txt": 2}
+
+def test_reinsert_is_idempotent(filled):
+    report = filled.insert_chunks_batch([make_chunk("space", 0, "the rocket reached the orbit of mars")])
+    assert report.inserted == 1
+    assert filled.index.size == 5
+    assert filled.hybrid_search("orbit", k=1, alpha=0)[0].text.endswith("mars")
+
+def test_delete(filled):
+    filled.delete_document("animals")
+    assert not filled.document_exists("animals")
+    report = filled.delete_documents(["space", "cooking", "missing", "space"])
+    assert (report.files, report.matched, report.deleted, report.failed) == (3, 3, 3, 0)
+    assert filled.index.size == 0
+    assert filled.hybrid_search("rocket") == []
+
+def test_keyword_search(filled):
+    chunks = filled.hybrid_search("rocket launch", k=2, alpha=0)
+    assert [chunk.file_id for chunk in chunks] == ["space", "space"]
+    assert chunks[0].score == pytest.approx(1.0)
+
+def test_vector_search(filled):
+    chunks = filled.hybrid_search("boil pasta with tomato", k=1, alpha=1)
+    assert chunks[0].chunk_id == "cooking_0"
+    assert chunks[0].explain_score == "vector: 1.00"
+
+def test_rights_filter(filled):
+    assert all(chunk.rights == "superior" for chunk in filled.hybrid_search("cats fox", rights="superior"))
+    assert "animals_1" not in [chunk.chunk_id for chunk in filled.hybrid_search("cats", rights="user", k=5)]
+
+def test_autocut_search(filled):
+    chunks = filled.hybrid_search("pasta tomato sauce", k=1, autocut=True)
+    assert 1 <= len(chunks) < 5
+    assert chunks[0].chunk_id == "cooking_0"
+
+def test_hybrid_search_many(filled):
+    queries = ["the moon orbit", "tomato pasta", "a dog and cats", "nothing matches"]
+    expected = [[(chunk.chunk_id, chunk.score) for chunk in filled.hybrid_search(query, k=2, rights="user")] for query in queries]
+    for vectors in [None, filled.embedding_model.embed(queries)]:
+        results = filled.hybrid_search_many(queries, k=2, rights="user", vectors=vectors)
+        assert [result.query for result in results] == queries
+        assert [[(chunk.chunk_id, chunk.score) for chunk in result.chunks] for result in results] == expected
+        assert all(result.seconds >= 0 for result in results)
+    assert filled.hybrid_search_many([]) == []
+
+def test_persistence(filled):
+    filled.delete_document("cooking")
+    expected = [(chunk.chunk_id, chunk.score) for chunk in filled.hybrid_search("the moon orbit", k=3)]
+
+    # reopen from the files (the shared index of the process is dropped)
+    LocalIndex._shared.pop(filled.path)
+    reopened = LocalVectorStore(collection_name="TestChunks", path=filled.path, embedding_model=HashEmbeddingModel())
+    assert reopened.index.size == 4
+    assert not reopened.document_exists("cooking")
+    actual = [(chunk.chunk_id, chunk.score) for chunk in reopened.hybrid_search("the moon orbit", k=3)]
+    assert [chunk_id for chunk_id, _ in actual] == [chunk_id for chunk_id, _ in expected]
+    assert [score for _, score in actual] == pytest.approx([score for _, score in expected])
+
+def test_growth_and_compaction(store):
+    corpus = SyntheticCorpus(seed=1)
+    chunks = corpus.chunks(3000, prefix="grow")
+    store.insert_chunks_batch(chunks, embeddings=SyntheticCorpus.vectors(len(chunks), 32))
+    assert store.index.size == 3000
+    assert store.index.vectors.shape[0] >= 3000
+
+    file_ids = sorted({chunk.file_id for chunk in chunks})
+    removed = file_ids[:len(file_ids) * 3 // 4]
+    store.delete_documents(removed)
+    assert store.index.deleted == 0  # compacted
+    assert not any(store.document_exists(file_id) for file_id in removed)
+    assert store.document_exists(file_ids[-1])
+    assert store.hybrid_search(corpus.queries(1)[0], k=3)
+
+@pytest.mark.parametrize("autocut", [False, True])
+def test_fused_candidates_match_hybrid_search(filled, autocut):
+    for query in ["the moon orbit", "tomato pasta", "a dog and cats"]:
+        candidates = filled.fetch_candidates(query)
+        for alpha in [0.0, 0.3, 0.55, 1.0]:
+            expected = filled.hybrid_search(query, k=2, alpha=alpha, autocut=autocut)
+            actual = fusion.hybrid_from_candidates(candidates, alpha=alpha, k=2, autocut=autocut)
+            assert [chunk.chunk_id for chunk in actual] == [chunk.chunk_id for chunk in expected]
+            assert [chunk.score for chunk in actual] == pytest.approx([chunk.score for chunk in expected])
+
+def test_pca_reduction(tmp_path):
+    # 3 dominant directions in 32 dimensions
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((500, 3)) @ rng.standard_normal((3, 32)) + 0.01 * rng.standard_normal((500, 32))
+    path = str(tmp_path / "projection.npz")
+    assert DimensionReduction.fit_pca(vectors, 3, path) > 0.99
+
+    reduction = DimensionReduction("pca", 3, path)
+    reduced = reduction(vectors)
+    assert reduced.shape == (500, 3)
+    assert np.linalg.norm(reduced, axis=1) == pytest.approx(np.ones(500), abs=1e-5)
+    assert reduction(reduced) is reduced  # reduced vectors are not projected again
+
+    # cosine neighbours are kept by the projection
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    assert np.argmax(reduced[1:] @ reduced[0]) in np.argsort(-(normalized[1:] @ normalized[0]))[:5]
+
+def test_matryoshka_reduction():
+    reduced = DimensionReduction("matryoshka", 2)(np.array([[3.0, 4.0, 100.0]]))
+    assert reduced.tolist() == [[pytest.approx(0.6), pytest.approx(0.8)]]
+
+def test_reduced_local_store(tmp_path):
+    model = HashEmbeddingModel(dimension=64)
+    chunks = SyntheticCorpus(seed=3).chunks(200, prefix="reduced")
+    path = str(tmp_path / "projection.npz")
+    DimensionReduction.fit_pca(model.embed([chunk.text for chunk in chunks], full=True), 16, path)
+    model.reduction = DimensionReduction("pca", 16, path)
+
+    store = LocalVectorStore(collection_name="ReducedChunks", path=str(tmp_path / "reduced"), embedding_model=model)
+    store.insert_chunks_batch(chunks, embeddings=model.embed([chunk.text for chunk in chunks], full=True))
+    assert store.index.vectors.shape[1] == 16
+    hits = sum(store.hybrid_search(chunk.text, k=1, alpha=1)[0].chunk_id == chunk.chunk_id for chunk in chunks[:20])
+    assert hits >= 18
+    LocalIndex._shared.pop(store.path, None)
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.fixture(scope="module")
+def weaviate_store():
+    try:
+        from vector_store import VectorStore
+        store = VectorStore(collection_name=PARITY_COLLECTION)
+    except Exception as e:
+        pytest.skip(f"Weaviate is not available: {e}")
+    yield store
+    store.delete_schema()
+    store.close()
+
+def test_parity_with_weaviate(weaviate_store, tmp_path):
+    """Same chunks, vectors and queries in both stores, the hybrid results have to agree"""
+    corpus = SyntheticCorpus(seed=7)
+    chunks = corpus.chunks(PARITY_CHUNKS, prefix="parity")
+    vectors = SyntheticCorpus.vectors(len(chunks), 64)
+    queries = corpus.queries(PARITY_QUERIES)
+    query_vectors = dict(zip(queries, SyntheticCorpus.vectors(len(queries), 64, seed=8)))
+
+    class FixedEmbeddingModel(BaseEmbeddingModel):
+        def embed(self, texts, batch_size: int = 0):
+            return np.asarray([query_vectors[texts]])
+
+    weaviate_store.delete_schema()
+    weaviate_store.get_schema()
+    weaviate_store.embedding_model = FixedEmbeddingModel()
+    local_store = LocalVectorStore(collection_name=PARITY_COLLECTION, path=str(tmp_path / "parity"), embedding_model=FixedEmbeddingModel())
+    assert weaviate_store.insert_chunks_batch(chunks, embeddings=vectors).failed == 0
+    local_store.insert_chunks_batch(chunks, embeddings=vectors)
+
+    for alpha in [0.0, 0.55, 1.0]:
+        jaccards, top1 = [], 0
+        for query in queries:
+            expected = [chunk.chunk_id for chunk in weaviate_store.hybrid_search(query, k=PARITY_K, alpha=alpha)]
+            actual = [chunk.chunk_id for chunk in local_store.hybrid_search(query, k=PARITY_K, alpha=alpha)]
+            union = set(expected) | set(actual)
+            jaccards.append(len(set(expected) & set(actual)) / len(union) if union else 1.0)
+            top1 += expected[:1] == actual[:1]
+        assert np.mean(jaccards) >= 0.8, f"alpha {alpha}: mean Jaccard {np.mean(jaccards):.2f}"
+        assert top1 / len(queries) >= 0.8, f"alpha {alpha}: top-1 agreement {top1 / len(queries):.0%}"
+
+    LocalIndex._shared.pop(local_store.path, None)
+
+def test_hydrate_objects_with_random_ids(weaviate_store):
+    """Objects inserted before the ids were derived from chunk_id are hydrated by their chunk_id"""
+    weaviate_store.delete_schema()
+    weaviate_store.get_schema()
+    dimension = 8
+    current = make_chunk("current", 0, "object id derived from the chunk id")
+    legacy = make_chunk("legacy", 1, "object with a random id", rights="superior")
+    # shares the words of the legacy chunk_id, must not be taken for it
+    similar = make_chunk("legacy_1", 0, "another object with a random id")
+
+    weaviate_store.insert_chunks_batch([current], embeddings=SyntheticCorpus.vectors(1, dimension))
+    for chunk, vector in zip([legacy, similar], SyntheticCorpus.vectors(2, dimension, seed=1)):
+        weaviate_store.collection.data.insert(properties=chunk.to_dict(), vector=vector, uuid=uuid.uuid4())
+
+    lean = [Chunk(chunk_id=chunk.chunk_id, text=chunk.text) for chunk in [current, legacy]]
+    weaviate_store.hydrate(lean)
+    assert [(chunk.file_id, chunk.filename, chunk.rights) for chunk in lean] == [
+        ("current", "current.txt", "user"),
+        ("legacy", "legacy.txt", "superior")
+    ]
@@ -0,0 +1,80 @@
+import time
+
+import numpy as np
+import pytest
+
+from embedding_model import OpenAIEmbeddingModel
+from tests.fake_openai import FakeOpenAIServer
+from utils import color_print
+
+DIMENSION = 8
+
+def texts(n):
+    return [f"chunk number {i} " + "lorem ipsum " * (i % 50) for i in range(n)]
+
+def expected(texts):
+    return np.array([FakeOpenAIServer.fake_embedding(text, DIMENSION) for text in texts], dtype=np.float32)
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "fake-key")
+
+@pytest.fixture
+def server():
+    with FakeOpenAIServer(dimension=DIMENSION) as server:
+        yield server
+
+def get_model(server, **kwargs):
+    return OpenAIEmbeddingModel(base_url=server.base_url, **kwargs)
+
+def test_order_and_alignment(server):
+    inputs = texts(500)
+    embeddings = get_model(server).embed(inputs, batch_size=64)
+
+    assert embeddings.dtype == np.float32 and embeddings.shape == (500, DIMENSION)
+    assert np.allclose(embeddings, expected(inputs))
+    # 500 inputs in batches of at most 64
+    assert len(server.requests) == 8
+    assert max(n for _, n in server.requests) <= 64
+
+def test_token_limit_splits_batches(server, monkeypatch):
+    monkeypatch.setattr(OpenAIEmbeddingModel, "MAX_TOKENS_PER_REQUEST", 200)
+    inputs = texts(100)
+    embeddings = get_model(server).embed(inputs)
+
+    assert np.allclose(embeddings, expected(inputs))
+    assert len(server.requests) > 1
+
+def test_empty_input_is_kept_aligned(server):
+    inputs = ["first", "", "third"]
+    embeddings = get_model(server).embed(inputs)
+
+    assert embeddings.shape == (3, DIMENSION)
+    assert np.allclose(embeddings[0], expected(["first"])[0])
+    assert np.allclose(embeddings[2], expected(["third"])[0])
+
+def test_retry_on_rate_limit(server):
+    server.fail_first = 2
+    inputs = texts(10)
+    embeddings = get_model(server).embed(inputs)
+
+    assert np.allclose(embeddings, expected(inputs))
+    assert len(server.requests) == 3
+
+def test_failure_is_raised(server, monkeypatch):
+    monkeypatch.setattr(OpenAIEmbeddingModel, "MAX_RETRIES", 1)
+    server.fail_first = 10
+
+    with pytest.raises(Exception):
+        get_model(server).embed(texts(10))
+
+def test_throughput_benchmark():
+    """Benchmark of texts/sec with a fixed request latency (serial vs. concurrent requests)"""
+    inputs = texts(5000)
+    with FakeOpenAIServer(dimension=DIMENSION, latency=0.05, shuffle=False) as server:
+        for concurrency in [1, 4, 8]:
+            model = get_model(server, max_concurrency=concurrency)
+            start = time.perf_counter()
+            model.embed(inputs, batch_size=100)
+            elapsed = time.perf_counter() - start
+            color_print(f"OpenAI embeddings, concurrency {concurrency}: {len(inputs) / elapsed:.0f} texts/sec", color="blue")
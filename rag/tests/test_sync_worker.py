@@ -0,0 +1,148 @@
+import threading
+import time
+
+import pytest
+
+from sync_worker import SyncWorker
+
+DEBOUNCE = 0.2
+
+
+class FakeSync:
+    '''stands in for run_sync, records when each sync started'''
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.calls = []
+        self.called = threading.Event()
+
+    def __call__(self):
+        self.calls.append(time.monotonic())
+        self.called.set()
+        if self.fail:
+            raise RuntimeError("drive unavailable")
+        return {"files": len(self.calls)}
+
+def wait_until(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+@pytest.fixture
+def worker_factory():
+    workers = []
+
+    def make(sync_fn, **kwargs):
+        worker = SyncWorker(sync_fn, **kwargs)
+        worker.start()
+        workers.append(worker)
+        return worker
+
+    yield make
+    for worker in workers:
+        worker.stop(timeout=5)
+
+# ----------------------------------------------------------------------------------------------------
+def test_burst_runs_one_sync(worker_factory):
+    sync = FakeSync()
+    worker = worker_factory(sync, debounce_seconds=DEBOUNCE, max_delay_seconds=10)
+
+    for _ in range(20):
+        worker.notify()
+    assert wait_until(lambda: worker.syncs_total == 1)
+    # nothing else is queued, no second sync follows
+    time.sleep(DEBOUNCE * 2)
+
+    assert len(sync.calls) == 1
+    metrics = worker.metrics()
+    assert metrics["notifications_total"] == 20
+    assert metrics["coalesced_notifications"] == 19
+    assert metrics["pending_notifications"] == 0
+
+def test_notification_during_sync_runs_another_sync(worker_factory):
+    release = threading.Event()
+    calls = []
+
+    def slow_sync():
+        calls.append(time.monotonic())
+        release.wait(5)
+
+    worker = worker_factory(slow_sync, debounce_seconds=DEBOUNCE, max_delay_seconds=10)
+    worker.notify(immediate=True)
+    assert wait_until(lambda: worker.running)
+    worker.notify(immediate=True)
+    release.set()
+
+    assert wait_until(lambda: worker.syncs_total == 2)
+    assert len(calls) == 2
+
+def test_max_delay_is_respected(worker_factory):
+    sync = FakeSync()
+    worker = worker_factory(sync, debounce_seconds=DEBOUNCE, max_delay_seconds=0.5)
+
+    # notifications keep arriving faster than the debounce window for twice the max delay
+    start = time.monotonic()
+    while time.monotonic() - start < 1.0:
+        worker.notify()
+        time.sleep(DEBOUNCE / 4)
+
+    assert sync.called.is_set()
+    first_delay = sync.calls[0] - start
+    assert 0.5 <= first_delay < 0.5 + DEBOUNCE
+    assert worker.last_queue_lag < 0.5 + DEBOUNCE
+
+def test_immediate_skips_debounce(worker_factory):
+    sync = FakeSync()
+    worker = worker_factory(sync, debounce_seconds=5, max_delay_seconds=10)
+
+    start = time.monotonic()
+    worker.notify(immediate=True)
+    assert sync.called.wait(2)
+    assert sync.calls[0] - start < 1
+
+def test_lag_metrics(worker_factory):
+    sync = FakeSync()
+    worker = worker_factory(sync, debounce_seconds=DEBOUNCE, max_delay_seconds=10)
+
+    metrics = worker.metrics()
+    assert metrics["syncs_total"] == 0 and metrics["last_queue_lag_seconds"] is None
+
+    worker.notify()
+    time.sleep(DEBOUNCE / 2)
+    # waiting in the debounce window, the lag grows until the sync starts
+    metrics = worker.metrics()
+    assert metrics["pending_notifications"] == 1
+    assert 0 < metrics["queue_lag_seconds"] < DEBOUNCE
+
+    assert wait_until(lambda: worker.syncs_total == 1)
+    metrics = worker.metrics()
+    assert metrics["pending_notifications"] == 0
+    assert metrics["queue_lag_seconds"] == 0.0
+    assert metrics["last_queue_lag_seconds"] >= DEBOUNCE
+    assert metrics["max_queue_lag_seconds"] == metrics["last_queue_lag_seconds"]
+    assert metrics["last_sync_duration_seconds"] is not None
+    assert metrics["last_result"] == {"files": 1}
+
+    # an immediate sync has a shorter lag, the maximum is kept
+    worker.notify(immediate=True)
+    assert wait_until(lambda: worker.syncs_total == 2)
+    metrics = worker.metrics()
+    assert metrics["last_queue_lag_seconds"] < DEBOUNCE
+    assert metrics["max_queue_lag_seconds"] >= DEBOUNCE
+
+def test_failed_sync_is_counted(worker_factory):
+    sync = FakeSync(fail=True)
+    worker = worker_factory(sync, debounce_seconds=DEBOUNCE, max_delay_seconds=10)
+
+    worker.notify(immediate=True)
+    assert wait_until(lambda: worker.syncs_total == 1)
+    metrics = worker.metrics()
+    assert metrics["sync_errors"] == 1
+    assert metrics["last_error"] == "RuntimeError: drive unavailable"
+    assert metrics["last_result"] is None
+
+    # the worker keeps running after a failure
+    worker.notify(immediate=True)
+    assert wait_until(lambda: worker.syncs_total == 2)
@@ -0,0 +1,121 @@
+import time
+
+import pytest
+
+from task_queue import TaskQueue
+
+LEASE = 0.2  # seconds, expired leases are simulated by sleeping past it
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = TaskQueue(path=str(tmp_path / "tasks.db"), lease_seconds=LEASE, max_attempts=3)
+    # failed tasks are available again right away
+    queue.RETRY_BACKOFF_SECONDS = 0
+    return queue
+
+def expire():
+    time.sleep(LEASE * 1.5)
+
+# ----------------------------------------------------------------------------------------------------
+def test_enqueue_is_idempotent(queue):
+    assert queue.enqueue({"a": {"file": 1}, "b": {"file": 2}}) == 2
+    assert queue.enqueue({"a": {"file": 1}, "c": {"file": 3}}) == 1
+    assert queue.stats() == {"pending": 3, "leased": 0, "done": 0, "failed": 0}
+
+def test_leased_tasks_are_not_shared(queue):
+    queue.enqueue({"a": {"file": 1}, "b": {"file": 2}, "c": {"file": 3}})
+
+    first = queue.lease("w1", n=2)
+    second = queue.lease("w2", n=2)
+    assert [task.task_id for task in first] == ["a", "b"]
+    assert [task.task_id for task in second] == ["c"]
+    assert first[0].payload == {"file": 1} and first[0].attempts == 1
+    assert queue.lease("w3") == []
+
+def test_expired_lease_is_released(queue):
+    queue.enqueue({"a": {}})
+    assert [task.task_id for task in queue.lease("w1")] == ["a"]
+    assert queue.lease("w2") == []
+
+    # w1 died, its lease runs out
+    expire()
+    tasks = queue.lease("w2")
+    assert [task.task_id for task in tasks] == ["a"]
+    assert tasks[0].attempts == 2
+
+def test_extend_lease(queue):
+    queue.enqueue({"a": {}})
+    queue.lease("w1")
+
+    # only the owner can extend the lease
+    time.sleep(LEASE / 2)
+    queue.extend_lease(["a"], "w2")
+    queue.extend_lease(["a"], "w1")
+    time.sleep(LEASE * 0.75)
+    assert queue.lease("w2") == []
+
+    expire()
+    assert [task.task_id for task in queue.lease("w2")] == ["a"]
+
+def test_fail_retries_until_max_attempts(queue):
+    queue.enqueue({"a": {}})
+
+    for attempt in range(1, queue.max_attempts + 1):
+        (task,) = queue.lease("w1")
+        assert task.attempts == attempt
+        queue.fail(task, "w1", f"error {attempt}")
+        expected = "failed" if attempt == queue.max_attempts else "pending"
+        assert queue.stats()[expected] == 1
+
+    assert queue.lease("w1") == []
+    assert queue.failed_tasks() == [{"task_id": "a", "attempts": 3, "error": "error 3"}]
+    assert queue.is_drained()
+
+def test_expired_leases_count_as_attempts(queue):
+    queue.enqueue({"a": {}})
+
+    for _ in range(queue.max_attempts):
+        assert len(queue.lease("w1")) == 1
+        expire()
+
+    # the last lease expired as well, the task is given up instead of leased again
+    assert queue.lease("w1") == []
+    assert queue.failed_tasks() == [{"task_id": "a", "attempts": 3, "error": "lease expired"}]
+
+def test_fail_backoff(queue):
+    queue.RETRY_BACKOFF_SECONDS = 60
+    queue.enqueue({"a": {}})
+    (task,) = queue.lease("w1")
+    queue.fail(task, "w1", "error")
+
+    assert queue.stats()["pending"] == 1
+    assert queue.lease("w1") == []
+
+def test_complete(queue):
+    queue.enqueue({"a": {}, "b": {}})
+    tasks = queue.lease("w1", n=2)
+    queue.complete([task.task_id for task in tasks], "w1")
+
+    assert queue.stats() == {"pending": 0, "leased": 0, "done": 2, "failed": 0}
+    assert queue.is_drained()
+    assert queue.lease("w1") == []
+
+def test_stale_worker_is_ignored(queue):
+    queue.enqueue({"a": {}, "b": {}})
+    stale = queue.lease("w1", n=2)
+
+    # w1 stalls, w2 takes over both tasks
+    expire()
+    current = queue.lease("w2", n=2)
+    assert len(current) == 2
+
+    queue.complete(["a"], "w1")
+    queue.fail(stale[1], "w1", "late failure")
+    queue.extend_lease(["a", "b"], "w1")
+    assert queue.stats() == {"pending": 0, "leased": 2, "done": 0, "failed": 0}
+
+    queue.complete(["a"], "w2")
+    queue.fail(current[1], "w2", "error")
+    stats = queue.stats()
+    assert stats["done"] == 1 and stats["pending"] == 1
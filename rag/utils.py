@@ -12,3 +12,19 @@ color_codes = {
 
 def color_print(message: str, color: str = "green", additional_text: str = ""):
     print("\033[" + color_codes[color] + "m" + message + "\033[0m" + additional_text)
+
+def parse_server_timing(header: str) -> dict:
+    # "rewrite_query;dur=12.3, hybrid_search;dur=4.5" -> {"rewrite_query": 0.0123, "hybrid_search": 0.0045}
+    timings = {}
+    for metric in filter(None, (part.strip() for part in header.split(","))):
+        name, _, duration = metric.partition(";dur=")
+        if duration:
+            timings[name] = float(duration) / 1000
+    return timings
+
+def add_usage(usage, response):
+    # accumulates the token usage of an OpenAI chat completion into the usage dict (None = not measured)
+    if usage is None or getattr(response, "usage", None) is None:
+        return
+    usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + response.usage.prompt_tokens
+    usage["completion_tokens"] = usage.get("completion_tokens", 0) + response.usage.completion_tokens
@@ -1,36 +1,246 @@
 # File: vector_store.py - VectorStore module 
 # Author: Adam Valík <xvalik05@stud.fit.vut.cz>
 
+import json
 import os
 import re
 import time
+from abc import ABC, abstractmethod
 from chunk import Chunk
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
 
+import numpy as np
 from tqdm import tqdm
 from weaviate import connect_to_local
+from weaviate.classes.aggregate import GroupByAggregate
 from weaviate.classes.config import (Configure, DataType, Property,
-                                     VectorDistances)
+                                     Tokenization, VectorDistances)
 from weaviate.classes.data import DataObject
-from weaviate.classes.query import Filter, HybridFusion, MetadataQuery
+from weaviate.classes.query import Filter, HybridFusion, MetadataQuery, Metrics
 from weaviate.client import WeaviateClient
 from weaviate.exceptions import WeaviateConnectionError
+from weaviate.util import generate_uuid5
 
-from embedding_model import EmbeddingModelFactory
+import fusion
+from batch_writer import BatchReport, BatchWriter
+from embedding_model import BaseEmbeddingModel, EmbeddingModelFactory
+from fusion import Candidates
+from query_cache import bump_generation, query_cache
 from utils import color_print
 
 
-class VectorStore():
+@dataclass
+class DeleteReport:
+    files: int = 0      # distinct file ids of the request
+    matched: int = 0    # chunks matched by the filters
+    deleted: int = 0
+    failed: int = 0
+    requests: int = 0   # delete requests sent to the store
+    seconds: float = 0.0
+
+    def to_dict(self) -> dict:
+        return vars(self).copy()
+
+    def __str__(self):
+        return (
+            f"{self.deleted}/{self.matched} chunks of {self.files} files deleted in {self.seconds:.2f}s "
+            f"({self.requests} requests), {self.failed} failed"
+        )
+
+
+@dataclass
+class SearchResult:
+    query: str
+    chunks: List[Chunk]
+    seconds: float = 0.0  # search of the query (the embedding of the batch is not included)
+
+
+class BaseVectorStore(ABC):
+    '''interface of the chunk stores (Weaviate, in-process local store), chunks are embedded by the store'''
     EMBEDDING_MODEL_TYPE = "huggingface"
     EMBEDDING_MODEL = "all-mpnet-base-v2"
+    CANDIDATES = 100  # size of the result sets fused by the hybrid search (the hybrid sub-search limit of Weaviate)
+    SEARCH_WORKERS = 8  # concurrent searches of hybrid_search_many
+
+    def load_embedding_model(self) -> BaseEmbeddingModel:
+        return EmbeddingModelFactory.get_model(model_type=self.EMBEDDING_MODEL_TYPE, model_name=self.EMBEDDING_MODEL)
+
+    @staticmethod
+    def chunk_uuid(chunk: Chunk) -> str:
+        # deterministic object id, re-inserting the same chunk overwrites it (idempotent writes)
+        return generate_uuid5(chunk.chunk_id)
+
+    @abstractmethod
+    def get_schema(self):
+        pass
+
+    @abstractmethod
+    def delete_schema(self):
+        pass
+
+    @abstractmethod
+    def existing_documents(self, file_ids: List[str]) -> Set[str]:
+        '''file ids of the given files that have chunks in the store'''
+        pass
+
+    def document_exists(self, file_id: str) -> bool:
+        return file_id in self.existing_documents([file_id])
+
+    @abstractmethod
+    def insert_chunks_batch(self, chunks: List[Chunk], embeddings: Optional[np.ndarray] = None) -> BatchReport:
+        pass
+
+    def insert_chunks(self, chunks: List[Chunk], embeddings: Optional[np.ndarray] = None):
+        self.insert_chunks_batch(chunks, embeddings=embeddings)
+
+    def delete_document(self, file_id: str):
+        if self.delete_documents([file_id], verbose=False).deleted:
+            color_print(f"File {file_id} successfully deleted from collection.")
+        else:
+            color_print(f"File {file_id} not found in collection.", color="yellow")
+
+    @abstractmethod
+    def delete_documents(self, file_ids: List[str], verbose: bool = True) -> DeleteReport:
+        '''deletes all chunks of the given files, verbose prints the counts of the report'''
+        pass
+
+    def update_document(self, file_id: str, new_chunks: List[Chunk]):
+        if not self.document_exists(file_id):
+            color_print(f"File {file_id} not found in collection.", color="yellow")
+            return
+
+        # delete existing document
+        self.delete_document(file_id)
+        # insert new chunks
+        self.insert_chunks_batch(new_chunks)
+
+    @abstractmethod
+    def rights_for(self, file_ids: List[str]) -> Dict[str, str]:
+        pass
+
+    def get_rights(self, file_id: str) -> Optional[str]:
+        return self.rights_for([file_id]).get(file_id)
+
+    @abstractmethod
+    def file_counts(self) -> Dict[str, int]:
+        '''number of chunks per filename'''
+        pass
+
+    def file_catalog(self, offset: int = 0, limit: Optional[int] = None) -> Tuple[List[dict], int]:
+        # one page of the files sorted by name with their chunk counts, and the number of all files
+        counts = self.file_counts()
+        filenames = sorted(counts)
+        page = filenames[offset:offset + limit] if limit is not None else filenames[offset:]
+        return [{"filename": filename, "chunks": counts[filename]} for filename in page], len(filenames)
+
+    def get_all_filenames(self) -> List[str]:
+        return sorted(self.file_counts())
+
+    @abstractmethod
+    def hybrid_search(self, query: str, rights: str = None, k: int = 5, alpha: float = 0.55, autocut: bool = False, vector: Optional[np.ndarray] = None) -> List[Chunk]:
+        '''vector = precomputed embedding of the query (full or reduced), embedded by the store otherwise'''
+        pass
+
+    def hybrid_search_many(
+        self,
+        queries: List[str],
+        rights: str = None,
+        k: int = 5,
+        alpha: float = 0.55,
+        autocut: bool = False,
+        vectors: Optional[np.ndarray] = None
+    ) -> List[SearchResult]:
+        '''hybrid searches of the queries with one embedding batch, results in the order of the queries'''
+        if not queries:
+            return []
+        if vectors is None:
+            vectors = self.embedding_model.embed(list(queries), full=True)
+
+        def search(i: int) -> SearchResult:
+            start = time.perf_counter()
+            chunks = self.hybrid_search(queries[i], rights=rights, k=k, alpha=alpha, autocut=autocut, vector=vectors[i])
+            return SearchResult(query=queries[i], chunks=chunks, seconds=time.perf_counter() - start)
+
+        # the searches share the client of the store (one multiplexed connection)
+        with ThreadPoolExecutor(max_workers=min(self.SEARCH_WORKERS, len(queries))) as executor:
+            return list(executor.map(search, range(len(queries))))
+
+    def query_embedding(self, query: str, vector: Optional[np.ndarray] = None) -> np.ndarray:
+        # vector of the index for the query, a precomputed vector is only reduced (EMBEDDING_REDUCTION)
+        if vector is None:
+            return self.embedding_model.embed(query)[0]
+        return self.embedding_model.reduce(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+
+    def hybrid_search_lean(self, query: str, rights: str = None, k: int = 5, alpha: float = 0.55, autocut: bool = False, explain: bool = False) -> List[Chunk]:
+        '''chunk_id, text and score of the hits (the reranking input), hydrate() fills the metadata of the kept chunks'''
+        return self.hybrid_search(query, rights=rights, k=k, alpha=alpha, autocut=autocut)
+
+    def hydrate(self, chunks: List[Chunk]) -> List[Chunk]:
+        '''fills the metadata of the chunks returned by hybrid_search_lean (in place)'''
+        return chunks
+
+    @abstractmethod
+    def fetch_candidates(self, query: str, rights: str = None, limit: int = CANDIDATES, vector: Optional[np.ndarray] = None) -> Candidates:
+        '''keyword and vector result sets of the hybrid search with raw scores, fused on the client (fusion.py)'''
+        pass
+
+    def close(self):
+        self.embedding_model.close()
+
+    @staticmethod
+    def format_explain_score(explain_score: str) -> str:
+        pattern = re.compile(r"normalized score: ([\d.]+)")
+        matches = pattern.findall(explain_score)
+
+        if len(matches) == 1:
+            return f"vector: {float(matches[0]):.2f}"
+        elif len(matches) == 2:
+            return f"keyword: {float(matches[0]):.2f} | vector: {float(matches[1]):.2f}"        
+        else:
+            return explain_score
+
+
+class VectorStore(BaseVectorStore):
+    DELETE_LIMIT = 10000  # QUERY_MAXIMUM_RESULTS, maximum number of objects deleted by one delete_many
+    FILTER_BATCH = 1000   # file ids of one filter (bulk existence, rights and delete requests)
+    # vector index of new collections (None = Weaviate default), WEAVIATE_INDEX='{"quantizer": "sq"}' overrides,
+    # tests/index_sweep.py measures recall, latency and memory of the settings
+    INDEX = {
+        "ef": None,                 # query-time candidate list (-1 = dynamic ef, the default), can change later
+        "ef_construction": None,    # build-time candidate list (default 128)
+        "max_connections": None,    # graph edges per node (default 32), memory of the graph
+        "quantizer": None,          # None | pq | bq | sq, compressed vectors in memory
+        "rescore_limit": None,      # bq / sq: candidates rescored with the full vectors (on disk)
+        "segments": None,           # pq: segments of a vector, one byte each (must divide the dimension)
+        "training_limit": None      # pq / sq: vectors the compression is trained on (trained when reached)
+    }
     
-    def __init__(self):
+    CATALOG_LIMIT = 100000  # files listed by the catalog (groups of one aggregation)
+    LEAN_PROPERTIES = ["chunk_id", "text"]  # properties returned by hybrid_search_lean
+    CHUNK_ID_MATCHES = 10   # objects fetched per chunk_id when hydrating objects with random ids
+    DOCUMENTS_K = 20        # documents selected by the first level of the hierarchical search
+    DOCUMENTS_BATCH = 100   # files of one document refresh query
+
+    def __init__(
+        self,
+        collection_name: Optional[str] = None,
+        index: Optional[dict] = None,
+        embedding_model: Optional[BaseEmbeddingModel] = None,
+        hierarchical: Optional[bool] = None
+    ):
         self.client = self.connect()
         if self.client is None:
             raise WeaviateConnectionError("Failed to connect to Weaviate after multiple attempts.")
-        self.collection_name = "DocumentChunks"
+        # a separate collection keeps benchmarks and experiments away from the production data
+        self.collection_name = collection_name or os.getenv("WEAVIATE_COLLECTION", "DocumentChunks")
+        self.index = {**self.INDEX, **json.loads(os.getenv("WEAVIATE_INDEX") or "{}"), **(index or {})}
+        # two-level search: documents first, then their chunks (HIERARCHICAL_SEARCH=1)
+        self.hierarchical = hierarchical if hierarchical is not None else os.getenv("HIERARCHICAL_SEARCH") == "1"
         self.get_schema()
-        self.embedding_model = EmbeddingModelFactory.get_model(model_type=self.EMBEDDING_MODEL_TYPE, model_name=self.EMBEDDING_MODEL)
+        self.embedding_model = embedding_model or self.load_embedding_model()
+        self.full_vectors = self.open_full_vectors()
         color_print("Connected to Weaviate.")
         
     @staticmethod
@@ -49,114 +259,348 @@ class VectorStore():
                 time.sleep(2)
         return None
 
+    @staticmethod
+    def index_config(index: dict):
+        # HNSW with cosine distance and the optional quantizer (compressed vectors in memory, rescoring with the full ones)
+        quantizer = index.get("quantizer")
+        if quantizer == "pq":
+            quantizer = Configure.VectorIndex.Quantizer.pq(segments=index.get("segments"), training_limit=index.get("training_limit"))
+        elif quantizer == "bq":
+            quantizer = Configure.VectorIndex.Quantizer.bq(rescore_limit=index.get("rescore_limit"))
+        elif quantizer == "sq":
+            quantizer = Configure.VectorIndex.Quantizer.sq(rescore_limit=index.get("rescore_limit"), training_limit=index.get("training_limit"))
+        elif quantizer is not None:
+            raise ValueError(f"Unknown quantizer '{quantizer}'")
+
+        return Configure.VectorIndex.hnsw(
+            distance_metric=VectorDistances.COSINE,
+            ef=index.get("ef"),
+            ef_construction=index.get("ef_construction"),
+            max_connections=index.get("max_connections"),
+            quantizer=quantizer
+        )
+
+    def collection_config(self) -> dict:
+        # arguments of collections.create, extended by the partitioned store (tenant_vector_store.py)
+        return {
+            "vector_index_config": self.index_config(self.index),
+            "properties": [
+                Property(name="chunk_id", data_type=DataType.TEXT),
+                Property(name="file_id", data_type=DataType.TEXT, tokenization=Tokenization.FIELD),
+                Property(name="text", data_type=DataType.TEXT),
+                Property(name="filename", data_type=DataType.TEXT),
+                Property(name="file_directory", data_type=DataType.TEXT),
+                Property(name="title", data_type=DataType.TEXT),
+                Property(name="page", data_type=DataType.TEXT),
+                Property(name="rights", data_type=DataType.TEXT)
+            ],
+        }
+
     def get_schema(self):
         # avoid recreating the schema
         if not self.client.collections.exists(self.collection_name):
             print("Schema does not exist. Creating schema...")
-            self.collection = self.client.collections.create(
-                name=self.collection_name,
-                vector_index_config=Configure.VectorIndex.hnsw(
-                    distance_metric=VectorDistances.COSINE,
-                ),
-                properties=[
-                    Property(name="chunk_id", data_type=DataType.TEXT),
-                    Property(name="file_id", data_type=DataType.TEXT),
-                    Property(name="text", data_type=DataType.TEXT),
-                    Property(name="filename", data_type=DataType.TEXT),
-                    Property(name="file_directory", data_type=DataType.TEXT),
-                    Property(name="title", data_type=DataType.TEXT),
-                    Property(name="page", data_type=DataType.TEXT),
-                    Property(name="rights", data_type=DataType.TEXT)
-                ],
-            )
+            self.collection = self.client.collections.create(name=self.collection_name, **self.collection_config())
         else:
             self.collection = self.client.collections.get(self.collection_name)
 
+        self.documents = None
+        if self.hierarchical:
+            name = f"{self.collection_name}Documents"
+            if not self.client.collections.exists(name):
+                self.documents = self.client.collections.create(
+                    name=name,
+                    vector_index_config=self.index_config(self.index),
+                    properties=[
+                        Property(name="file_id", data_type=DataType.TEXT, tokenization=Tokenization.FIELD),
+                        Property(name="filename", data_type=DataType.TEXT),
+                        Property(name="file_directory", data_type=DataType.TEXT),
+                        Property(name="rights", data_type=DataType.TEXT),
+                        Property(name="chunks", data_type=DataType.INT)
+                    ]
+                )
+            else:
+                self.documents = self.client.collections.get(name)
+            self.field_document_ids = self.field_tokenized(self.documents, "file_id")
+        self.field_file_ids = self.field_tokenized(self.collection, "file_id")
+
+    @staticmethod
+    def field_tokenized(collection, prop: str) -> bool:
+        # collections created before file_id was field-tokenized keep the equal filters (file_ids_filter)
+        properties = collection.config.get().properties
+        return any(p.name == prop and p.tokenization == Tokenization.FIELD for p in properties)
+
     def delete_schema(self):
         self.client.collections.delete(self.collection_name)
+        if self.documents is not None:
+            self.client.collections.delete(self.documents.name)
+        bump_generation()
         color_print("Schema deleted.", color="yellow")
         
-    def document_exists(self, file_id: str) -> bool:
+    def existing_documents(self, file_ids: List[str]) -> Set[str]:
+        # one aggregation per FILTER_BATCH files
+        existing = set()
+        for batch in self.batches(file_ids):
+            counts = self.group_counts(self.collection, "file_id", filters=self.file_ids_filter(batch, self.field_file_ids), limit=len(batch))
+            existing.update(set(counts) & set(batch))
+        return existing
+
+    @classmethod
+    def batches(cls, file_ids: List[str]) -> List[List[str]]:
+        file_ids = list(dict.fromkeys(file_ids))
+        return [file_ids[i:i + cls.FILTER_BATCH] for i in range(0, len(file_ids), cls.FILTER_BATCH)]
+
+    # ----------------------------------------------------------------------------------------------------
+    # reduced embeddings (EMBEDDING_REDUCTION): the index holds the reduced vectors, the full vectors are kept
+    # in a memory-mapped side store (local_vector_store.LocalIndex) and rescore the candidates of a query
+
+    def open_full_vectors(self):
+        if self.embedding_model.reduction is None:
+            return None
+        from local_vector_store import LocalIndex
+        return LocalIndex.shared(os.path.join(os.getenv("FULL_VECTORS_PATH", "full_vectors"), self.collection_name))
+
+    def index_vectors(self, chunks: List[Chunk], embeddings: Optional[np.ndarray], batch_size: int = 0) -> np.ndarray:
+        # vectors written to the index, full vectors (embedded here or passed by the caller) go to the side store
+        if embeddings is None:
+            embeddings = self.embedding_model.embed([chunk.text for chunk in chunks], batch_size=batch_size, full=True)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.full_vectors is not None and embeddings.shape[1] != self.embedding_model.reduction.dimension:
+            self.full_vectors.insert(
+                objects=[{"file_id": chunk.file_id, "rights": chunk.rights} for chunk in chunks],
+                vectors=embeddings,
+                uuids=[self.chunk_uuid(chunk) for chunk in chunks]
+            )
+        return self.embedding_model.reduce(embeddings)
+
+    def delete_full_vectors(self, file_ids: List[str]):
+        if self.full_vectors is not None:
+            self.full_vectors.delete([row for file_id in set(file_ids) for row in self.full_vectors.rows_by_file.get(file_id, [])])
+
+    def query_vectors(self, query: str, vector: Optional[np.ndarray] = None) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        # (vector of the index, full vector of the rescoring), a reduced precomputed vector is not rescored
+        full = self.embedding_model.embed(query, full=True) if vector is None else np.asarray(vector, dtype=np.float32).reshape(1, -1)
+        reduced = self.embedding_model.reduce(full)
+        return reduced[0], (full[0] if full.shape[1] != reduced.shape[1] else None)
+
+    def rescore(self, candidates: Candidates, query_vector: np.ndarray) -> Candidates:
+        # the vector scores of the reduced index are replaced by the cosine similarities of the full vectors
+        if self.full_vectors is None or query_vector is None:
+            return candidates
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+        with self.full_vectors.lock:
+            rows = [self.full_vectors.rows.get(self.chunk_uuid(chunk)) for chunk in candidates.chunks]
+            rescored = [i for i, row in enumerate(rows) if row is not None and not np.isnan(candidates.vector_scores[i])]
+            if rescored:
+                candidates.vector_scores[rescored] = self.full_vectors.vectors[[rows[i] for i in rescored]] @ query_vector
+        return candidates
+
+    # ----------------------------------------------------------------------------------------------------
+    # hierarchical search: a document is the mean of its chunk vectors in the documents collection,
+    # a query selects DOCUMENTS_K documents and searches only their chunks
+
+    def refresh_documents(self, file_ids: List[str]):
+        # recomputed from the stored chunks (idempotent, a file inserted in several batches is complete)
+        if self.documents is None or not file_ids:
+            return
+        file_ids = list(dict.fromkeys(file_ids))
+        for i in range(0, len(file_ids), self.DOCUMENTS_BATCH):
+            self._refresh_documents(file_ids[i:i + self.DOCUMENTS_BATCH])
+
+    def _refresh_documents(self, file_ids: List[str]):
         response = self.collection.query.fetch_objects(
-            filters=Filter.by_property("file_id").equal(file_id),
-            limit=1
+            filters=self.file_ids_filter(file_ids, self.field_file_ids), include_vector=True, limit=self.DELETE_LIMIT
         )
-        return len(response.objects) > 0
+        objects = response.objects
+        if len(objects) == self.DELETE_LIMIT:
+            # above the query limit, one query per file
+            objects = [
+                obj for file_id in file_ids
+                for obj in self.collection.query.fetch_objects(
+                    filters=Filter.by_property("file_id").equal(file_id), include_vector=True, limit=self.DELETE_LIMIT
+                ).objects
+            ]
+
+        documents: Dict[str, dict] = {}
+        for obj in objects:
+            document = documents.setdefault(obj.properties["file_id"], {"properties": obj.properties, "vectors": []})
+            document["vectors"].append(obj.vector["default"])
+
+        document_objs = []
+        for file_id, document in documents.items():
+            vector = np.mean(np.asarray(document["vectors"], dtype=np.float32), axis=0)
+            properties = {key: document["properties"][key] for key in ["file_id", "filename", "file_directory", "rights"]}
+            document_objs.append(DataObject(
+                properties={**properties, "chunks": len(document["vectors"])},
+                vector=vector / (np.linalg.norm(vector) or 1.0),
+                uuid=generate_uuid5(file_id)
+            ))
+        if document_objs:
+            self.documents.data.insert_many(document_objs)
+
+    def rebuild_documents(self):
+        # document vectors of an existing collection
+        if self.documents is None:
+            return
+        file_ids = [obj.properties["file_id"] for obj in tqdm(self.collection.iterator(return_properties=["file_id"]), desc="Listing Files", unit="chunks")]
+        self.refresh_documents(file_ids)
+        bump_generation()
+
+    def delete_document_vectors(self, file_ids: List[str]):
+        if self.documents is not None and file_ids:
+            for batch in self.batches(file_ids):
+                self.documents.data.delete_many(where=self.file_ids_filter(batch, self.field_document_ids))
+
+    def search_filters(self, embedding: np.ndarray, rights: Optional[str]):
+        # rights filter of the chunk search, restricted to the selected documents in the hierarchical search
+        # (None = no documents were selected)
+        filters = Filter.by_property("rights").equal(rights) if rights else None
+        if self.documents is None:
+            return filters, True
 
+        response = self.documents.query.near_vector(near_vector=embedding, limit=self.DOCUMENTS_K, filters=filters)
+        file_ids = [obj.properties["file_id"] for obj in response.objects]
+        if not file_ids:
+            return None, False
+        documents = self.file_ids_filter(file_ids, self.field_file_ids)
+        return (documents & filters if filters else documents), True
+
+    # ----------------------------------------------------------------------------------------------------
     def insert_chunks(self, chunks: List[Chunk], embeddings: Optional[List[float]] = None):
-        if embeddings is None:
-            embeddings = self.embedding_model.embed([chunk.text for chunk in chunks])
+        embeddings = self.index_vectors(chunks, embeddings)
 
         for i, chunk in enumerate(tqdm(chunks, desc="One-by-One Insert", unit="chunk")):
-            self.collection.data.insert(properties=chunk.to_dict(), vector=embeddings[i])
+            self.collection.data.insert(properties=chunk.to_dict(), vector=embeddings[i], uuid=self.chunk_uuid(chunk))
+        self.refresh_documents([chunk.file_id for chunk in chunks])
+        bump_generation()
 
-    def insert_chunks_batch(self, chunks: List[Chunk], embeddings: Optional[List[float]] = None):
-        if embeddings is None:
-            embeddings = self.embedding_model.embed([chunk.text for chunk in chunks], batch_size=100)
+    def insert_chunks_batch(self, chunks: List[Chunk], embeddings: Optional[np.ndarray] = None, batch_writer: Optional[BatchWriter] = None) -> BatchReport:
+        if not chunks:
+            return BatchReport()
+        embeddings = self.index_vectors(chunks, embeddings, batch_size=100)
 
-        with self.collection.batch.dynamic() as batch:
-            for i, chunk in enumerate(tqdm(chunks, desc=f"Inserting Batches", unit="chunks")):
-                batch.add_object(properties=chunk.to_dict(), vector=embeddings[i])
+        batch_writer = batch_writer or BatchWriter(self.collection)
+        report = batch_writer.write(
+            objects=[chunk.to_dict() for chunk in chunks],
+            vectors=embeddings,
+            uuids=[self.chunk_uuid(chunk) for chunk in chunks]
+        )
+        self.refresh_documents([chunk.file_id for chunk in chunks])
+        bump_generation()
+        return report
 
-    def insert_many_chunks(self, chunks: List[Chunk], embeddings: Optional[List[float]] = None):
-        if embeddings is None:
-            embeddings = self.embedding_model.embed([chunk.text for chunk in chunks])
+    def insert_many_chunks(self, chunks: List[Chunk], embeddings: Optional[np.ndarray] = None):
+        # single request, fails on messages larger than the gRPC limit (insert_chunks_batch splits them)
+        embeddings = self.index_vectors(chunks, embeddings)
 
-        chunk_objs = [DataObject(properties=chunk.to_dict(), vector=embeddings[i]) for i, chunk in enumerate(chunks)]
-        self.collection.data.insert_many(chunk_objs)
+        chunk_objs = [DataObject(properties=chunk.to_dict(), vector=embeddings[i], uuid=self.chunk_uuid(chunk)) for i, chunk in enumerate(chunks)]
+        response = self.collection.data.insert_many(chunk_objs)
+        if response.has_errors:
+            color_print(f"{len(response.errors)} of {len(chunks)} chunks failed to insert.", color="red")
+        self.refresh_documents([chunk.file_id for chunk in chunks])
+        bump_generation()
         
-    def update_document(self, file_id: str, new_chunks: List[Chunk]):
-        if not self.document_exists(file_id):
-            color_print(f"File {file_id} not found in collection.", color="yellow")
-            return
+    @staticmethod
+    def file_ids_filter(file_ids: List[str], field_tokenized: bool = True):
+        # contains_any needs the field tokenization of file_id (a word-tokenized id matches other ids sharing its words),
+        # the legacy collections get one equal filter per file
+        if field_tokenized:
+            return Filter.by_property("file_id").contains_any(file_ids)
+        filters = [Filter.by_property("file_id").equal(file_id) for file_id in file_ids]
+        return filters[0] if len(filters) == 1 else Filter.any_of(filters)
 
-        # delete existing document
-        self.delete_document(file_id)
-        # insert new chunks
-        self.insert_many_chunks(new_chunks)
+    def delete_documents(self, file_ids: List[str], verbose: bool = True) -> DeleteReport:
+        # one filtered delete per FILTER_BATCH files, re-run only above the deletion limit
+        start = time.perf_counter()
+        batches = self.batches(file_ids)
+        report = DeleteReport(files=sum(len(batch) for batch in batches))
+        for batch in batches:
+            self._delete_where(self.collection, self.file_ids_filter(batch, self.field_file_ids), report)
+        if batches:
+            self.delete_full_vectors(file_ids)
+            self.delete_document_vectors(file_ids)
+            bump_generation()
+        report.seconds = time.perf_counter() - start
+        if verbose:
+            color_print(str(report), color="yellow")
+        return report
 
-    def delete_document(self, file_id: str):
+    def _delete_where(self, collection, filters, report: DeleteReport):
         # NOTE: There is a configurable maximum limit (QUERY_MAXIMUM_RESULTS) on the number of objects
         # that can be deleted in a single query (default 10,000). To delete more objects than the limit,
         # re-run the query.
-        deleted = False
-        while self.document_exists(file_id):
-            self.collection.data.delete_many(
-                where=Filter.by_property("file_id").equal(file_id)
+        while True:
+            result = collection.data.delete_many(where=filters)
+            report.requests += 1
+            report.matched += result.matches
+            report.deleted += result.successful
+            report.failed += result.failed
+            if result.matches < self.DELETE_LIMIT or not result.successful:
+                break
+
+    def rights_for(self, file_ids: List[str]) -> Dict[str, str]:
+        # rights of the stored files, one aggregation per FILTER_BATCH files (files that are not stored are missing in the result)
+        rights = {}
+        for batch in self.batches(file_ids):
+            response = self.collection.aggregate.over_all(
+                filters=self.file_ids_filter(batch, self.field_file_ids),
+                group_by=GroupByAggregate(prop="file_id", limit=len(batch)),
+                return_metrics=Metrics("rights").text(top_occurrences_value=True),
             )
-            deleted = True
-        
-        if deleted:
-            color_print(f"File {file_id} successfully deleted from collection.")
-        else:
-            color_print(f"File {file_id} not found in collection.", color="yellow")
-            
-    def get_rights(self, file_id: str) -> Optional[str]:
-        response = self.collection.query.fetch_objects(
-            filters=Filter.by_property("file_id").equal(file_id),
-            limit=1
-        )
-        if len(response.objects) == 0:
-            return None
-        return response.objects[0].properties["rights"]
+            requested = set(batch)
+            for group in response.groups:
+                file_id = group.grouped_by.value
+                if file_id not in requested:
+                    continue
+                top_occurrences = group.properties["rights"].top_occurrences
+                rights[file_id] = top_occurrences[0].value if top_occurrences else ""
+        return rights
 
     def close(self):
         if self.client:
             self.client.close()
+        super().close()
             
-    def get_all_filenames(self) -> List[str]:
-        filenames = []
-        for item in self.collection.iterator():
-            filename = item.properties["filename"]
-            if filename not in filenames:
-                filenames.append(filename)
-        
-        return filenames    
+    def file_counts(self) -> Dict[str, int]:
+        # server-side group-by, no objects are transferred
+        return self.group_counts(self.collection, "filename")
+
+    @classmethod
+    def group_counts(cls, collection, prop: str, filters=None, limit: Optional[int] = None) -> Dict[str, int]:
+        response = collection.aggregate.over_all(
+            filters=filters,
+            group_by=GroupByAggregate(prop=prop, limit=limit or cls.CATALOG_LIMIT),
+            total_count=True
+        )
+        return {group.grouped_by.value: group.total_count for group in response.groups}
         
-    def hybrid_search(self, query: str, rights: str = None, k: int = 5, alpha: float = 0.55, autocut: bool = False) -> List[Chunk]:
+    def hybrid_search(self, query: str, rights: str = None, k: int = 5, alpha: float = 0.55, autocut: bool = False, vector: Optional[np.ndarray] = None) -> List[Chunk]:
+        # identical searches of the same index generation are served by the query cache (query_cache.py),
+        # a precomputed vector has to be the embedding of the query
+        return query_cache.get_or_search(
+            self.cache_key("hybrid", query, rights, k, alpha, autocut),
+            lambda: self._hybrid_search(query, rights=rights, k=k, alpha=alpha, autocut=autocut, vector=vector)
+        )
+
+    def hybrid_search_lean(self, query: str, rights: str = None, k: int = 5, alpha: float = 0.55, autocut: bool = False, explain: bool = False) -> List[Chunk]:
+        return query_cache.get_or_search(
+            self.cache_key("lean_explain" if explain else "lean", query, rights, k, alpha, autocut),
+            lambda: self._hybrid_search_lean(query, rights=rights, k=k, alpha=alpha, autocut=autocut, explain=explain)
+        )
+
+    def cache_key(self, mode: str, *params) -> tuple:
+        return (self.collection_name, self.hierarchical, mode, *params)
+
+    def _hybrid_search(self, query: str, rights: str = None, k: int = 5, alpha: float = 0.55, autocut: bool = False, vector: Optional[np.ndarray] = None) -> List[Chunk]:
         assert 0 <= alpha <= 1, "Alpha must be between 0 and 1."
+        if self.full_vectors is not None:
+            # fusion of the rescored candidates on the client
+            return fusion.hybrid_from_candidates(self.fetch_candidates(query, rights, vector=vector), alpha=alpha, k=k, autocut=autocut)
         
-        embedding = self.embedding_model.embed(query)[0]
+        embedding = self.query_embedding(query, vector)
+        filters, selected = self.search_filters(embedding, rights)
+        if not selected:
+            return []
         response = self.collection.query.hybrid(
             query=query,
             vector=embedding,
@@ -165,10 +609,92 @@ class VectorStore():
             return_metadata=MetadataQuery(score=True, explain_score=True),
             limit = k if not autocut else None,
             auto_limit= k if autocut else None,
-            filters=Filter.by_property("rights").equal(rights) if rights else None
+            filters=filters
         )
         chunks = self.get_chunks_from_objs(response.objects)
         return chunks
+
+    def _hybrid_search_lean(self, query: str, rights: str = None, k: int = 5, alpha: float = 0.55, autocut: bool = False, explain: bool = False) -> List[Chunk]:
+        if self.full_vectors is not None:
+            # the candidates carry all properties already (hydrate skips them)
+            return self._hybrid_search(query, rights=rights, k=k, alpha=alpha, autocut=autocut)
+
+        embedding = self.embedding_model.embed(query)[0]
+        filters, selected = self.search_filters(embedding, rights)
+        if not selected:
+            return []
+        response = self.collection.query.hybrid(
+            query=query,
+            vector=embedding,
+            alpha=alpha,
+            fusion_type=HybridFusion.RELATIVE_SCORE,
+            return_metadata=MetadataQuery(score=True, explain_score=explain),
+            return_properties=self.LEAN_PROPERTIES,
+            limit = k if not autocut else None,
+            auto_limit= k if autocut else None,
+            filters=filters
+        )
+        return self.get_lean_chunks_from_objs(response.objects, explain)
+
+    def hydrate(self, chunks: List[Chunk]) -> List[Chunk]:
+        # one fetch by the object ids (chunk_uuid) of the lean chunks, objects with other ids by their chunk_id
+        missing = [chunk for chunk in chunks if not chunk.file_id]
+        if missing:
+            self.fill_metadata(self.collection, missing)
+        return chunks
+
+    @classmethod
+    def fill_metadata(cls, collection, chunks: List[Chunk]):
+        response = collection.query.fetch_objects(
+            filters=Filter.by_id().contains_any([cls.chunk_uuid(chunk) for chunk in chunks]),
+            limit=len(chunks)
+        )
+        cls.set_properties(chunks, response.objects)
+
+        # objects inserted before the ids were derived from chunk_id have random ids, they are fetched by
+        # the chunk_id property (word-tokenized, it also matches ids sharing its words, kept are exact matches)
+        unresolved = [chunk for chunk in chunks if not chunk.file_id]
+        if unresolved:
+            response = collection.query.fetch_objects(
+                filters=Filter.any_of([Filter.by_property("chunk_id").equal(chunk.chunk_id) for chunk in unresolved]),
+                limit=len(unresolved) * cls.CHUNK_ID_MATCHES
+            )
+            cls.set_properties(unresolved, response.objects)
+
+    @staticmethod
+    def set_properties(chunks: List[Chunk], objects):
+        properties = {obj.properties["chunk_id"]: obj.properties for obj in objects}
+        for chunk in chunks:
+            for name, value in properties.get(chunk.chunk_id, {}).items():
+                setattr(chunk, name, value)
+
+    def fetch_candidates(self, query: str, rights: str = None, limit: int = BaseVectorStore.CANDIDATES, vector: Optional[np.ndarray] = None) -> Candidates:
+        embedding, full = self.query_vectors(query, vector)
+        filters, selected = self.search_filters(embedding, rights)
+        if not selected:
+            return Candidates.from_result_sets(keyword=[], vector=[])
+        keyword, vector = self.result_sets(self.collection, query, embedding, limit, filters)
+        return self.rescore(Candidates.from_result_sets(keyword=keyword, vector=vector), full)
+
+    @staticmethod
+    def result_sets(collection, query: str, embedding: np.ndarray, limit: int, filters=None) -> Tuple[list, list]:
+        # (chunk, raw score) of the bm25 and the vector search, the vector score is the cosine similarity
+        keyword = collection.query.bm25(
+            query=query,
+            limit=limit,
+            filters=filters,
+            return_metadata=MetadataQuery(score=True)
+        )
+        vector = collection.query.near_vector(
+            near_vector=embedding,
+            limit=limit,
+            filters=filters,
+            return_metadata=MetadataQuery(distance=True)
+        )
+        return (
+            [(Chunk(**obj.properties), obj.metadata.score) for obj in keyword.objects],
+            [(Chunk(**obj.properties), 1 - obj.metadata.distance) for obj in vector.objects]
+        )
     
     @staticmethod
     def get_chunks_from_objs(objects) -> List[Chunk]:
@@ -188,15 +714,34 @@ class VectorStore():
             )
             chunks.append(chunk)
         return chunks
-    
+
     @staticmethod
-    def format_explain_score(explain_score: str) -> str:
-        pattern = re.compile(r"normalized score: ([\d.]+)")
-        matches = pattern.findall(explain_score)
+    def get_lean_chunks_from_objs(objects, explain: bool = False) -> List[Chunk]:
+        # explain scores are parsed only when they were requested
+        return [
+            Chunk(
+                chunk_id=obj.properties["chunk_id"],
+                text=obj.properties["text"],
+                score=obj.metadata.score,
+                explain_score=VectorStore.format_explain_score(obj.metadata.explain_score) if explain else ""
+            )
+            for obj in objects
+        ]
 
-        if len(matches) == 1:
-            return f"vector: {float(matches[0]):.2f}"
-        elif len(matches) == 2:
-            return f"keyword: {float(matches[0]):.2f} | vector: {float(matches[1]):.2f}"        
+
+class VectorStoreFactory:
+    @staticmethod
+    def get_store(store_type: Optional[str] = None, **kwargs) -> BaseVectorStore:
+        # VECTOR_STORE=local runs without the Weaviate service (tests, evaluation, small deployments),
+        # VECTOR_STORE=tenants partitions the Weaviate collection by rights
+        store_type = (store_type or os.getenv("VECTOR_STORE", "weaviate")).lower()
+        if store_type == "weaviate":
+            return VectorStore(**kwargs)
+        elif store_type == "tenants":
+            from tenant_vector_store import TenantVectorStore
+            return TenantVectorStore(**kwargs)
+        elif store_type == "local":
+            from local_vector_store import LocalVectorStore
+            return LocalVectorStore(**kwargs)
         else:
-            return explain_score
+            raise ValueError(f"Unknown store_type '{store_type}'")